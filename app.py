@@ -1,19 +1,32 @@
 # --- 1. IMPORTAÇÃO DAS BIBLIOTECAS ---
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-import io
+import tempfile
+import time
 from datetime import datetime
 import os
 import locale
 import base64
+import uuid
 from weasyprint import HTML, CSS
-from openpyxl import load_workbook
+from core.cache import DatasetCache, dataset_cache_key, hash_bytes
+from core.charts import LEVEL_LABELS, MAX_BARS, OTHERS_LABEL, category_figure, evolution_figure, figure_marks, pdf_layout, performance_figure, performance_rollup, report_figures, requester_figure, specialty_figure, top_n_with_others, with_regions
+from core.exports import EXCEL_MAX_ROWS, EXCEL_MIME, EXPORT_FORMATS, export_bytes
+from core.incremental import TeleconsultaStore
+from core.model import filter_options
+from core.profiling import Profiler, ProfileLog, summarize
+from core.pipeline import Dataset, Selection, apply_filters, build_engines, category_distribution, compute_flow, compute_kpis, compute_performance, load_upload, monthly_evolution, prepare, requester_distribution, response_time_summary, specialty_distribution
+from core.reference import load_reference_data, reference_signature
+from core.rendering import ChartRenderer
+from core.reports import DETAIL_COLUMNS, SUMMARY_COLUMNS, dashboard_report_html, to_excel_report_bytes, write_reports_zip
+from core.sketches import RELATIVE_ERROR, SLA_COLUMN, SLA_HOURS, SUMMARY_QUANTILES
+from core.tables import PAGE_SIZES, PERFORMANCE_CSS, paginate, performance_class
 
 # --- 2. CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(layout="wide", page_title="Dashboard de Teleconsultorias")
 st.title("Dashboard de Gestão e Análise de Teleconsultorias")
+# Execuções completas do app.py nesta sessão; reexecuções de fragmentos não passam por aqui.
+st.session_state['execucoes_app'] = st.session_state.get('execucoes_app', 0) + 1
 
 # Definir locale para formatação de números em português
 try:
@@ -23,136 +36,440 @@ except locale.Error:
     locale.setlocale(locale.LC_ALL, '')
 
 # --- 3. FUNÇÕES AUXILIARES ---
-@st.cache_data
 def load_excel_upload(uploaded_file):
     """Lê um arquivo Excel a partir de um upload, tratando .xls e .xlsx."""
     try:
-        file_name = uploaded_file.name
-        if file_name.endswith('.xlsx'):
-            buffer = io.BytesIO(uploaded_file.getvalue())
-            workbook = load_workbook(buffer)
-            cleaned_buffer = io.BytesIO()
-            workbook.save(cleaned_buffer)
-            cleaned_buffer.seek(0)
-            df = pd.read_excel(cleaned_buffer, engine='openpyxl')
-            return df
-        elif file_name.endswith('.xls'):
-            df = pd.read_excel(uploaded_file, engine='xlrd')
-            return df
-        else:
-            st.error("Formato de arquivo não suportado. Por favor, use .xls ou .xlsx.")
-            return None
+        return load_upload(uploaded_file.getvalue(), uploaded_file.name)
+    except ValueError as e:
+        st.error(str(e))
+        return None, None
     except Exception as e:
         st.error(f"Erro ao ler arquivo Excel do upload: {e}")
-        return None
-
-@st.cache_data
-def load_local_data(path):
-    if not os.path.exists(path): st.error(f"ERRO: Arquivo '{path}' não encontrado."); return None
-    try: return pd.read_excel(path)
-    except Exception as e: st.error(f"Erro ao ler arquivo local '{path}': {e}"); return None
-
-def find_existing(col_list, df_cols):
-    for candidate in col_list:
-        for c in df_cols:
-            if str(c).strip().lower() == str(candidate).strip().lower(): return c
-    return None
-
-def get_filter_options(df, col):
-    if col in df.columns: return sorted(df[col].dropna().unique())
-    return []
-
-def to_excel_bytes_generic(df_export):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df_export.to_excel(writer, index=False, sheet_name='Dados Filtrados')
-    return output.getvalue()
-
-def to_excel_report_bytes(df_summary, df_details):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df_summary.to_excel(writer, index=False, sheet_name='Resumo_Performance')
-        df_details.to_excel(writer, index=False, sheet_name='Detalhes_Consultorias')
-        for sheet_name, df_sheet in [('Resumo_Performance', df_summary), ('Detalhes_Consultorias', df_details)]:
-            worksheet = writer.sheets[sheet_name]
-            for idx, col in enumerate(df_sheet.columns):
-                series = df_sheet[col]
-                if not series.empty:
-                    max_len = max(series.astype(str).map(len).max(), len(str(col))) + 2
-                    worksheet.set_column(idx, idx, max_len)
-    return output.getvalue()
+        return None, None
+
+@st.cache_resource(show_spinner="Carregando planilhas de referência...")
+def get_reference_data(source_signature):
+    """Snapshot das referências, compartilhado pelo processo; source_signature muda quando algum .xlsx muda."""
+    return load_reference_data(BASE_DIR, os.path.join(CACHE_DIR, 'referencias'))
+
+@st.cache_resource
+def get_dataset_cache():
+    max_bytes = int(os.environ.get('DASHBOARD_CACHE_MAX_MB', '1024')) * 2**20
+    return DatasetCache(os.path.join(CACHE_DIR, 'datasets'), max_bytes)
+
+# Datasets em cache_resource: uma única instância por processo, somente leitura, serve a todas as
+# sessões (o cache_data entregaria uma cópia desserializada a cada sessão).
+@st.cache_resource(max_entries=4, show_spinner=False)
+def shared_dataset(dataset_key):
+    """Dataset do cache em disco (memory-map) para dataset_key; KeyError se não estiver lá.
+
+    Só o que foi gravado no cache em disco entra aqui: falhas levantam exceção, que o
+    st.cache_resource não guarda, e a leitura do upload fica com quem chama.
+    """
+    frames = get_dataset_cache().get(dataset_key)
+    if frames is None:
+        raise KeyError(dataset_key)
+    return Dataset.from_frames(frames)
+
+def load_prepared_dataset(dataset_key, uploaded_file, refs):
+    """Retorna (Dataset, mensagem de origem), ou (None, None) se o upload não puder ser lido.
+
+    Lê do cache em disco quando possível; senão lê e prepara o upload, grava no cache
+    e passa a usar a instância compartilhada. Se a gravação falhar, o dataset fica só
+    nesta sessão, para não reler o arquivo a cada interação.
+    """
+    start = time.perf_counter()
+    try:
+        return shared_dataset(dataset_key), f"Dados carregados do cache local em {time.perf_counter() - start:.2f} s."
+    except KeyError:
+        pass
+    sem_cache = st.session_state.get('dataset_sem_cache')
+    if sem_cache is not None and sem_cache[0] == dataset_key:
+        return sem_cache[1], sem_cache[2]
+    with st.spinner("Preparando os dados..."):
+        secao = start_section("Leitura do upload")
+        df_upload, ingest_stats = load_excel_upload(uploaded_file)
+        if df_upload is None:
+            return None, None
+        end_section(secao, len(df_upload))
+        secao = start_section("Preparação", len(df_upload))
+        dataset = prepare(df_upload, refs)
+        end_section(secao, len(dataset.teleconsultorias))
+    message = f"Arquivo lido em {ingest_stats.parse_seconds:.2f} s ({format_number(ingest_stats.rows)} linhas, memória da leitura {ingest_stats.memory_mb:.0f} MB ({ingest_stats.memory_source}), leitor {ingest_stats.engine})."
+    try:
+        get_dataset_cache().put(dataset_key, dataset.frames())
+        # Relido do disco para que as sessões usem as páginas mapeadas, e não a cópia recém-preparada.
+        return shared_dataset(dataset_key), message
+    except Exception as e:
+        motivo = "os dados passam do limite do cache (DASHBOARD_CACHE_MAX_MB)" if isinstance(e, KeyError) else e
+        st.warning(f"Não foi possível gravar o cache local dos dados: {motivo}")
+        st.session_state['dataset_sem_cache'] = (dataset_key, dataset, message)
+        return dataset, message
+
+@st.cache_resource
+def get_teleconsulta_store():
+    return TeleconsultaStore(os.path.join(CACHE_DIR, 'historico'))
+
+@st.cache_resource(max_entries=2, show_spinner="Carregando o histórico local...")
+def load_history(dataset_key):
+    """Retorna (Dataset, mensagem de origem) do histórico incremental; dataset_key muda a cada versão."""
+    start = time.perf_counter()
+    dataset = Dataset.from_frames(get_teleconsulta_store().load())
+    return dataset, f"Histórico local carregado em {time.perf_counter() - start:.2f} s ({format_number(len(dataset.teleconsultorias))} linhas)."
+
+@st.cache_resource(show_spinner=False)
+def get_chart_renderer():
+    """Processos kaleido aquecidos e cache de PNGs, compartilhados por todas as sessões."""
+    workers = int(os.environ.get('DASHBOARD_PDF_WORKERS', '0')) or None
+    renderer = ChartRenderer(os.path.join(CACHE_DIR, 'graficos'), workers=workers)
+    renderer.warm()
+    return renderer
+
+def show_chart(stats, name, fig, **kwargs):
+    """st.plotly_chart registrando em stats as marcas e o tempo da chamada; o tamanho do JSON da figura só para administradores.
+
+    Serializar a figura de novo só para medir dobraria o custo de cada gráfico, então fica fora da execução normal.
+    """
+    render_start = time.perf_counter()
+    event = st.plotly_chart(fig, use_container_width=True, **kwargs)
+    entry = {'Gráfico': name, 'Marcas': figure_marks(fig), 'Tempo (ms)': round((time.perf_counter() - render_start) * 1000, 1)}
+    if is_admin():
+        entry['JSON (KB)'] = round(len(fig.to_json()) / 1024, 1)
+    stats.append(entry)
+    return event
+
+def paginated_table(key, df, signature, style=None, search_columns=None, column_order=None, rows=None, columns=None):
+    """Tabela paginada no servidor: busca, ordenação e página saem do core.tables e só a página vai ao navegador.
+
+    Com rows (posições em df) e columns, a tabela é uma visão do dataset compartilhado, sem cópia.
+    """
+    visible = column_order or columns or list(df.columns)
+    col_busca, col_ordem, col_sentido, col_tamanho = st.columns([3, 2, 1, 1])
+    busca = col_busca.text_input("Buscar", key=f"{key}_busca", placeholder="Texto em qualquer coluna")
+    ordem = col_ordem.selectbox("Ordenar por", ["Ordem original", *visible], key=f"{key}_ordem")
+    tamanho = col_tamanho.selectbox("Linhas por página", PAGE_SIZES, index=1, key=f"{key}_tamanho")
+    with col_sentido:
+        decrescente = st.toggle("Decrescente", key=f"{key}_desc")
+    # Volta para a primeira página quando os dados, a busca ou a ordenação mudam.
+    estado = (signature, busca, ordem, decrescente, tamanho)
+    if st.session_state.get(f"{key}_estado") != estado or f"{key}_pagina" not in st.session_state:
+        st.session_state[f"{key}_estado"] = estado
+        st.session_state[f"{key}_pagina"] = 1
+    page = paginate(df, st.session_state[f"{key}_pagina"], tamanho, None if ordem == "Ordem original" else ordem, not decrescente, busca.strip(), search_columns or columns, rows, columns)
+    st.session_state[f"{key}_pagina"] = page.page
+    st.dataframe(style(page.rows) if style else page.rows, use_container_width=True, column_order=column_order)
+    col_info, col_pagina = st.columns([3, 1])
+    with col_pagina:
+        st.number_input("Página", min_value=1, max_value=page.pages, key=f"{key}_pagina")
+    primeira = (page.page - 1) * tamanho + 1 if page.total else 0
+    col_info.caption(f"Linhas {format_number(primeira)} a {format_number(min(page.page * tamanho, page.total))} de {format_number(page.total)} · página {page.page} de {page.pages}")
+    return page
+
+def style_performance_page(rows):
+    """Cores do Percentual Atingido a partir da coluna Faixa, já calculada para a tabela inteira."""
+    styles = pd.DataFrame('', index=rows.index, columns=rows.columns)
+    styles['Percentual Atingido'] = rows['Faixa'].map(PERFORMANCE_CSS).fillna('')
+    return rows.style.apply(lambda _: styles, axis=None).format({'Percentual Atingido': '{:.1f}%', 'CotaMensal_Estabelecimento': '{:.2f}'})
+
+@st.cache_resource
+def get_profile_log():
+    """Log JSON lines das seções, compartilhado pelas sessões; DASHBOARD_PROFILE_LOG vazio desliga o log."""
+    path = os.environ.get('DASHBOARD_PROFILE_LOG', os.path.join(CACHE_DIR, 'perfil', 'secoes.jsonl'))
+    return ProfileLog(path) if path else None
+
+def get_profiler():
+    if 'perfil' not in st.session_state:
+        st.session_state['perfil'] = Profiler(uuid.uuid4().hex[:12], get_profile_log())
+    return st.session_state['perfil']
+
+def start_section(name, rows_in=None):
+    return get_profiler().start(name, rows_in)
+
+def end_section(section, rows_out=None, fragment=False):
+    """Fecha a seção: guarda tempo, linhas e memória na sessão e no log."""
+    return get_profiler().stop(section, rows_out, st.session_state.get('linhas_dataset'), st.session_state.get('execucoes_app', 0), fragment)
+
+def is_admin():
+    """Painel de desempenho só para quem abre o app com ?admin=<DASHBOARD_ADMIN_TOKEN>."""
+    token = os.environ.get('DASHBOARD_ADMIN_TOKEN')
+    return bool(token) and st.query_params.get('admin') == token
+
+def section_caption(name):
+    if not is_admin():
+        return
+    profiler = get_profiler()
+    record = profiler.records[name]
+    st.caption(f"Seção recalculada em {record.segundos * 1000:.0f} ms ({record.delta_memoria_mb:+.1f} MB) · {profiler.counts[name]} execuções desta seção e {st.session_state['execucoes_app']} do app completo nesta sessão.")
+
+def lazy_download(key, signature, build, button_label, label, file_name, mime):
+    """Gera o arquivo só quando o botão é clicado e o mantém na sessão enquanto signature não mudar."""
+    if st.button(button_label, key=f"{key}_gerar"):
+        build_start = time.perf_counter()
+        try:
+            with st.spinner("Gerando o arquivo..."):
+                st.session_state[key] = (signature, build(), time.perf_counter() - build_start)
+        except Exception as e:
+            st.error(f"Ocorreu um erro ao gerar o arquivo: {e}")
+    generated = st.session_state.get(key)
+    if generated is not None and generated[0] == signature:
+        _, data, seconds = generated
+        st.download_button(label=label, data=data, file_name=file_name, mime=mime, key=f"{key}_baixar", use_container_width=True)
+        st.caption(f"Arquivo de {len(data) / 2**20:.2f} MB gerado em {seconds:.1f} s.")
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def get_engines(dataset_key, _dataset):
+    return build_engines(_dataset)
 
 def format_number(n):
     if pd.isna(n): return 'N/D'
     try: return locale.format_string("%d", int(n), grouping=True)
     except (ValueError, TypeError): return str(n)
 
-# --- 4. CARREGAMENTO E PREPARAÇÃO DOS DADOS ---
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-df_condicoes_raw = load_local_data(os.path.join(BASE_DIR, 'condicoes.xlsx'))
-df_estabelecimentos_raw = load_local_data(os.path.join(BASE_DIR, 'estabelecimentos.xlsx'))
-df_categoria_raw = load_local_data(os.path.join(BASE_DIR, 'categoria.xlsx'))
+def evolution_data(view, start, end):
+    """Evolução mensal da visão filtrada no período, ou None se não houver teleconsultorias."""
+    agg_evolucao = view.aggregates_for(start, end)
+    return monthly_evolution(agg_evolucao, start, end) if agg_evolucao.total() > 0 else None
+
+def evolution_dates(start_default, end_default):
+    """Período escolhido na seção de evolução (o padrão enquanto a seção não foi desenhada)."""
+    return pd.to_datetime(st.session_state.get('start_date_evol', start_default)), pd.to_datetime(st.session_state.get('end_date_evol', end_default))
+
+def render_pdf_images(renderer, figures):
+    """Converte as figuras do relatório em PNG (base64) pelo ChartRenderer, com progresso por gráfico."""
+    pdf_figs = pdf_layout(figures)
+    images = {}
+    progress = st.progress(0.0, text="Renderizando os gráficos...")
+    for done, (title, png, error, cached) in enumerate(renderer.render(pdf_figs, width=800, height=450), start=1):
+        if error is not None:
+            st.warning(f"Não foi possível converter um gráfico para o PDF. Erro: {error}")
+        else:
+            images[title] = base64.b64encode(png).decode()
+        progress.progress(done / len(pdf_figs), text=f"Gráfico {done} de {len(pdf_figs)} pronto: {title}{' (cache)' if cached else ''}")
+    progress.empty()
+    return images
+
+# Seções em fragmentos: cada uma depende só dos argumentos e dos próprios widgets, e uma
+# interação dentro dela reexecuta apenas o fragmento, não o app.py inteiro.
+@st.fragment
+def evolution_section(view, start_default, end_default, chart_stats):
+    secao = start_section("Evolução mensal", view.n_rows)
+    st.subheader("Evolução Mensal das Teleconsultorias")
+    col_evol_1, col_evol_2 = st.columns(2)
+    with col_evol_1:
+        start_date_evol = st.date_input("Data de Início da Evolução", value=start_default, min_value=start_default, max_value=end_default, key="start_date_evol")
+    with col_evol_2:
+        end_date_evol = st.date_input("Data de Fim da Evolução", value=end_default, min_value=start_date_evol, max_value=end_default, key="end_date_evol")
+    start_date_evol_dt = pd.to_datetime(start_date_evol)
+    end_date_evol_dt = pd.to_datetime(end_date_evol)
+    df_ts = evolution_data(view, start_date_evol_dt, end_date_evol_dt)
+    if df_ts is not None:
+        show_chart(chart_stats, "Evolução Mensal", evolution_figure(df_ts))
+    else:
+        st.info("Sem dados de evolução para o período e filtros selecionados.")
+    end_section(secao, len(df_ts) if df_ts is not None else 0, fragment=True)
+    section_caption("Evolução mensal")
+
+@st.fragment
+def response_time_section(view, start_date_dt, end_date_dt):
+    secao = start_section("Tempo de resposta", view.n_rows)
+    linhas_tabela = 0
+    st.subheader(f"Tempo de Resposta e Prazo de {SLA_HOURS}h")
+    df_total, fonte = response_time_summary(view, start_date_dt, end_date_dt)
+    if df_total.empty:
+        st.info("Sem teleconsultorias respondidas no período e filtros selecionados.")
+    else:
+        total = df_total.iloc[0]
+        col_p50, col_p90, col_p95, col_prazo = st.columns(4)
+        col_p50.metric("Mediana (horas)", f"{total['P50 (h)']:.1f}")
+        col_p90.metric("P90 (horas)", f"{total['P90 (h)']:.1f}")
+        col_p95.metric("P95 (horas)", f"{total['P95 (h)']:.1f}")
+        col_prazo.metric(f"Respondidas em até {SLA_HOURS}h", f"{total[SLA_COLUMN]:.1f}%")
+        grupos = {'Especialidade': 'Especialidade', 'Especialista': 'NomeEspecialista', 'Município': 'Municipio Solicitante'}
+        grupos = {label: col for label, col in grupos.items() if col in view.dataset.teleconsultorias.columns}
+        agrupar = st.radio("Agrupar por", list(grupos), horizontal=True, key="tempo_resposta_grupo")
+        df_grupos, fonte = response_time_summary(view, start_date_dt, end_date_dt, grupos[agrupar])
+        linhas_tabela = len(df_grupos)
+        st.dataframe(df_grupos.rename(columns={grupos[agrupar]: agrupar}), use_container_width=True, hide_index=True,
+                     column_config={col: st.column_config.NumberColumn(format="%.1f") for col in [*SUMMARY_QUANTILES, SLA_COLUMN]})
+        origem = "dos sketches pré-agregados por dia, município e especialidade" if fonte == 'sketches' else "das linhas filtradas (filtro ou agrupamento fora dos sketches)"
+        st.caption(f"Percentis estimados com erro relativo de no máximo {RELATIVE_ERROR:.0%} a partir {origem}; respostas em até 1 minuto contam como 0 h. O percentual em até {SLA_HOURS}h é exato.")
+    end_section(secao, linhas_tabela, fragment=True)
+    section_caption("Tempo de resposta")
+
+@st.fragment
+def performance_table_section(df_tabela_perf, selection_signature):
+    secao = start_section("Tabela de performance", len(df_tabela_perf))
+    cols_perf = list(df_tabela_perf.columns)
+    page = paginated_table("tabela_performance", df_tabela_perf.assign(Faixa=performance_class(df_tabela_perf['Percentual Atingido'])), selection_signature,
+                    style=style_performance_page, search_columns=['Municipio Solicitante', 'Estabelecimento'], column_order=cols_perf)
+    end_section(secao, len(page.rows), fragment=True)
+    section_caption("Tabela de performance")
+
+@st.fragment
+def municipal_report_section(view, df_performance, selection_signature, start_date_dt, end_date_dt):
+    secao = start_section("Relatórios por município", view.n_rows)
+    linhas_relatorio = 0
+    st.subheader("Gerador de Relatórios por Município")
+    municipios_disponiveis = filter_options(view.dataset.teleconsultorias, 'Municipio Solicitante', view.positions)
+    if not municipios_disponiveis:
+        st.info("Nenhum município com dados no período selecionado para gerar relatório.")
+    else:
+        municipio_relatorio = st.selectbox("Selecione um município para o relatório detalhado:", options=municipios_disponiveis, index=None, placeholder="Escolha um município")
+        if municipio_relatorio:
+            df_sumario_relatorio = df_performance[df_performance['Municipio Solicitante'] == municipio_relatorio].copy()
+            df_detalhes_relatorio = view.frame(DETAIL_COLUMNS, view.positions_for('Municipio Solicitante', [municipio_relatorio]))
+            cols_summary = [col for col in SUMMARY_COLUMNS if col in df_sumario_relatorio.columns]
+            df_sumario_relatorio = df_sumario_relatorio[cols_summary]
+            linhas_relatorio = len(df_detalhes_relatorio)
+            lazy_download("relatorio_municipio", (selection_signature, municipio_relatorio), lambda: to_excel_report_bytes(df_sumario_relatorio, df_detalhes_relatorio),
+                          f"Gerar Relatório de {municipio_relatorio}", f"📥 Download Relatório de {municipio_relatorio}", f"Relatorio_{municipio_relatorio.replace(' ', '_')}.xlsx", EXCEL_MIME)
+
+        with st.expander(f"Relatórios de todos os {len(municipios_disponiveis)} municípios em um ZIP"):
+            incluir_pdf = st.checkbox("Incluir também um PDF resumido por município", value=False)
+            if st.button("Gerar ZIP com todos os municípios"):
+                progress_zip = st.progress(0.0, text="Gerando os relatórios...")
+                def update_zip_progress(done, total, municipio):
+                    progress_zip.progress(done / total, text=f"{done} de {total} municípios: {municipio}")
+                zip_start = time.perf_counter()
+                zip_file = tempfile.TemporaryFile()  # em disco: os relatórios não ficam todos na memória
+                workers = int(os.environ.get('DASHBOARD_REPORT_WORKERS', '0')) or None
+                periodo_zip = f"{start_date_dt.strftime('%d/%m/%Y')} a {end_date_dt.strftime('%d/%m/%Y')}"
+                try:
+                    total_zip = write_reports_zip(zip_file, df_performance, view.frame(DETAIL_COLUMNS), periodo=periodo_zip, include_pdf=incluir_pdf, workers=workers, progress=update_zip_progress)
+                    zip_file.seek(0)
+                    st.caption(f"{total_zip} municípios processados em {time.perf_counter() - zip_start:.1f} s.")
+                    st.download_button(label="📥 Download dos Relatórios (ZIP)", data=zip_file.read(), file_name=f"Relatorios_Municipios_{start_date_dt.strftime('%Y%m%d')}_{end_date_dt.strftime('%Y%m%d')}.zip", mime="application/zip", use_container_width=True)
+                except Exception as e:
+                    st.error(f"Ocorreu um erro ao gerar os relatórios em lote: {e}")
+    end_section(secao, linhas_relatorio, fragment=True)
+    section_caption("Relatórios por município")
+
+@st.fragment
+def detail_section(view, selection_signature):
+    secao = start_section("Detalhamento geral", view.n_rows)
+    linhas_pagina = 0
+    st.subheader("Detalhamento Geral das Teleconsultorias Filtradas")
+    df = view.dataset.teleconsultorias
+    cols_show = [col for col in ['Data_Solicitacao', 'Municipio Solicitante', 'Estabelecimento', 'Especialidade', 'SolicitanteNome', 'Categoria Profissional', 'Situação', 'Monitor'] if col in df.columns]
+    if view.n_rows:
+        linhas_pagina = len(paginated_table("detalhe_geral", df, selection_signature, rows=view.positions, columns=cols_show).rows)
+        formatos = list(EXPORT_FORMATS) if view.n_rows <= EXCEL_MAX_ROWS else list(EXPORT_FORMATS)[1:]
+        formato = st.radio("Formato do arquivo", formatos, horizontal=True, help="CSV e Parquet são gerados bem mais rápido que o Excel em extrações grandes.")
+        extensao, mime = EXPORT_FORMATS[formato]
+        lazy_download("dados_filtrados", (selection_signature, extensao), lambda: export_bytes(view.frame(cols_show), extensao, sheet_name='Dados Filtrados'),
+                      "Gerar arquivo dos Dados Filtrados", "📥 Download dos Dados Filtrados (Geral)", f"Relatorio_Geral_Teleconsultorias.{extensao}", mime)
+    end_section(secao, linhas_pagina, fragment=True)
+    section_caption("Detalhamento geral")
+
+@st.fragment
+def pdf_section(view, kpis, flow, df_performance, df_tabela_perf, df_especialidade_tabela, figures, cat_count, solicitante_count, start_default, end_default, start_date_dt, end_date_dt):
+    """Só o clique no botão gera o PDF; a evolução entra com as datas escolhidas na sua seção."""
+    secao = start_section("Exportação PDF", view.n_rows)
+    # Obtido ao desenhar a seção, não no clique, para o kaleido aquecer enquanto o usuário navega.
+    renderer = get_chart_renderer()
+    for error in renderer.warm_errors():
+        st.warning(f"Falha ao pré-aquecer o conversor de gráficos do PDF; o primeiro relatório pode demorar mais. Erro: {error}")
+    if st.button("Gerar Relatório PDF"):
+        if not view.n_rows:
+            st.warning("Não há dados filtrados para gerar o relatório PDF.")
+        else:
+            try:
+                with st.spinner("Gerando seu relatório PDF, por favor aguarde..."):
+                    observacao_fluxo_pdf = ""
+                    casos_ubs, total_encaminhados, perc_ubs, perc_enc = (flow.casos_ubs, flow.encaminhados, flow.percentual_ubs, flow.percentual_encaminhados) if flow else (0, 0, 0.0, 0.0)
+                    evitados, perc_evitados = (flow.evitados, flow.percentual_evitados) if flow and flow.evitados is not None else (0, 0.0)
+                    if flow and flow.intencao_encaminhar > 0:
+                        observacao_fluxo_pdf = (f"<b>Observação:</b> De um total de {format_number(flow.intencao_encaminhar)} solicitações com intenção de encaminhamento, " f"{format_number(total_encaminhados)} foram efetivamente encaminhadas, " f"resultando em <b>{format_number(evitados)} encaminhamentos evitados</b>.")
+                    
+                    kpis_for_pdf_rows = [
+                        {"Total de Consultorias": format_number(kpis.total), "Média Resp. (h)": f"{kpis.media_resposta:.1f}" if kpis.media_resposta is not None else "N/D", "Concluídas": f"{format_number(kpis.concluidas)} ({kpis.percentual_concluidas:.1f}%)" if kpis.concluidas is not None else "N/D", "Municípios Atendidos": len(kpis.municipios), "Estabelecimentos Visíveis": kpis.estabelecimentos},
+                        {"Meta Mensal Total": format_number(df_performance['CotaMensal_Estabelecimento'].sum()), "Meta Mensal Média/Estab.": f"{df_performance['CotaMensal_Estabelecimento'].mean():.1f}" if not df_performance.empty else "N/D"},
+                        {"Casos Mantidos na UBS": f"{format_number(casos_ubs)} ({perc_ubs:.1f}%)", "Casos Encaminhados": f"{format_number(total_encaminhados)} ({perc_enc:.1f}%)", "Encaminhamentos Evitados": f"{format_number(evitados)} ({perc_evitados:.1f}%)"}
+                    ]
+                    
+                    df_ts = evolution_data(view, *evolution_dates(start_default, end_default))
+                    fig_ts = evolution_figure(df_ts) if df_ts is not None else None
+                    fig_perf, fig_pie, fig_cat, fig_sol = figures['perf'], figures['pie'], figures['cat'], figures['sol']
+                    df_spec_for_pdf = df_especialidade_tabela[['label', 'count']].rename(columns={'label': 'Especialidade (Média Resp. h)', 'count': 'Quantidade'})
+                    figures_for_pdf = report_figures(fig_perf, fig_ts, fig_pie, df_spec_for_pdf, cat_count, fig_cat, solicitante_count, fig_sol)
+                    
+                    stage_records = []
+                    etapa = start_section("PDF: gráficos", len(figures_for_pdf))
+                    images_for_pdf = render_pdf_images(renderer, figures_for_pdf)
+                    stage_records.append(end_section(etapa, len(images_for_pdf), fragment=True))
 
-uploaded_file = st.file_uploader("Faça upload do arquivo Excel principal de teleconsultorias (xls/xlsx):", type=["xls", "xlsx"])
+                    etapa = start_section("PDF: HTML")
+                    html_content = dashboard_report_html(start_date_dt, end_date_dt, kpis_for_pdf_rows, observacao_fluxo_pdf, df_tabela_perf, figures_for_pdf, images_for_pdf)
+                    stage_records.append(end_section(etapa, fragment=True))
 
-if uploaded_file is None or df_condicoes_raw is None or df_estabelecimentos_raw is None or df_categoria_raw is None:
-    st.warning("Por favor, faça o upload do relatório de teleconsultorias, filtrando sempre o período de setembro de 2024 até a data atual.")
-    st.stop()
+                    etapa = start_section("PDF: WeasyPrint")
+                    pdf_bytes = HTML(string=html_content).write_pdf()
+                    stage_records.append(end_section(etapa, fragment=True))
 
-df_raw = load_excel_upload(uploaded_file)
-if df_raw is None:
+                    st.caption("Tempo por etapa: " + ", ".join(f"{record.secao.removeprefix('PDF: ')} {record.segundos:.2f} s" for record in stage_records))
+                    st.download_button(
+                        label="📥 Download do Relatório PDF",
+                        data=pdf_bytes,
+                        file_name=f"Relatorio_Final_{datetime.now().strftime('%Y%m%d')}.pdf",
+                        mime="application/pdf"
+                    )
+            except Exception as e:
+                st.error(f"Ocorreu um erro ao gerar o PDF com WeasyPrint. Verifique a instalação (GTK3 no Windows) e as bibliotecas. Erro: {e}")
+    end_section(secao, fragment=True)
+    section_caption("Exportação PDF")
+
+# --- 4. CARREGAMENTO E PREPARAÇÃO DOS DADOS ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get('DASHBOARD_CACHE_DIR', os.path.join(BASE_DIR, '.cache'))
+secao = start_section("Carga dos dados")
+try:
+    refs = get_reference_data(reference_signature(BASE_DIR))
+except (OSError, ValueError) as e:
+    st.error(f"Erro ao carregar as planilhas de referência: {e}")
     st.stop()
 
-col_map_full = {'Municipio Solicitante': ['Municipio Solicitante', 'Município Solicitante', 'Municipio'], 'Estabelecimento': ['Estabelecimento', 'Estabelecimento do Solicitante', 'Estabelecimento Solicitante', 'Unidade de Saúde'], 'Especialidade': ['Especialidade', 'Especialty', 'Specialty'], 'SolicitanteNome': ['Solicitante', 'Nome do Solicitante', 'Profissional Solicitante'], 'NomeEspecialista': ['Nome do Especialista', 'Nome do Especialista Teleconsultor', 'Especialista'], 'CBP': ['CBP', 'cbo'], 'Conduta': ['Conduta'], 'Inten.Encaminhamento': ['Inten.Encaminhamento'], 'Concluida?': ['Concluída?', 'Concluida?'], 'Data_Solicitacao': ['Data Solicitação', 'Data Solicitacao', 'Data_Solicitacao', 'Dt.Criação'], 'Data_Resposta': ['Data Resposta', 'Data_Resposta', 'Dt.1ª resposta'], 'Situação': ['Situação', 'Situacao', 'Status']}
-mapped = {canonical: find_existing(candidates, df_raw.columns) for canonical, candidates in col_map_full.items()}
-df = df_raw.rename(columns={v: k for k, v in mapped.items() if v})
-
-for dcol in ['Data_Solicitacao', 'Data_Resposta']:
-    if dcol in df.columns:
-        df[dcol] = pd.to_datetime(df[dcol], errors='coerce', dayfirst=True)
-if 'Concluida?' in df.columns:
-    df['Concluida?'] = df['Concluida?'].astype(str).str.lower().str.strip()
-
-col_map_categoria = {'CBO': ['CBO'], 'Categoria': ['Categoria']}
-mapped_cat = {canonical: find_existing(candidates, df_categoria_raw.columns) for canonical, candidates in col_map_categoria.items()}
-df_categoria = df_categoria_raw.rename(columns={v: k for k, v in mapped_cat.items() if v})
-if 'CBO' in df_categoria.columns:
-    df_categoria['CBO'] = df_categoria['CBO'].astype(str).str.replace(r'\.0$', '', regex=True)
-    cbo_to_categoria_map = df_categoria.set_index('CBO')['Categoria'].to_dict()
-    if 'CBP' in df.columns:
-        df['CBP'] = df['CBP'].astype(str).str.replace(r'\.0$', '', regex=True)
-        df['Categoria Profissional'] = df['CBP'].map(cbo_to_categoria_map).fillna('Não Mapeado')
-
-col_map_condicoes = {'Municipio Solicitante': ['MUNICÍPIOS', 'Municipio Solicitante'], 'CotaTotal': ['Cota total', 'Cota Total'], 'Monitor': ['Monitor(a) de Campo Responsável', 'Monitor'], 'Macrorregiao': ['Macrorregião de Saúde'], 'Microrregiao': ['Microrregião de Saúde']}
-mapped_cond = {canonical: find_existing(candidates, df_condicoes_raw.columns) for canonical, candidates in col_map_condicoes.items()}
-df_condicoes = df_condicoes_raw.rename(columns={v: k for k, v in mapped_cond.items() if v})
-
-col_map_estab = {'Municipio Solicitante': ['Município', 'Municipio Solicitante'], 'Estabelecimento': ['Unidade de Saúde', 'Estabelecimento']}
-mapped_estab = {canonical: find_existing(candidates, df_estabelecimentos_raw.columns) for canonical, candidates in col_map_estab.items()}
-df_estabelecimentos = df_estabelecimentos_raw.rename(columns={v: k for k, v in mapped_estab.items() if v})
-
-if 'Municipio Solicitante' in df_estabelecimentos.columns and 'Municipio Solicitante' in df_condicoes.columns:
-    df_estabelecimentos = pd.merge(df_estabelecimentos, df_condicoes[['Municipio Solicitante', 'CotaTotal']], on='Municipio Solicitante', how='left').fillna({'CotaTotal': 0})
-
-ano_referencia = 2024
-if 'Data_Solicitacao' in df.columns and 'Situação' in df.columns:
-    df_ano_ref = df[(df['Data_Solicitacao'].dt.year == ano_referencia) & (~df['Situação'].str.lower().str.contains('cancelad', na=False))].copy()
-    realizado_ano_ref = df_ano_ref.groupby('Municipio Solicitante').size().reset_index(name='Realizado_AnoRef')
-    df_estabelecimentos['Num_Estabelecimentos'] = df_estabelecimentos.groupby('Municipio Solicitante')['Estabelecimento'].transform('count')
-    df_estabelecimentos = pd.merge(df_estabelecimentos, realizado_ano_ref, on='Municipio Solicitante', how='left').fillna({'Realizado_AnoRef': 0})
-    df_estabelecimentos['Realizado_AnoRef'] = df_estabelecimentos['Realizado_AnoRef'].astype(int)
-    df_estabelecimentos['CotaMensal_Estabelecimento'] = ((df_estabelecimentos['CotaTotal'] - df_estabelecimentos['Realizado_AnoRef']) / 12 / df_estabelecimentos['Num_Estabelecimentos']).where(df_estabelecimentos['Num_Estabelecimentos'] > 0, 0).round(2)
-    df_estabelecimentos['CotaMensal_Estabelecimento'] = df_estabelecimentos['CotaMensal_Estabelecimento'].apply(lambda x: max(x, 0))
-
-cols_to_merge_final = [col for col in ['Municipio Solicitante', 'Monitor', 'Macrorregiao', 'Microrregiao'] if col in df_condicoes.columns]
-if 'Municipio Solicitante' in df.columns and 'Municipio Solicitante' in df_condicoes.columns:
-    df = pd.merge(df, df_condicoes[cols_to_merge_final], on='Municipio Solicitante', how='left')
+modo_incremental = st.toggle("Carga incremental (anexar o upload ao histórico local)", value=False, help="O upload traz só os dias mais recentes; linhas novas são anexadas e as alteradas, atualizadas no histórico guardado no servidor.")
+uploaded_file = st.file_uploader("Faça upload do arquivo Excel principal de teleconsultorias (xls/xlsx):", type=["xls", "xlsx"])
+
+if modo_incremental:
+    store = get_teleconsulta_store()
+    if uploaded_file is not None:
+        upload_hash = hash_bytes(uploaded_file.getvalue())
+        if not store.is_applied(upload_hash):
+            with st.spinner("Mesclando o upload ao histórico local..."):
+                df_upload, ingest_stats = load_excel_upload(uploaded_file)
+                if df_upload is None:
+                    st.stop()
+                result = store.append(df_upload, upload_hash, refs)
+            st.success(f"Histórico atualizado: {format_number(result.novas)} teleconsultorias novas, {format_number(result.atualizadas)} atualizadas e {format_number(result.inalteradas)} já existentes "
+                       f"(leitura {ingest_stats.parse_seconds:.2f} s, mescla {result.seconds:.2f} s, {result.dias_recalculados} dias recalculados).")
+    if not store.exists():
+        st.warning("O histórico local está vazio. Faça uma primeira vez o upload do relatório completo, de setembro de 2024 até a data atual; depois basta enviar os dias mais recentes.")
+        st.stop()
+    if store.sync_references(refs):
+        st.info("As planilhas de referência mudaram: o histórico local foi recalculado.")
+    dataset_key = f"historico-{store.version()}"
+    dataset, load_message = load_history(dataset_key)
+else:
+    if uploaded_file is None:
+        st.warning("Por favor, faça o upload do relatório de teleconsultorias, filtrando sempre o período de setembro de 2024 até a data atual.")
+        st.stop()
+    dataset_key = dataset_cache_key(hash_bytes(uploaded_file.getvalue()), refs.fingerprint)
+    dataset, load_message = load_prepared_dataset(dataset_key, uploaded_file, refs)
+    if dataset is None:
+        st.stop()
+st.caption(load_message)
+st.session_state['linhas_dataset'] = len(dataset.teleconsultorias)
+end_section(secao, len(dataset.teleconsultorias))
 
 
 # --- 5. BARRA LATERAL DE FILTROS ---
+secao = start_section("Filtros", len(dataset.teleconsultorias))
 st.sidebar.header("Filtros")
-if not df['Data_Solicitacao'].dropna().empty:
-    min_date_val, max_date_val = (df['Data_Solicitacao'].dropna().min(), df['Data_Solicitacao'].dropna().max())
+engines = get_engines(dataset_key, dataset)
+filter_engine = engines.rows
+if filter_engine.date_bounds() is not None:
+    min_date_val, max_date_val = filter_engine.date_bounds()
     start_default, end_default = (min_date_val.date(), max_date_val.date())
     st.sidebar.markdown("##### Período Principal de Análise")
     col_data_inicio, col_data_fim = st.sidebar.columns(2)
@@ -163,140 +480,114 @@ if not df['Data_Solicitacao'].dropna().empty:
     start_date_dt = pd.to_datetime(start_date)
     end_date_dt = pd.to_datetime(end_date)
     
-    df_base_filtrado = df.copy()
-    if 'Situação' in df.columns:
+    mask_base = filter_engine.all_rows()
+    selections = {}
+    if 'Situação' in filter_engine:
         st.sidebar.markdown("---")
-        todos_status = sorted(df['Situação'].dropna().unique())
+        todos_status = filter_engine.options('Situação')
         status_selecionado = st.sidebar.multiselect("Status", options=todos_status, placeholder="Filtrar por status")
         if status_selecionado:
-            df_base_filtrado = df_base_filtrado[df_base_filtrado['Situação'].isin(status_selecionado)]
+            selections['Situação'] = status_selecionado
+            mask_base &= filter_engine.mask_for('Situação', status_selecionado)
     st.sidebar.markdown("---")
     filters_config = [{'column': 'Monitor', 'label': 'Monitor de Campo'}, {'column': 'Macrorregiao', 'label': 'Macrorregião de Saúde'}, {'column': 'Microrregiao', 'label': 'Microrregião de Saúde'}, {'column': 'Municipio Solicitante', 'label': 'Município'}, {'column': 'Estabelecimento', 'label': 'Estabelecimento'}, {'column': 'Especialidade', 'label': 'Especialidade'}, {'column': 'Categoria Profissional', 'label': 'Categoria Profissional'}, {'column': 'SolicitanteNome', 'label': 'Nome do Solicitante'}, {'column': 'NomeEspecialista', 'label': 'Nome do Especialista'}]
     for f in filters_config:
-        if f['column'] in df_base_filtrado.columns:
-            options = get_filter_options(df_base_filtrado, f['column'])
+        if f['column'] in filter_engine:
+            options = filter_engine.options(f['column'], mask_base)
             if options:
                 selection = st.sidebar.multiselect(f['label'], options=options, key=f['column'], placeholder="Selecione as opções")
                 if selection:
-                    df_base_filtrado = df_base_filtrado[df_base_filtrado[f['column']].isin(selection)]
-    df_filtered_final = df_base_filtrado[df_base_filtrado['Data_Solicitacao'].between(start_date_dt, end_date_dt)].copy()
+                    selections[f['column']] = selection
+                    mask_base &= filter_engine.mask_for(f['column'], selection)
+    # Sem filtro por solicitante/especialista, KPIs, performance e distribuições saem do cubo pré-agregado.
+    view = apply_filters(dataset, engines, Selection(start_date_dt, end_date_dt, selections))
+    # Identifica a seleção atual; arquivos gerados para outra seleção não são oferecidos para download.
+    selection_signature = (dataset_key, start_date, end_date, repr(sorted(selections.items())))
+    agg = view.aggregates
+    end_section(secao, view.n_rows)
 
     # --- 6. CORPO PRINCIPAL DO DASHBOARD ---
-    fig_perf, fig_ts, fig_pie, fig_cat, fig_sol = None, None, None, None, None
+    fig_perf, fig_pie, fig_cat, fig_sol = None, None, None, None
+    chart_stats = []
     df_tabela_perf, df_especialidade_tabela = pd.DataFrame(), pd.DataFrame()
-    municipios_visiveis = df_filtered_final['Municipio Solicitante'].unique()
-    estabelecimentos_visiveis_df = df_estabelecimentos[df_estabelecimentos['Municipio Solicitante'].isin(municipios_visiveis)]
-    total_estabelecimentos_visiveis = estabelecimentos_visiveis_df['Estabelecimento'].nunique()
+    # Sem cotas (arquivo sem 'Situação'), os relatórios e o PDF recebem uma performance vazia.
+    df_performance_estab_filtrado = pd.DataFrame(columns=SUMMARY_COLUMNS)
+    secao = start_section("KPIs e fluxo", view.n_rows)
+    kpis = compute_kpis(agg, refs)
+    flow = compute_flow(agg)
 
     st.subheader("Indicadores Chave de Operação (KPIs)")
     col1, col2, col3, col4, col5 = st.columns(5)
-    col1.metric("Total de Teleconsultorias", format_number(len(df_filtered_final)))
-    if 'Data_Resposta' in df_filtered_final.columns and not df_filtered_final['Data_Resposta'].dropna().empty:
-        df_filtered_final['Tempo_Resposta_Horas'] = (df_filtered_final['Data_Resposta'] - df_filtered_final['Data_Solicitacao']).dt.total_seconds() / 3600
-        col2.metric("Média (horas) resposta", f"{df_filtered_final['Tempo_Resposta_Horas'].mean():.1f}")
-    else:
-        col2.metric("Média (horas) resposta", "N/D")
-    if 'Concluida?' in df_filtered_final.columns and not df_filtered_final.empty:
-        concluido = df_filtered_final['Concluida?'].str.contains('sim', na=False).sum()
-        percentual = (concluido / len(df_filtered_final) * 100) if len(df_filtered_final) > 0 else 0
-        col3.metric("Concluídas", f"{format_number(concluido)} ({percentual:.1f}%)")
-    else:
-        col3.metric("Concluídas", "N/D")
-    col4.metric("Municípios Atendidos", df_filtered_final['Municipio Solicitante'].nunique())
-    col5.metric("Total de Estabelecimentos", format_number(total_estabelecimentos_visiveis))
+    col1.metric("Total de Teleconsultorias", format_number(kpis.total))
+    col2.metric("Média (horas) resposta", f"{kpis.media_resposta:.1f}" if kpis.media_resposta is not None else "N/D")
+    col3.metric("Concluídas", f"{format_number(kpis.concluidas)} ({kpis.percentual_concluidas:.1f}%)" if kpis.concluidas is not None else "N/D")
+    col4.metric("Municípios Atendidos", len(kpis.municipios))
+    col5.metric("Total de Estabelecimentos", format_number(kpis.estabelecimentos))
 
     st.markdown("---")
     st.subheader("Análise de Fluxo de Encaminhamentos")
-    casos_ubs, total_encaminhados, evitados, intencao_encaminhar = 0, 0, 0, 0
-    perc_ubs, perc_enc, perc_evitados = 0.0, 0.0, 0.0
-    if 'Conduta' in df_filtered_final.columns and 'Inten.Encaminhamento' in df_filtered_final.columns:
+    if flow is not None:
         col_ubs, col_enc, col_evit = st.columns(3)
-        df_filtered_final['Conduta'] = df_filtered_final['Conduta'].astype(str).str.lower()
-        casos_ubs = df_filtered_final['Conduta'].str.contains('manter na unidade', na=False).sum()
-        casos_enc_sec = df_filtered_final['Conduta'].str.contains('encaminhar niveis secundarios', na=False).sum()
-        casos_enc_ter = df_filtered_final['Conduta'].str.contains('encaminhar niveis terciarios', na=False).sum()
-        total_encaminhados = casos_enc_sec + casos_enc_ter
-        total_conduta = casos_ubs + total_encaminhados
-        if total_conduta > 0:
-            perc_ubs, perc_enc = (casos_ubs / total_conduta * 100), (total_encaminhados / total_conduta * 100)
-        col_ubs.metric("Casos Mantidos na UBS", f"{format_number(casos_ubs)} ({perc_ubs:.1f}%)")
-        col_enc.metric("Casos Encaminhados", f"{format_number(total_encaminhados)} ({perc_enc:.1f}%)")
-        intencao_encaminhar = df_filtered_final['Inten.Encaminhamento'].astype(str).str.lower().str.strip().isin(['sim']).sum()
-        if intencao_encaminhar > 0:
-            evitados = intencao_encaminhar - total_encaminhados
-            perc_evitados = (evitados / intencao_encaminhar) * 100
-            col_evit.metric("Encaminhamentos Evitados", f"{format_number(evitados)} ({perc_evitados:.1f}%)")
+        col_ubs.metric("Casos Mantidos na UBS", f"{format_number(flow.casos_ubs)} ({flow.percentual_ubs:.1f}%)")
+        col_enc.metric("Casos Encaminhados", f"{format_number(flow.encaminhados)} ({flow.percentual_encaminhados:.1f}%)")
+        if flow.evitados is not None:
+            col_evit.metric("Encaminhamentos Evitados", f"{format_number(flow.evitados)} ({flow.percentual_evitados:.1f}%)")
         else:
             col_evit.metric("Encaminhamentos Evitados", "N/D")
     else:
         st.warning("A Análise de Fluxo não pode ser exibida. Verifique se as colunas 'Conduta' e 'Inten.Encaminhamento' existem no arquivo carregado.")
+    end_section(secao)
 
     st.markdown("---")
+    secao = start_section("Performance", view.n_rows)
     st.header("Análise de Performance de Metas")
-    if 'CotaMensal_Estabelecimento' in df_estabelecimentos.columns:
-        municipios_filtrados = df_filtered_final['Municipio Solicitante'].unique()
-        estabelecimentos_base_df = df_estabelecimentos[df_estabelecimentos['Municipio Solicitante'].isin(municipios_filtrados)]
-        realizado_estab = df_filtered_final.groupby('Estabelecimento').size().reset_index(name='Realizado_Periodo')
-        df_performance_estab_filtrado = pd.merge(estabelecimentos_base_df, realizado_estab, on='Estabelecimento', how='left').fillna({'Realizado_Periodo': 0})
-        df_performance_estab_filtrado['Realizado_Periodo'] = df_performance_estab_filtrado['Realizado_Periodo'].astype(int)
+    if 'CotaMensal_Estabelecimento' in dataset.estabelecimentos.columns:
+        df_performance_estab_filtrado = compute_performance(dataset, agg, kpis.municipios)
         st.subheader("Gráfico Realizado vs. Meta por Estabelecimento")
         if not df_performance_estab_filtrado.empty:
-            fig_perf = go.Figure()
-            fig_perf.add_trace(go.Bar(name='Realizado no Período', x=df_performance_estab_filtrado['Estabelecimento'], y=df_performance_estab_filtrado['Realizado_Periodo'], marker_color="#33ac47"))
-            fig_perf.add_trace(go.Bar(name='Cota Mensal', x=df_performance_estab_filtrado['Estabelecimento'], y=df_performance_estab_filtrado['CotaMensal_Estabelecimento'], marker_color='#adb5bd'))
-            fig_perf.update_layout(barmode='group', xaxis_tickangle=-90, title_text='Comparativo de Realizado vs. Meta por Estabelecimento', legend=dict(orientation="h", yanchor="top", y=-0.4, xanchor="center", x=0.5))
-            st.plotly_chart(fig_perf, use_container_width=True)
+            # Drill-down: a lista de (nível, valor) clicados vale enquanto a seleção de filtros não muda.
+            if st.session_state.get('drill_performance_sig') != selection_signature:
+                st.session_state['drill_performance_sig'] = selection_signature
+                st.session_state['drill_performance'] = []
+            drill = st.session_state['drill_performance']
+            df_grafico_perf, nivel_perf = performance_rollup(with_regions(df_performance_estab_filtrado, refs.condicoes), drill)
+            if drill:
+                col_caminho, col_voltar = st.columns([4, 1])
+                col_caminho.caption(" › ".join(f"{LEVEL_LABELS[col]}: {valor}" for col, valor in drill))
+                if col_voltar.button("Voltar um nível", key="drill_voltar"):
+                    drill.pop()
+                    st.rerun()
+            if nivel_perf != 'Estabelecimento':
+                st.caption(f"Valores somados por {LEVEL_LABELS[nivel_perf].lower()}: o nível seguinte teria mais de {MAX_BARS} barras. Clique em uma barra para detalhar.")
+            fig_perf = performance_figure(df_grafico_perf, nivel_perf)
+            evento = show_chart(chart_stats, "Realizado vs. Meta", fig_perf, key=f"grafico_performance_{len(drill)}",
+                                on_select="rerun" if nivel_perf != 'Estabelecimento' else "ignore", selection_mode="points")
+            pontos = evento.selection.points if nivel_perf != 'Estabelecimento' else []
+            if pontos and not str(pontos[0]['x']).startswith(OTHERS_LABEL):
+                drill.append((nivel_perf, pontos[0]['x']))
+                st.rerun()
         else:
             st.info("Nenhum estabelecimento encontrado para os filtros selecionados.")
         st.subheader("Tabela de Performance por Estabelecimento")
-        df_performance_estab_filtrado['Percentual Atingido'] = (df_performance_estab_filtrado['Realizado_Periodo'] / df_performance_estab_filtrado['CotaMensal_Estabelecimento'] * 100).where(df_performance_estab_filtrado['CotaMensal_Estabelecimento'] > 0, 0)
-        def style_performance(v):
-            if pd.isna(v): return ''
-            return 'background-color: #f8d7da; color: #721c24;' if v < 50 else ('background-color: #fff3cd; color: #856404;' if v < 90 else 'background-color: #d4edda; color: #33ac47;')
         cols_perf = ['Municipio Solicitante', 'Estabelecimento', 'CotaMensal_Estabelecimento', 'Realizado_Periodo', 'Percentual Atingido']
         df_tabela_perf = df_performance_estab_filtrado[cols_perf].copy()
         df_tabela_perf.reset_index(drop=True, inplace=True)
         df_tabela_perf.index += 1
-        st.dataframe(df_tabela_perf.style.applymap(style_performance, subset=['Percentual Atingido']).format({'Percentual Atingido': '{:.1f}%', 'CotaMensal_Estabelecimento': '{:.2f}'}), use_container_width=True)
+        performance_table_section(df_tabela_perf, selection_signature)
     else:
         st.warning("A Análise de Performance não pode ser exibida.")
+    end_section(secao, len(df_tabela_perf))
 
     st.markdown("---")
     st.header("Análises Descritivas e Distribuições")
-    st.subheader("Evolução Mensal das Teleconsultorias")
-    col_evol_1, col_evol_2 = st.columns(2)
-    with col_evol_1:
-        start_date_evol = st.date_input("Data de Início da Evolução", value=start_default, min_value=start_default, max_value=end_default, key="start_date_evol")
-    with col_evol_2:
-        end_date_evol = st.date_input("Data de Fim da Evolução", value=end_default, min_value=start_date_evol, max_value=end_default, key="end_date_evol")
-    start_date_evol_dt = pd.to_datetime(start_date_evol)
-    end_date_evol_dt = pd.to_datetime(end_date_evol)
-    df_evolucao = df_base_filtrado[df_base_filtrado['Data_Solicitacao'].between(start_date_evol_dt, end_date_evol_dt)].copy()
-    if not df_evolucao.empty:
-        date_range_full = pd.date_range(start=start_date_evol_dt, end=end_date_evol_dt, freq='MS')
-        df_ts = df_evolucao.set_index('Data_Solicitacao').resample('MS').size().reindex(date_range_full, fill_value=0).reset_index(name='Quantidade')
-        df_ts.rename(columns={'index': 'Data_Solicitacao'}, inplace=True)
-        df_ts['Mês'] = df_ts['Data_Solicitacao'].dt.strftime('%b/%Y').str.lower()
-        fig_ts = px.line(df_ts, x='Mês', y='Quantidade', text='Quantidade', title='Evolução Mensal das Teleconsultorias', markers=True, color_discrete_sequence=['#33ac47'])
-        fig_ts.update_traces(textposition='top center')
-        fig_ts.update_xaxes(type='category')
-        st.plotly_chart(fig_ts, use_container_width=True)
-    else:
-        st.info("Sem dados de evolução para o período e filtros selecionados.")
+    evolution_section(view, start_default, end_default, chart_stats)
 
+    secao = start_section("Distribuições", view.n_rows)
     st.subheader("Distribuição por Especialidade")
-    if 'Especialidade' in df_filtered_final.columns and not df_filtered_final.empty:
-        esp_count = df_filtered_final['Especialidade'].value_counts().reset_index(name='count')
-        df_pie_data = esp_count
-        if 'Tempo_Resposta_Horas' in df_filtered_final.columns:
-            avg_resp = df_filtered_final.groupby('Especialidade')['Tempo_Resposta_Horas'].mean().round(1).reset_index(name='avg_resp_horas')
-            df_pie_data = pd.merge(esp_count, avg_resp, on='Especialidade')
-            df_pie_data['label'] = df_pie_data.apply(lambda row: f"{row['Especialidade']} ({row['avg_resp_horas']}h)", axis=1)
-        else:
-            df_pie_data['label'] = df_pie_data['Especialidade']
-        fig_pie = px.pie(df_pie_data, names='label', values='count', title='Distribuição por Especialidade e Média de Resposta (horas)', hole=0.3, color_discrete_sequence=px.colors.qualitative.Pastel)
-        fig_pie.update_traces(textposition='inside', textinfo='percent')
-        st.plotly_chart(fig_pie, use_container_width=True)
+    if agg.has('Especialidade') and agg.total() > 0:
+        df_pie_data = specialty_distribution(agg)
+        fig_pie = specialty_figure(df_pie_data)
+        show_chart(chart_stats, "Especialidade", fig_pie)
         df_especialidade_tabela = df_pie_data.copy()
         df_especialidade_tabela.reset_index(drop=True, inplace=True)
         df_especialidade_tabela.index += 1
@@ -306,168 +597,53 @@ if not df['Data_Solicitacao'].dropna().empty:
     col_desc1, col_desc2 = st.columns(2)
     with col_desc1:
         st.subheader("Distribuição por Categoria Profissional")
-        if 'Categoria Profissional' in df_filtered_final.columns and not df_filtered_final['Categoria Profissional'].dropna().empty:
-            cat_count = df_filtered_final['Categoria Profissional'].value_counts().reset_index()
-            fig_cat = px.bar(cat_count, x='Categoria Profissional', y='count', title='Teleconsultorias por Categoria', labels={'count':'Quantidade'}, color_discrete_sequence=['#33ac47'])
-            st.plotly_chart(fig_cat, use_container_width=True)
+        cat_count = category_distribution(agg)
+        if not cat_count.empty:
+            fig_cat = category_figure(top_n_with_others(cat_count, 'Categoria Profissional'))
+            show_chart(chart_stats, "Categoria Profissional", fig_cat)
         else:
             st.info("Sem dados de Categoria Profissional para exibir.")
     with col_desc2:
         st.subheader("Distribuição por Solicitante")
-        if 'SolicitanteNome' in df_filtered_final.columns and not df_filtered_final['SolicitanteNome'].dropna().empty:
-            solicitante_count = df_filtered_final['SolicitanteNome'].value_counts().reset_index()
-            fig_sol = px.bar(solicitante_count, x='SolicitanteNome', y='count', title='Teleconsultorias por Solicitante', labels={'count':'Quantidade', 'SolicitanteNome': 'Nome do Solicitante'}, color_discrete_sequence=['#33ac47'])
-            st.plotly_chart(fig_sol, use_container_width=True)
+        solicitante_count = requester_distribution(view)
+        if not solicitante_count.empty:
+            fig_sol = requester_figure(top_n_with_others(solicitante_count, 'SolicitanteNome'))
+            show_chart(chart_stats, "Solicitante", fig_sol)
         else:
             st.info("Sem dados de Solicitantes para exibir.")
+    end_section(secao, len(df_especialidade_tabela) + len(cat_count) + len(solicitante_count))
+
+    with st.expander("Desempenho dos gráficos"):
+        st.dataframe(pd.DataFrame(chart_stats), use_container_width=True, hide_index=True)
+        st.caption(f"Rankings e comparativos mostram no máximo {MAX_BARS} barras por série (variável DASHBOARD_MAX_BARS); o restante vai para \"{OTHERS_LABEL}\" ou para o nível regional.")
+
+    st.markdown("---")
+    response_time_section(view, start_date_dt, end_date_dt)
 
     # --- 7. DETALHAMENTO E EXPORTAÇÃO DE DADOS ---
     st.markdown("---")
     st.header("Detalhamento e Exportação de Dados")
-    st.subheader("Gerador de Relatórios por Município")
-    municipios_disponiveis = sorted(df_filtered_final['Municipio Solicitante'].unique())
-    if not municipios_disponiveis:
-        st.info("Nenhum município com dados no período selecionado para gerar relatório.")
-    else:
-        municipio_relatorio = st.selectbox("Selecione um município para o relatório detalhado:", options=municipios_disponiveis, index=None, placeholder="Escolha um município")
-        if municipio_relatorio:
-            df_sumario_relatorio = df_performance_estab_filtrado[df_performance_estab_filtrado['Municipio Solicitante'] == municipio_relatorio].copy()
-            df_detalhes_relatorio = df_filtered_final[df_filtered_final['Municipio Solicitante'] == municipio_relatorio].copy()
-            cols_summary = [col for col in ['Municipio Solicitante', 'Estabelecimento', 'CotaMensal_Estabelecimento', 'Realizado_Periodo', 'Percentual Atingido'] if col in df_sumario_relatorio.columns]
-            df_sumario_relatorio = df_sumario_relatorio[cols_summary]
-            cols_details = [col for col in ['Data_Solicitacao', 'Municipio Solicitante', 'Estabelecimento', 'Especialidade', 'SolicitanteNome', 'Categoria Profissional', 'Situação', 'Monitor', 'Conduta', 'Inten.Encaminhamento'] if col in df_detalhes_relatorio.columns]
-            df_detalhes_relatorio = df_detalhes_relatorio[cols_details]
-            excel_bytes = to_excel_report_bytes(df_sumario_relatorio, df_detalhes_relatorio)
-            st.download_button(label=f"📥 Download Relatório de {municipio_relatorio}", data=excel_bytes, file_name=f"Relatorio_{municipio_relatorio.replace(' ', '_')}.xlsx", mime="application/vnd.openxmlformats-officedocument.sheet", use_container_width=True)
+    municipal_report_section(view, df_performance_estab_filtrado, selection_signature, start_date_dt, end_date_dt)
 
-    st.subheader("Detalhamento Geral das Teleconsultorias Filtradas")
-    cols_show = [col for col in ['Data_Solicitacao', 'Municipio Solicitante', 'Estabelecimento', 'Especialidade', 'SolicitanteNome', 'Categoria Profissional', 'Situação', 'Monitor'] if col in df_filtered_final.columns]
-    if not df_filtered_final.empty:
-        df_detalhe_geral = df_filtered_final[cols_show].copy()
-        df_detalhe_geral.reset_index(drop=True, inplace=True)
-        df_detalhe_geral.index += 1
-        st.dataframe(df_detalhe_geral, use_container_width=True)
-        st.download_button(label="📥 Download dos Dados Filtrados (Geral)", data=to_excel_bytes_generic(df_detalhe_geral), file_name="Relatorio_Geral_Teleconsultorias.xlsx", mime="application/vnd.openxmlformats-officedocument.sheet")
+    detail_section(view, selection_signature)
 
 
     # ### SEÇÃO DE EXPORTAÇÃO DE PDF COM WEASYPRINT ###
     st.markdown("---")
     st.header("Exportar Relatório em PDF")
 
-    def generate_html_for_pdf(start_date, end_date, kpis_dict, observacao_fluxo, df_perf, figures, df_spec):
-        """Gera uma string HTML completa para o relatório PDF."""
-        def fig_to_base64(fig):
-            if fig is None: return None
-            try:
-                fig.update_layout(height=450, margin=dict(l=60, r=20, t=50, b=180))
-                img_bytes = fig.to_image(format="png", width=800, engine="kaleido")
-                return base64.b64encode(img_bytes).decode()
-            except Exception as e:
-                st.warning(f"Não foi possível converter um gráfico para o PDF. Erro: {e}")
-                return None
-        df_perf_formatted = df_perf.copy()
-        if 'Percentual Atingido' in df_perf_formatted.columns:
-            df_perf_formatted['Percentual Atingido'] = df_perf_formatted['Percentual Atingido'].map('{:.1f}%'.format)
-        df_perf_html = df_perf_formatted.to_html(index=True, classes='styled-table', border=0)
-        df_spec_html = df_spec.to_html(index=True, classes='styled-table', border=0) if df_spec is not None and not df_spec.empty else ""
-        kpi_html_rows = ""
-        for i, kpi_row in enumerate(kpis_dict):
-            kpi_html_rows += '<div class="kpi-container">'
-            for k, v in kpi_row.items():
-                kpi_html_rows += f'<div class="kpi"><div class="kpi-value">{v}</div><div class="kpi-label">{k}</div></div>'
-            kpi_html_rows += '</div>'
-            if i == 2 and observacao_fluxo:
-                kpi_html_rows += f'<div class="observacao">{observacao_fluxo}</div>'
-        html = f"""
-        <html><head><meta charset="UTF-8">
-            <style>
-                @page {{ size: A4 portrait; margin: 1.5cm; }}
-                body {{ font-family: 'Helvetica', sans-serif; color: #333; font-size: 10px;}}
-                h1 {{ text-align: center; color: #33ac47; font-size: 20px;}}
-                h2 {{ color: #33ac47; border-bottom: 1px solid #33ac47; padding-bottom: 5px; margin-top: 25px; font-size: 14px;}}
-                .periodo {{ text-align: center; font-style: italic; color: #555; }}
-                .kpi-container {{ display: flex; flex-wrap: wrap; justify-content: space-around; padding: 8px; background-color: #f8f9fa; border-radius: 5px; margin-bottom: 5px; border: 1px solid #dee2e6; }}
-                .kpi {{ text-align: center; padding: 5px 10px; flex-grow: 1; }}
-                .kpi-value {{ font-size: 18px; font-weight: bold; }}
-                .kpi-label {{ font-size: 10px; color: #6c757d; }}
-                .observacao {{ font-size: 9px; font-style: italic; color: #6c757d; text-align: center; padding: 10px; margin-top: -5px; border: 1px dashed #ccc; border-radius: 5px; background-color: #f8f9fa;}}
-                .styled-table {{ border-collapse: collapse; margin: 15px 0; font-size: 8px; width: 100%; table-layout: fixed; }}
-                .styled-table thead tr {{ background-color: #33ac47; color: #ffffff; text-align: center; }}
-                .styled-table th, .styled-table td {{ padding: 6px 8px; border: 1px solid #ddd; word-wrap: break-word; text-align: left; }}
-                .styled-table td:nth-child(n+3) {{ text-align: center; }}
-                .styled-table tbody tr:nth-of-type(even) {{ background-color: #f3f3f3; }}
-                .chart-container {{ page-break-before: always; text-align: center; margin-top: 20px; }}
-                img {{ max-width: 100%; height: auto; }}
-            </style>
-        </head><body>
-            <h1>Relatório de Análise de Teleconsultorias</h1>
-            <p class="periodo">Período: {start_date.strftime('%d/%m/%Y')} a {end_date.strftime('%d/%m/%Y')}</p>
-            <h2>Indicadores Chave do Período</h2>
-            {kpi_html_rows}
-            <h2>Performance por Estabelecimento</h2>
-            {df_perf_html}
-        """
-        charts_html = ""
-        for title, fig_data in figures.items():
-            if fig_data is not None and fig_data.get('fig') is not None:
-                fig = fig_data['fig']
-                df_table = fig_data.get('table')
-                img_b64 = fig_to_base64(fig)
-                if img_b64:
-                    charts_html += f'<div class="chart-container"><h2>{title}</h2><img src="data:image/png;base64,{img_b64}">'
-                    if df_table is not None and not df_table.empty:
-                        charts_html += df_table.to_html(index=True, classes='styled-table', border=0)
-                    charts_html += '</div>'
-        html += charts_html
-        html += "</body></html>"
-        return html
-
-    if st.button("Gerar Relatório PDF"):
-        if df_filtered_final.empty:
-            st.warning("Não há dados filtrados para gerar o relatório PDF.")
-        else:
-            try:
-                with st.spinner("Gerando seu relatório PDF, por favor aguarde..."):
-                    observacao_fluxo_pdf = ""
-                    if intencao_encaminhar > 0:
-                        observacao_fluxo_pdf = (f"<b>Observação:</b> De um total de {format_number(intencao_encaminhar)} solicitações com intenção de encaminhamento, " f"{format_number(total_encaminhados)} foram efetivamente encaminhadas, " f"resultando em <b>{format_number(evitados)} encaminhamentos evitados</b>.")
-                    
-                    kpis_for_pdf_rows = [
-                        {"Total de Consultorias": format_number(len(df_filtered_final)), "Média Resp. (h)": f"{df_filtered_final['Tempo_Resposta_Horas'].mean():.1f}" if 'Tempo_Resposta_Horas' in df_filtered_final.columns and not df_filtered_final['Tempo_Resposta_Horas'].dropna().empty else "N/D", "Concluídas": f"{format_number(concluido)} ({percentual:.1f}%)" if 'Concluida?' in df_filtered_final.columns and not df_filtered_final.empty else "N/D", "Municípios Atendidos": df_filtered_final['Municipio Solicitante'].nunique(), "Estabelecimentos Visíveis": total_estabelecimentos_visiveis},
-                        {"Meta Mensal Total": format_number(df_performance_estab_filtrado['CotaMensal_Estabelecimento'].sum()), "Meta Mensal Média/Estab.": f"{df_performance_estab_filtrado['CotaMensal_Estabelecimento'].mean():.1f}"},
-                        {"Casos Mantidos na UBS": f"{format_number(casos_ubs)} ({perc_ubs:.1f}%)", "Casos Encaminhados": f"{format_number(total_encaminhados)} ({perc_enc:.1f}%)", "Encaminhamentos Evitados": f"{format_number(evitados)} ({perc_evitados:.1f}%)"}
-                    ]
-                    
-                    fig_cat_pdf, fig_sol_pdf = fig_cat, fig_sol
-                    if 'Categoria Profissional' in df_filtered_final.columns and df_filtered_final['Categoria Profissional'].nunique() > 30:
-                        cat_count_pdf = df_filtered_final['Categoria Profissional'].value_counts().reset_index().head(30)
-                        fig_cat_pdf = px.bar(cat_count_pdf, x='Categoria Profissional', y='count', title='Top 30 Categorias', labels={'count':'Quantidade'}, color_discrete_sequence=['#33ac47'])
-                    if 'SolicitanteNome' in df_filtered_final.columns and df_filtered_final['SolicitanteNome'].nunique() > 30:
-                        sol_count_pdf = df_filtered_final['SolicitanteNome'].value_counts().reset_index().head(30)
-                        fig_sol_pdf = px.bar(sol_count_pdf, x='SolicitanteNome', y='count', title='Top 30 Solicitantes', labels={'count':'Quantidade'}, color_discrete_sequence=['#33ac47'])
-                    
-                    df_spec_for_pdf = df_especialidade_tabela[['label', 'count']].rename(columns={'label': 'Especialidade (Média Resp. h)', 'count': 'Quantidade'})
-
-                    figures_for_pdf = {
-                        "Comparativo de Realizado vs. Meta": {'fig': fig_perf},
-                        "Evolução Mensal": {'fig': fig_ts},
-                        "Distribuição por Especialidade": {'fig': fig_pie, 'table': df_spec_for_pdf},
-                        "Distribuição por Categoria": {'fig': fig_cat_pdf},
-                        "Distribuição por Solicitante": {'fig': fig_sol_pdf}
-                    }
-                    
-                    html_content = generate_html_for_pdf(start_date_dt, end_date_dt, kpis_for_pdf_rows, observacao_fluxo_pdf, df_tabela_perf, figures_for_pdf, df_especialidade_tabela)
-                    
-                    pdf_bytes = HTML(string=html_content).write_pdf()
-                    
-                    st.download_button(
-                        label="📥 Download do Relatório PDF",
-                        data=pdf_bytes,
-                        file_name=f"Relatorio_Final_{datetime.now().strftime('%Y%m%d')}.pdf",
-                        mime="application/pdf"
-                    )
-            except Exception as e:
-                st.error(f"Ocorreu um erro ao gerar o PDF com WeasyPrint. Verifique a instalação (GTK3 no Windows) e as bibliotecas. Erro: {e}")
+    pdf_section(view, kpis, flow, df_performance_estab_filtrado, df_tabela_perf, df_especialidade_tabela, {'perf': fig_perf, 'pie': fig_pie, 'cat': fig_cat, 'sol': fig_sol},
+                cat_count, solicitante_count, start_default, end_default, start_date_dt, end_date_dt)
+
+if is_admin():
+    with st.expander("Painel de desempenho (administração)"):
+        st.markdown("##### Última execução de cada seção nesta sessão")
+        st.dataframe(get_profiler().table(), use_container_width=True, hide_index=True)
+        st.caption("Seções em fragmento (evolução, tempo de resposta, tabelas, relatórios e PDF) reexecutam sozinhas quando se interage com elas; nas outras, o número de execuções acompanha o do app completo.")
+        profile_log = get_profile_log()
+        if profile_log is not None:
+            st.markdown(f"##### Histórico do log ({profile_log.path})")
+            st.dataframe(summarize(profile_log.read(last=20000)), use_container_width=True, hide_index=True)
 
 st.markdown("---")
 st.caption(f"Dashboard atualizado em {datetime.now().strftime('%d/%m/%Y às %H:%M:%S')}")
\ No newline at end of file
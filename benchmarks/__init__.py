@@ -0,0 +1 @@
+"""Benchmarks e dados sintéticos do dashboard."""
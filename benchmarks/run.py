@@ -0,0 +1,247 @@
+"""Benchmark das etapas do dashboard sobre exportações sintéticas.
+
+Cada tamanho roda num subprocesso próprio, para que o pico de memória de um
+não contamine o outro. Por etapa são registrados o tempo (mediana e mínimo das
+repetições nas etapas rápidas) e o pico de RSS do processo ao final dela; com
+--tracemalloc registra-se também o pico de alocações Python da etapa (bem mais
+lento). O resultado é um JSON que pode ser comparado entre versões:
+
+    python -m benchmarks.run --linhas 10000 100000 1000000 --saida resultados.json
+    python -m benchmarks.run --comparar antes.json depois.json
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import cached_export, generate_export
+from core.charts import category_figure, evolution_figure, pdf_layout, performance_figure, performance_rollup, report_figures, requester_figure, specialty_figure, top_n_with_others, with_regions
+from core.cube import build_cube
+from core.exports import export_bytes
+from core.filters import FILTER_COLUMNS
+from core.ingestion import normalize_columns, peak_rss_mb
+from core.model import encode_teleconsultas
+from core.pipeline import Dataset, Selection, apply_filters, build_engines, category_distribution, compute_flow, compute_kpis, compute_performance, load_upload, monthly_evolution, requester_distribution, response_time_summary, specialty_distribution
+from core.preparation import enrich_teleconsultas
+from core.reference import load_reference_data
+from core.reports import DETAIL_COLUMNS, SUMMARY_COLUMNS, dashboard_report_html, to_excel_report_bytes
+from core.sketches import build_response_sketches
+from core.tables import paginate
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+STAGES = ['leitura_upload', 'normalizacao', 'referencias', 'codificacao', 'cubo', 'sketches', 'indices', 'filtros_sidebar', 'kpis_fluxo', 'performance', 'evolucao', 'distribuicoes', 'percentis', 'tabela_paginada', 'exportacao_excel', 'exportacao_csv', 'exportacao_parquet', 'exportacao_pdf']
+# Diferenças menores que isso são ruído de medição, não regressão.
+MIN_DIFF_SECONDS = 0.005
+# Colunas filtradas na simulação da barra lateral e a fração das opções selecionadas em cada uma.
+SIDEBAR_SELECTION = {'Situação': 0.5, 'Macrorregiao': 0.3, 'Especialidade': 0.2}
+
+
+class StageTimer:
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.results = {}
+        if trace_memory:
+            tracemalloc.start()
+
+    def run(self, name, fn, repeat=1):
+        """Executa fn repeat vezes e registra tempos e memória da etapa; retorna o último resultado."""
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        rss_before = peak_rss_mb()
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn()
+            seconds.append(time.perf_counter() - start)
+        entry = {'segundos': statistics.median(seconds), 'min_segundos': min(seconds), 'repeticoes': repeat,
+                 'pico_rss_mb': round(peak_rss_mb(), 1), 'aumento_pico_rss_mb': round(peak_rss_mb() - rss_before, 1)}
+        if self.trace_memory:
+            entry['pico_tracemalloc_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        self.results[name] = entry
+        return result
+
+
+def _sidebar(dataset, engines, start, end):
+    """Reproduz a barra lateral: opções em cascata por coluna e seleção de parte delas."""
+    mask = engines.rows.all_rows()
+    selections = {}
+    for col in FILTER_COLUMNS:
+        if col not in engines.rows:
+            continue
+        options = engines.rows.options(col, mask)
+        if col in SIDEBAR_SELECTION and options:
+            selections[col] = options[: max(1, int(len(options) * SIDEBAR_SELECTION[col]))]
+            mask &= engines.rows.mask_for(col, selections[col])
+    return apply_filters(dataset, engines, Selection(start, end, selections))
+
+
+def _pdf(refs, kpis, df_perf, df_ts, df_pie, cat_count, sol_count, start, end, timer_parts):
+    from core.rendering import ChartRenderer
+    figures = report_figures(performance_figure(*performance_rollup(with_regions(df_perf, refs.condicoes))), evolution_figure(df_ts), specialty_figure(df_pie), df_pie[['label', 'count']], cat_count,
+                             category_figure(top_n_with_others(cat_count, 'Categoria Profissional')), sol_count, requester_figure(top_n_with_others(sol_count, 'SolicitanteNome')))
+    with tempfile.TemporaryDirectory() as png_dir:
+        stage_start = time.perf_counter()
+        renderer = ChartRenderer(png_dir)
+        images = {title: base64.b64encode(png).decode() for title, png, error, _ in renderer.render(pdf_layout(figures)) if error is None}
+        timer_parts['graficos'] = time.perf_counter() - stage_start
+    kpi_rows = [{"Total de Consultorias": kpis.total, "Municípios Atendidos": len(kpis.municipios), "Estabelecimentos Visíveis": kpis.estabelecimentos}]
+    stage_start = time.perf_counter()
+    html = dashboard_report_html(start, end, kpi_rows, "", df_perf[SUMMARY_COLUMNS], figures, images)
+    timer_parts['html'] = time.perf_counter() - stage_start
+    try:
+        from weasyprint import HTML
+    except (ImportError, OSError) as e:
+        timer_parts['weasyprint'] = f"indisponível: {e}"
+        return None
+    stage_start = time.perf_counter()
+    pdf = HTML(string=html).write_pdf()
+    timer_parts['weasyprint'] = time.perf_counter() - stage_start
+    return pdf
+
+
+def benchmark_size(n_rows, refs, cache_dir, repeat=5, trace_memory=False, skip=()):
+    timer = StageTimer(trace_memory)
+    path = cached_export(n_rows, refs, cache_dir)
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    df_upload, stats = timer.run('leitura_upload', lambda: load_upload(data, path))
+    timer.results['leitura_upload']['motor'] = stats.engine
+    raw = generate_export(n_rows, refs)  # mesmo conteúdo, como o openpyxl entrega antes da normalização
+    timer.run('normalizacao', lambda: normalize_columns(raw.copy()))
+    raw = None  # libera antes das próximas etapas
+    df_enriched, df_estab = timer.run('referencias', lambda: enrich_teleconsultas(df_upload, refs))
+    df, df_estab = timer.run('codificacao', lambda: encode_teleconsultas(df_enriched, df_estab))
+    df_enriched = None
+    cube = timer.run('cubo', lambda: build_cube(df))
+    sketches = timer.run('sketches', lambda: build_response_sketches(df))
+    dataset = Dataset(df, df_estab, cube, sketches)
+    engines = timer.run('indices', lambda: build_engines(dataset))
+
+    start, end = (d.normalize() for d in engines.rows.date_bounds())
+    view = timer.run('filtros_sidebar', lambda: _sidebar(dataset, engines, start, end), repeat)
+    kpis = timer.run('kpis_fluxo', lambda: (compute_kpis(view.aggregates, refs), compute_flow(view.aggregates))[0], repeat)
+    df_perf = timer.run('performance', lambda: compute_performance(dataset, view.aggregates, kpis.municipios), repeat)
+    df_ts = timer.run('evolucao', lambda: monthly_evolution(view.aggregates_for(start, end), start, end), repeat)
+    df_pie, cat_count, sol_count = timer.run('distribuicoes', lambda: (specialty_distribution(view.aggregates), category_distribution(view.aggregates), requester_distribution(view)), repeat)
+    timer.run('percentis', lambda: [response_time_summary(view, start, end, by) for by in (None, 'Especialidade', 'Municipio Solicitante')], repeat)
+
+    detail_columns = [c for c in DETAIL_COLUMNS if c in df.columns]
+    timer.run('tabela_paginada', lambda: paginate(df, 2, 50, 'Data_Solicitacao', False, 'centro', detail_columns, view.positions, detail_columns), repeat)
+    details = view.frame(detail_columns)
+    if 'exportacao_excel' not in skip:
+        excel = timer.run('exportacao_excel', lambda: to_excel_report_bytes(df_perf[SUMMARY_COLUMNS], details))
+        timer.results['exportacao_excel']['bytes'] = len(excel)
+        for extension in ('csv', 'parquet'):
+            content = timer.run(f'exportacao_{extension}', lambda: export_bytes(details, extension))
+            timer.results[f'exportacao_{extension}']['bytes'] = len(content)
+    if 'exportacao_pdf' not in skip:
+        parts = {}
+        pdf = timer.run('exportacao_pdf', lambda: _pdf(refs, kpis, df_perf, df_ts, df_pie, cat_count, sol_count, start, end, parts))
+        timer.results['exportacao_pdf']['partes'] = parts
+        timer.results['exportacao_pdf']['bytes'] = len(pdf) if pdf else None
+
+    return {'linhas': n_rows, 'linhas_filtradas': view.n_rows, 'fonte_agregacoes': view.aggregates.source,
+            'memoria_df_mb': round(df.memory_usage(deep=True).sum() / 2**20, 1), 'pico_rss_total_mb': round(peak_rss_mb(), 1), 'etapas': timer.results}
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    import pyarrow
+    return {'data': datetime.now().isoformat(timespec='seconds'), 'commit': commit, 'python': platform.python_version(), 'pandas': pd.__version__,
+            'numpy': np.__version__, 'pyarrow': pyarrow.__version__, 'cpus': os.cpu_count(), 'plataforma': platform.platform()}
+
+
+def compare(before_path, after_path, threshold=0.10):
+    """Imprime a razão depois/antes por tamanho e etapa e marca as que ficaram mais de threshold mais lentas.
+
+    Tamanhos que falharam em um dos arquivos (sem 'etapas') são listados como
+    falha e não comparados; uma falha só no arquivo novo conta como regressão.
+    """
+    with open(before_path, encoding='utf-8') as f:
+        before = {r['linhas']: r for r in json.load(f)['resultados']}
+    with open(after_path, encoding='utf-8') as f:
+        after = {r['linhas']: r for r in json.load(f)['resultados']}
+    regressions = 0
+    for n_rows in sorted(set(before) & set(after)):
+        failed = {label: results[n_rows].get('erro', 'falhou') for label, results in [('antes', before), ('depois', after)] if 'etapas' not in results[n_rows]}
+        if failed:
+            print(f"\n{n_rows} linhas: falhou ({'; '.join(f'{label}: {error}' for label, error in failed.items())}), não comparado")
+            regressions += list(failed) == ['depois']
+            continue
+        print(f"\n{n_rows} linhas")
+        for stage in STAGES:
+            old, new = before[n_rows]['etapas'].get(stage), after[n_rows]['etapas'].get(stage)
+            if not old or not new:
+                continue
+            ratio = new['segundos'] / old['segundos'] if old['segundos'] else float('nan')
+            flag = '  <- regressão' if ratio > 1 + threshold and new['segundos'] - old['segundos'] > MIN_DIFF_SECONDS else ''
+            regressions += bool(flag)
+            print(f"  {stage:<18} {old['segundos']:9.3f} s -> {new['segundos']:9.3f} s  ({ratio:5.2f}x){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark das etapas do dashboard com dados sintéticos.")
+    parser.add_argument('--linhas', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--saida', help="arquivo JSON de saída (padrão: stdout)")
+    parser.add_argument('--repeticoes', type=int, default=5, help="repetições das etapas interativas (filtros, KPIs, gráficos)")
+    parser.add_argument('--tracemalloc', action='store_true', help="registra o pico de alocações por etapa (mais lento)")
+    parser.add_argument('--pular', action='append', default=[], choices=['exportacao_excel', 'exportacao_pdf'])
+    parser.add_argument('--comparar', nargs=2, metavar=('ANTES', 'DEPOIS'))
+    parser.add_argument('--um', type=int, help=argparse.SUPPRESS)  # uso interno: um tamanho, no processo atual
+    args = parser.parse_args(argv)
+
+    if args.comparar:
+        sys.exit(1 if compare(*args.comparar) else 0)
+
+    snapshot_dir = os.path.join(BASE_DIR, '.cache', 'referencias')
+    data_dir = os.path.join(BASE_DIR, '.cache', 'benchmarks')
+    if args.um:
+        refs = load_reference_data(BASE_DIR, snapshot_dir)
+        result = benchmark_size(args.um, refs, data_dir, args.repeticoes, args.tracemalloc, args.pular)
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return
+
+    results = []
+    for n_rows in args.linhas:
+        print(f"{n_rows} linhas...", file=sys.stderr)
+        # O resultado volta por arquivo: bibliotecas como a WeasyPrint escrevem avisos no stdout.
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result_path = os.path.join(tmp_dir, 'resultado.json')
+            command = [sys.executable, '-m', 'benchmarks.run', '--um', str(n_rows), '--repeticoes', str(args.repeticoes), '--saida', result_path]
+            command += ['--tracemalloc'] if args.tracemalloc else []
+            command += [item for stage in args.pular for item in ('--pular', stage)]
+            completed = subprocess.run(command, cwd=BASE_DIR, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(completed.stderr, file=sys.stderr)
+                results.append({'linhas': n_rows, 'erro': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'falhou'})
+                continue
+            with open(result_path, encoding='utf-8') as f:
+                results.append(json.load(f))
+    output = json.dumps({'meta': _metadata(), 'resultados': results}, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
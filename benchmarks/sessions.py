@@ -0,0 +1,182 @@
+"""Teste de carga com várias sessões simultâneas sobre o mesmo dataset.
+
+Simula o que cada sessão do dashboard mantém depois de uma execução com
+filtros aleatórios (visão filtrada, KPIs, performance, evolução, distribuições
+e uma página do detalhamento), com as sessões rodando em threads como no
+servidor do Streamlit, e mede quanto a memória privada do processo cresce por
+sessão. Dois modos:
+
+- compartilhado: o dataset é lido uma vez do cache em disco (memory-map) e
+  todas as sessões usam a mesma instância, com visões por posição (o app atual);
+- copia: cada sessão recebe uma cópia desserializada do dataset e guarda as
+  linhas filtradas copiadas (o que o st.cache_data e a visão antiga faziam).
+
+A memória privada (RssAnon) é a que cresce com as sessões; a mapeada de
+arquivos (RssFile), que inclui o dataset em memory-map além das bibliotecas,
+é compartilhada entre processos pelo cache de páginas do sistema.
+
+    python -m benchmarks.sessions --linhas 100000 --sessoes 30 --simultaneas 8 [--limite-mb 20]
+"""
+import argparse
+import gc
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.run import BASE_DIR
+from benchmarks.synthetic import cached_export
+from core.cache import DatasetCache
+from core.pipeline import Dataset, Selection, apply_filters, build_engines, category_distribution, compute_flow, compute_kpis, compute_performance, load_upload, monthly_evolution, prepare, requester_distribution, response_time_summary, specialty_distribution
+from core.profiling import current_rss_mb
+from core.reference import load_reference_data
+from core.reports import DETAIL_COLUMNS
+from core.tables import paginate
+
+MODES = ['compartilhado', 'copia']
+# Colunas em que as sessões simuladas escolhem filtros, e a fração máxima das opções selecionadas.
+SESSION_FILTERS = {'Situação': 0.6, 'Macrorregiao': 0.5, 'Especialidade': 0.3, 'Municipio Solicitante': 0.1}
+
+
+def memory_mb():
+    """(memória privada, memória mapeada de arquivos) do processo em MB; sem /proc, (RSS, 0)."""
+    values = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(('RssAnon:', 'RssFile:')):
+                    key, value = line.split(':')
+                    values[key] = int(value.split()[0]) / 1024
+        return values['RssAnon'], values['RssFile']
+    except (OSError, KeyError, ValueError):
+        return current_rss_mb(), 0.0
+
+
+def shared_dataset(n_rows, refs, data_dir):
+    """Dataset sintético lido do cache em disco via memory-map, preparado e gravado só na primeira vez."""
+    cache = DatasetCache(os.path.join(data_dir, 'sessoes'), max_bytes=8 * 2**30)
+    key = f"sessoes-{n_rows}-{refs.fingerprint[:12]}"
+    if cache.get(key) is None:
+        path = cached_export(n_rows, refs, data_dir)
+        with open(path, 'rb') as f:
+            df_upload, _ = load_upload(f.read(), path)
+        cache.put(key, prepare(df_upload, refs).frames())
+    return Dataset.from_frames(cache.get(key))
+
+
+def _random_selection(engines, rng):
+    start, end = (d.normalize() for d in engines.rows.date_bounds())
+    days = pd.date_range(start, end, freq='D')
+    lo, hi = sorted(rng.choice(len(days), size=2, replace=False))
+    mask = engines.rows.all_rows()
+    filters = {}
+    for col, fraction in SESSION_FILTERS.items():
+        options = engines.rows.options(col, mask) if col in engines.rows else []
+        if options and rng.random() < 0.5:
+            size = int(rng.integers(1, max(2, int(len(options) * fraction) + 1)))
+            filters[col] = list(rng.choice(options, size=min(size, len(options)), replace=False))
+            mask &= engines.rows.mask_for(col, filters[col])
+    return Selection(days[lo], days[hi], filters)
+
+
+def simulate_session(dataset, engines, refs, seed, copy):
+    """Objetos que uma sessão mantém após uma execução completa do dashboard com filtros aleatórios."""
+    rng = np.random.default_rng(seed)
+    if copy:
+        dataset = pickle.loads(pickle.dumps(dataset, protocol=pickle.HIGHEST_PROTOCOL))
+    selection = _random_selection(engines, rng)
+    view = apply_filters(dataset, engines, selection)
+    state = {'view': view}
+    if copy:
+        state['linhas'] = view.frame()
+    agg = view.aggregates
+    state['kpis'] = compute_kpis(agg, refs)
+    state['fluxo'] = compute_flow(agg)
+    state['performance'] = compute_performance(dataset, agg, state['kpis'].municipios)
+    if agg.total():
+        state['evolucao'] = monthly_evolution(view.aggregates_for(selection.start, selection.end), selection.start, selection.end)
+        state['especialidades'] = specialty_distribution(agg)
+    state['categorias'] = category_distribution(agg)
+    state['solicitantes'] = requester_distribution(view)
+    state['tempos'] = response_time_summary(view, selection.start, selection.end, 'Especialidade')
+    detail_columns = [c for c in DETAIL_COLUMNS if c in dataset.teleconsultorias.columns]
+    state['pagina'] = paginate(dataset.teleconsultorias, 1, 50, 'Data_Solicitacao', False, rows=view.positions, columns=detail_columns)
+    return state
+
+
+def load_test(n_rows, n_sessions, concurrency, mode, refs, data_dir):
+    dataset = shared_dataset(n_rows, refs, data_dir)
+    engines = build_engines(dataset)  # compartilhados pelo cache_resource nos dois modos
+    copy = mode == 'copia'
+    simulate_session(dataset, engines, refs, n_sessions, copy)  # aquece bibliotecas e caches internos
+    gc.collect()
+    private_base, file_base = memory_mb()
+    sessions, steps = [], []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for batch_start in range(0, n_sessions, concurrency):
+            seeds = range(batch_start, min(batch_start + concurrency, n_sessions))
+            sessions.extend(pool.map(lambda seed: simulate_session(dataset, engines, refs, seed, copy), seeds))
+            gc.collect()
+            private, mapped = memory_mb()
+            steps.append({'sessoes': len(sessions), 'privada_mb': round(private, 1), 'arquivo_mb': round(mapped, 1)})
+    private, mapped = memory_mb()
+    return {'modo': mode, 'linhas': n_rows, 'sessoes': n_sessions, 'simultaneas': concurrency,
+            'linhas_filtradas_media': round(float(np.mean([s['view'].n_rows for s in sessions])), 1),
+            'memoria_dataset_mb': round(sum(df.memory_usage(deep=True).sum() for df in dataset.frames().values()) / 2**20, 1),
+            'privada_inicial_mb': round(private_base, 1), 'arquivo_inicial_mb': round(file_base, 1),
+            'por_sessao_mb': round((private - private_base) / n_sessions, 2), 'evolucao': steps}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga de sessões simultâneas do dashboard.")
+    parser.add_argument('--linhas', type=int, default=100_000)
+    parser.add_argument('--sessoes', type=int, default=30)
+    parser.add_argument('--simultaneas', type=int, default=8, help="sessões executando ao mesmo tempo")
+    parser.add_argument('--modos', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--limite-mb', type=float, help="falha se o modo compartilhado passar deste acréscimo de memória por sessão")
+    parser.add_argument('--saida', help="arquivo JSON de saída")
+    parser.add_argument('--um', choices=MODES, help=argparse.SUPPRESS)  # uso interno: um modo, no processo atual
+    args = parser.parse_args(argv)
+
+    data_dir = os.path.join(BASE_DIR, '.cache', 'benchmarks')
+    if args.um:
+        refs = load_reference_data(BASE_DIR, os.path.join(BASE_DIR, '.cache', 'referencias'))
+        result = load_test(args.linhas, args.sessoes, args.simultaneas, args.um, refs, data_dir)
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return
+
+    # Cada modo num subprocesso próprio, para que a memória de um não conte no outro.
+    results = []
+    for mode in args.modos:
+        print(f"{mode}...", file=sys.stderr)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result_path = os.path.join(tmp_dir, 'resultado.json')
+            command = [sys.executable, '-m', 'benchmarks.sessions', '--um', mode, '--linhas', str(args.linhas), '--sessoes', str(args.sessoes),
+                       '--simultaneas', str(args.simultaneas), '--saida', result_path]
+            completed = subprocess.run(command, cwd=BASE_DIR, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(completed.stderr, file=sys.stderr)
+                sys.exit(completed.returncode)
+            with open(result_path, encoding='utf-8') as f:
+                results.append(json.load(f))
+    for result in results:
+        print(f"{result['modo']:<14} {result['sessoes']} sessões sobre {result['linhas']} linhas: {result['por_sessao_mb']:7.2f} MB privados por sessão "
+              f"(dataset de {result['memoria_dataset_mb']} MB, {result['arquivo_inicial_mb']} MB mapeados de arquivo)")
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    shared = next((r for r in results if r['modo'] == 'compartilhado'), None)
+    if args.limite_mb is not None and shared and shared['por_sessao_mb'] > args.limite_mb:
+        print(f"Acréscimo por sessão acima do limite de {args.limite_mb} MB.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Gerador de exportações sintéticas de teleconsultorias, no formato do relatório do sistema.
+
+Os cabeçalhos são os que o COL_MAP_FULL reconhece; municípios e
+estabelecimentos saem de estabelecimentos.xlsx (com peso proporcional à cota
+do município), os CBOs de categoria.xlsx (com uma fração não mapeada) e as
+datas cobrem setembro de 2024 a setembro de 2025 em horário comercial. Situação,
+Conduta, intenção de encaminhamento e tempo de resposta seguem distribuições
+plausíveis e coerentes entre si (canceladas não têm resposta nem conduta).
+
+    python -m benchmarks.synthetic 100000 saida.xlsx
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from core.exports import write_excel
+
+PERIOD_START, PERIOD_END = pd.Timestamp('2024-09-01'), pd.Timestamp('2025-09-30')
+SPECIALTIES = ['Cardiologia', 'Dermatologia', 'Endocrinologia', 'Psiquiatria', 'Neurologia', 'Reumatologia', 'Pediatria', 'Ginecologia e Obstetrícia', 'Ortopedia',
+               'Nefrologia', 'Gastroenterologia', 'Pneumologia', 'Oftalmologia', 'Otorrinolaringologia', 'Urologia', 'Hematologia', 'Infectologia', 'Geriatria',
+               'Nutrição', 'Fonoaudiologia', 'Estomaterapia', 'Enfermagem', 'Odontologia', 'Farmácia Clínica', 'Saúde Mental']
+SITUACOES = {'Respondida': 0.78, 'Cancelada': 0.08, 'Aguardando resposta': 0.09, 'Devolvida ao solicitante': 0.05}
+CONDUTAS = {'Manter na unidade': 0.36, 'Encaminhar niveis secundarios': 0.44, 'Encaminhar niveis terciarios': 0.12, None: 0.08}
+UNMAPPED_CBO_SHARE = 0.03
+
+
+def _choice(rng, distribution, n):
+    values = list(distribution)
+    index = rng.choice(len(values), size=n, p=np.array(list(distribution.values())) / sum(distribution.values()))
+    return np.array(values, dtype=object)[index]
+
+
+def _timestamps(rng, n):
+    days = pd.bdate_range(PERIOD_START, PERIOD_END)
+    day = days.values[rng.integers(0, len(days), n)]
+    minutes = np.clip(rng.normal(13 * 60, 150, n), 7 * 60, 19 * 60).astype(np.int64)
+    return pd.DatetimeIndex(day) + pd.to_timedelta(minutes, unit='min')
+
+
+def generate_export(n_rows, refs, seed=0):
+    """DataFrame com as colunas da exportação do sistema (datas em texto dd/mm/aaaa hh:mm)."""
+    rng = np.random.default_rng(seed)
+    estab = refs.estabelecimentos.dropna(subset=['Municipio Solicitante', 'Estabelecimento']).reset_index(drop=True)
+    per_municipio = estab.groupby('Municipio Solicitante')['Estabelecimento'].transform('count')
+    weights = (estab['CotaTotal'].clip(lower=0) / per_municipio + 1).to_numpy(dtype=float)
+    idx = rng.choice(len(estab), size=n_rows, p=weights / weights.sum())
+
+    cbos = refs.categoria['CBO'].dropna().astype(str).unique()
+    cbo = cbos[rng.integers(0, len(cbos), n_rows)].astype(object)
+    cbo[rng.random(n_rows) < UNMAPPED_CBO_SHARE] = '999999'
+
+    solicitada = _timestamps(rng, n_rows)
+    situacao = _choice(rng, SITUACOES, n_rows)
+    respondida = situacao == 'Respondida'
+    resposta = solicitada + pd.to_timedelta(rng.lognormal(np.log(30), 0.8, n_rows), unit='h')
+    conduta = _choice(rng, CONDUTAS, n_rows)
+    conduta[~respondida] = None
+    intencao = np.where(rng.random(n_rows) < 0.6, 'Sim', 'Não').astype(object)
+    concluida = np.where(respondida & (rng.random(n_rows) < 0.7), 'Sim', 'Não').astype(object)
+
+    n_solicitantes = max(50, n_rows // 15)
+    df = pd.DataFrame({
+        'Dt.Criação': solicitada.strftime('%d/%m/%Y %H:%M'),
+        'Município Solicitante': estab['Municipio Solicitante'].to_numpy()[idx],
+        'Estabelecimento': estab['Estabelecimento'].to_numpy()[idx],
+        'Especialidade': np.array(SPECIALTIES, dtype=object)[np.minimum(rng.zipf(1.6, n_rows) - 1, len(SPECIALTIES) - 1)],
+        'Solicitante': [f'Profissional {i:06d}' for i in rng.integers(0, n_solicitantes, n_rows)],
+        'Nome do Especialista': [f'Especialista {i:03d}' for i in rng.integers(0, 150, n_rows)],
+        'CBP': cbo,
+        'Conduta': conduta,
+        'Inten.Encaminhamento': intencao,
+        'Concluída?': concluida,
+        'Dt.1ª resposta': np.where(respondida, resposta.strftime('%d/%m/%Y %H:%M'), None),
+        'Situação': situacao,
+    })
+    return df
+
+
+def write_export(df, path):
+    """Grava como .xlsx pelo escritor em streaming do core.exports (1M linhas cabem sem estourar a memória)."""
+    write_excel(path, [('Teleconsultorias', df)])
+
+
+def cached_export(n_rows, refs, cache_dir, seed=0):
+    """Caminho de um .xlsx sintético com n_rows linhas, gerado só na primeira vez."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"teleconsultorias_{n_rows}_{seed}.xlsx")
+    if not os.path.exists(path):
+        tmp_path = path + '.tmp.xlsx'
+        write_export(generate_export(n_rows, refs, seed), tmp_path)
+        os.replace(tmp_path, path)
+    return path
+
+
+if __name__ == '__main__':
+    from core.reference import load_reference_data
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    n, target = int(sys.argv[1]), sys.argv[2]
+    write_export(generate_export(n, load_reference_data(base, os.path.join(base, '.cache', 'referencias'))), target)
+    print(f"{n} linhas gravadas em {target}.")
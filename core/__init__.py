@@ -0,0 +1 @@
+"""Núcleo de dados do dashboard de teleconsultorias, sem dependência do Streamlit."""
@@ -0,0 +1,124 @@
+"""Cache em disco dos dados já normalizados, em formato colunar (Arrow/Feather).
+
+Cada entrada é um diretório com um arquivo .arrow por tabela, identificado por
+uma chave derivada do conteúdo do upload e das planilhas de referência. Os
+arquivos são gravados sem compressão para poderem ser lidos via memory-map, e o
+tamanho total é limitado com descarte LRU (a data de modificação do diretório
+é atualizada a cada leitura).
+
+A leitura (read_arrow) não copia as colunas que o Arrow entrega direto ao
+pandas (códigos das categóricas, datas e números sem nulos): elas ficam nas
+páginas do arquivo mapeado, somente leitura, e são compartilhadas pelas
+sessões e pelos processos que abrirem o mesmo arquivo.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# Incrementar sempre que a preparação dos dados mudar de forma incompatível com entradas antigas.
+CACHE_SCHEMA_VERSION = 4
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_arrow(path):
+    """DataFrame de um .arrow sem compressão, via memory-map e sem copiar as colunas que admitem zero-cópia."""
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+
+def dataset_cache_key(upload_hash, reference_fingerprint):
+    """Chave do dataset: hash do upload + impressão digital das planilhas de referência + versão do esquema."""
+    parts = [f"v{CACHE_SCHEMA_VERSION}", upload_hash, reference_fingerprint]
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()[:32]
+
+
+def _arrow_safe(df):
+    """Converte para texto as colunas de objetos com tipos misturados, que o Arrow não aceita."""
+    df = df.reset_index(drop=True)
+    for col in df.columns[df.dtypes == object]:
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+class DatasetCache:
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """Retorna {nome: DataFrame} da entrada, ou None se ela não existir ou estiver corrompida."""
+        entry_dir = self._entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            return None
+        try:
+            frames = {}
+            for file_name in os.listdir(entry_dir):
+                if file_name.endswith('.arrow'):
+                    frames[file_name[:-len('.arrow')]] = read_arrow(os.path.join(entry_dir, file_name))
+            os.utime(entry_dir)
+            return frames or None
+        except (OSError, pa.ArrowException):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+    def put(self, key, frames):
+        """Grava {nome: DataFrame} de forma atômica e aplica o limite de tamanho."""
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            for name, df in frames.items():
+                feather.write_feather(_arrow_safe(df), os.path.join(tmp_dir, f"{name}.arrow"), compression='uncompressed')
+            entry_dir = self._entry_dir(key)
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(key)
+            if key.startswith('.tmp-') or not os.path.isdir(entry_dir):
+                continue
+            try:
+                size = sum(e.stat().st_size for e in os.scandir(entry_dir) if e.is_file())
+                entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self):
+        """Remove as entradas menos usadas recentemente até o total caber em max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def total_bytes(self):
+        return sum(size for _, size, _ in self._entries())
@@ -0,0 +1,131 @@
+"""Figuras Plotly do dashboard e do relatório PDF, a partir das tabelas do core.pipeline.
+
+Gráficos de barras com muitas categorias passam antes pela camada de dados
+daqui: o ranking vira top N + "Outros" e a performance por estabelecimento
+sobe para município, microrregião ou macrorregião quando há barras demais,
+com drill-down a partir do nível agregado. Assim o JSON da figura (enviado ao
+navegador e ao kaleido) fica limitado a MAX_BARS marcas por série.
+"""
+import os
+
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+PDF_TOP_N = 30
+MAX_BARS = int(os.environ.get('DASHBOARD_MAX_BARS', '40'))
+# Acima disso o gráfico de linha usa WebGL; as barras não têm versão WebGL no Plotly.
+WEBGL_MIN_POINTS = 1000
+OTHERS_LABEL = 'Outros'
+NO_REGION_LABEL = 'Sem regional'
+# Do mais agregado ao mais detalhado.
+PERFORMANCE_LEVELS = ['Macrorregiao', 'Microrregiao', 'Municipio Solicitante', 'Estabelecimento']
+LEVEL_LABELS = {'Macrorregiao': 'Macrorregião', 'Microrregiao': 'Microrregião', 'Municipio Solicitante': 'Município', 'Estabelecimento': 'Estabelecimento'}
+
+
+def top_n_with_others(df, label_col, value_col='count', n=MAX_BARS):
+    """As n maiores linhas de df e uma linha "Outros (k)" com a soma das demais; df já vem em ordem decrescente."""
+    if len(df) <= n:
+        return df
+    rest = df.iloc[n - 1:]
+    others = pd.DataFrame({label_col: [f"{OTHERS_LABEL} ({len(rest)})"], value_col: [rest[value_col].sum()]})
+    return pd.concat([df.iloc[:n - 1][[label_col, value_col]], others], ignore_index=True)
+
+
+def with_regions(df_perf, df_condicoes):
+    """df_perf com Microrregiao e Macrorregiao do município ("Sem regional" quando não há)."""
+    regions = [col for col in ['Microrregiao', 'Macrorregiao'] if col in df_condicoes.columns]
+    df = df_perf.drop(columns=[col for col in regions if col in df_perf.columns]).merge(df_condicoes[['Municipio Solicitante', *regions]].drop_duplicates('Municipio Solicitante'), on='Municipio Solicitante', how='left')
+    for col in regions:
+        df[col] = df[col].astype(object).fillna(NO_REGION_LABEL)
+    return df
+
+
+def _group_count(df_perf, level):
+    # Nomes de estabelecimento se repetem entre municípios; cada linha é uma barra.
+    return len(df_perf) if level == 'Estabelecimento' else df_perf[level].nunique()
+
+
+def performance_rollup(df_perf, drill=(), max_bars=MAX_BARS):
+    """(tabela do gráfico, nível) para o recorte drill [(nível, valor), ...].
+
+    O nível é o mais detalhado abaixo do recorte com até max_bars grupos; se nem
+    o mais agregado couber, ficam as max_bars - 1 maiores barras e "Outros".
+    """
+    for col, value in drill:
+        df_perf = df_perf[df_perf[col] == value]
+    start = PERFORMANCE_LEVELS.index(drill[-1][0]) + 1 if drill else 0
+    levels = [col for col in PERFORMANCE_LEVELS[start:] if col in df_perf.columns]
+    level = next((col for col in reversed(levels) if _group_count(df_perf, col) <= max_bars), levels[0])
+    if level == 'Estabelecimento':
+        grouped = df_perf[[level, 'Realizado_Periodo', 'CotaMensal_Estabelecimento']]  # um estabelecimento por linha, como na tabela
+    else:
+        grouped = df_perf.groupby(level, observed=True)[['Realizado_Periodo', 'CotaMensal_Estabelecimento']].sum().reset_index()
+    if len(grouped) > max_bars:
+        grouped = grouped.sort_values('Realizado_Periodo', ascending=False, kind='stable')
+        rest = grouped.iloc[max_bars - 1:]
+        others = pd.DataFrame({level: [f"{OTHERS_LABEL} ({len(rest)})"], 'Realizado_Periodo': [rest['Realizado_Periodo'].sum()], 'CotaMensal_Estabelecimento': [rest['CotaMensal_Estabelecimento'].sum()]})
+        grouped = pd.concat([grouped.iloc[:max_bars - 1], others], ignore_index=True)
+    return grouped, level
+
+
+def figure_marks(fig):
+    """Número de pontos/barras desenhados pela figura."""
+    marks = 0
+    for trace in fig.data:
+        values = getattr(trace, 'x', None)
+        if values is None:
+            values = getattr(trace, 'values', None)
+        marks += len(values) if values is not None else 0
+    return marks
+
+
+def performance_figure(df_perf, level='Estabelecimento'):
+    fig = go.Figure()
+    fig.add_trace(go.Bar(name='Realizado no Período', x=df_perf[level], y=df_perf['Realizado_Periodo'], marker_color="#33ac47"))
+    fig.add_trace(go.Bar(name='Cota Mensal', x=df_perf[level], y=df_perf['CotaMensal_Estabelecimento'], marker_color='#adb5bd'))
+    fig.update_layout(barmode='group', xaxis_tickangle=-90, title_text=f'Comparativo de Realizado vs. Meta por {LEVEL_LABELS[level]}', legend=dict(orientation="h", yanchor="top", y=-0.4, xanchor="center", x=0.5))
+    return fig
+
+
+def evolution_figure(df_ts):
+    fig = px.line(df_ts, x='Mês', y='Quantidade', text='Quantidade', title='Evolução Mensal das Teleconsultorias', markers=True, color_discrete_sequence=['#33ac47'],
+                  render_mode='webgl' if len(df_ts) > WEBGL_MIN_POINTS else 'auto')
+    fig.update_traces(textposition='top center')
+    fig.update_xaxes(type='category')
+    return fig
+
+
+def specialty_figure(df_pie_data):
+    fig = px.pie(df_pie_data, names='label', values='count', title='Distribuição por Especialidade e Média de Resposta (horas)', hole=0.3, color_discrete_sequence=px.colors.qualitative.Pastel)
+    fig.update_traces(textposition='inside', textinfo='percent')
+    return fig
+
+
+def category_figure(cat_count, title='Teleconsultorias por Categoria'):
+    return px.bar(cat_count, x='Categoria Profissional', y='count', title=title, labels={'count': 'Quantidade'}, color_discrete_sequence=['#33ac47'])
+
+
+def requester_figure(solicitante_count, title='Teleconsultorias por Solicitante', labels=None):
+    labels = labels or {'count': 'Quantidade', 'SolicitanteNome': 'Nome do Solicitante'}
+    return px.bar(solicitante_count, x='SolicitanteNome', y='count', title=title, labels=labels, color_discrete_sequence=['#33ac47'])
+
+
+def report_figures(fig_perf, fig_ts, fig_pie, df_spec_table, cat_count, fig_cat, solicitante_count, fig_sol):
+    """Figuras do relatório PDF ({título: {'fig', 'table'}}); categorias e solicitantes ficam no top 30."""
+    if len(cat_count) > PDF_TOP_N:
+        fig_cat = category_figure(cat_count.head(PDF_TOP_N), title=f'Top {PDF_TOP_N} Categorias')
+    if len(solicitante_count) > PDF_TOP_N:
+        fig_sol = requester_figure(solicitante_count.head(PDF_TOP_N), title=f'Top {PDF_TOP_N} Solicitantes', labels={'count': 'Quantidade'})
+    return {
+        "Comparativo de Realizado vs. Meta": {'fig': fig_perf},
+        "Evolução Mensal": {'fig': fig_ts},
+        "Distribuição por Especialidade": {'fig': fig_pie, 'table': df_spec_table},
+        "Distribuição por Categoria": {'fig': fig_cat},
+        "Distribuição por Solicitante": {'fig': fig_sol},
+    }
+
+
+def pdf_layout(figures):
+    """Cópias das figuras de {título: {'fig', ...}} com o layout usado nas imagens do PDF."""
+    return {title: go.Figure(fig_data['fig']).update_layout(height=450, margin=dict(l=60, r=20, t=50, b=180)) for title, fig_data in figures.items() if fig_data is not None and fig_data.get('fig') is not None}
@@ -0,0 +1,191 @@
+"""Cubo pré-agregado das teleconsultorias e agregações usadas pelo dashboard.
+
+O cubo é montado na ingestão agrupando as linhas por dia x município x
+estabelecimento x especialidade x categoria x situação (Monitor, Macro e
+Microrregião vêm junto, pois dependem só do município). Cada célula guarda a
+contagem, as somas das flags de conclusão/conduta/intenção e soma/contagem do
+tempo de resposta. Linhas de meia-noite exata ficam em células separadas e
+Data_Ref é o menor horário da célula, para que filtros de período com limites
+em dias inteiros (como os do dashboard) deem o mesmo resultado que o
+Series.between nas linhas. first_row guarda a menor posição da linha no df,
+o que permite reproduzir a ordem de empates do value_counts.
+
+RowAggregates e CubeAggregates têm a mesma interface; o dashboard usa o cubo
+quando nenhum filtro por solicitante/especialista está ativo. Ambas recebem a
+tabela inteira e as posições selecionadas, e cada agregação copia só as
+colunas que usa, nessas posições.
+
+Verificação contra as linhas: python -m core.cube arquivo.xlsx
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+from core.filters import FilterEngine
+from core.model import count_by, filter_options
+
+CUBE_DIMENSIONS = ['Municipio Solicitante', 'Monitor', 'Macrorregiao', 'Microrregiao', 'Estabelecimento', 'Especialidade', 'Categoria Profissional', 'Situação']
+ROW_LEVEL_FILTERS = ['SolicitanteNome', 'NomeEspecialista']
+MEASURE_FLAGS = ['Concluida_Sim', 'Conduta_Manter_UBS', 'Conduta_Enc_Secundario', 'Conduta_Enc_Terciario', 'Intencao_Encaminhar']
+
+
+def build_cube(df, positions=None):
+    """Agrega df (já codificado por core.model) no cubo diário.
+
+    positions informa a posição de cada linha de df no dataset completo quando
+    df é só um recorte (atualização incremental de alguns dias).
+    """
+    valid = df['Data_Solicitacao'].notna().to_numpy()
+    positions = np.arange(len(df)) if positions is None else np.asarray(positions)
+    rows = df[valid]
+    dims = [c for c in CUBE_DIMENSIONS if c in df.columns]
+    flags = [f for f in MEASURE_FLAGS if f in df.columns]
+    dia = rows['Data_Solicitacao'].dt.normalize()
+    frame = pd.DataFrame({'Dia': dia, 'Meia_Noite': rows['Data_Solicitacao'].eq(dia), **{d: rows[d] for d in dims}})
+    frame['n'] = np.ones(len(rows), dtype=np.int32)
+    frame['first_row'] = positions[valid].astype(np.int32)
+    frame['Data_Ref'] = rows['Data_Solicitacao']
+    for flag in flags:
+        frame[flag] = rows[flag].astype(np.int32)
+    aggregations = {'n': ('n', 'sum'), 'first_row': ('first_row', 'min'), 'Data_Ref': ('Data_Ref', 'min'), **{f: (f, 'sum') for f in flags}}
+    if 'Tempo_Resposta_Horas' in rows.columns:
+        frame['resp_sum'] = rows['Tempo_Resposta_Horas'].fillna(0.0)
+        frame['resp_count'] = rows['Tempo_Resposta_Horas'].notna().astype(np.int32)
+        aggregations.update(resp_sum=('resp_sum', 'sum'), resp_count=('resp_count', 'sum'))
+    cube = frame.groupby(['Dia', 'Meia_Noite', *dims], observed=True, dropna=False, sort=False).agg(**aggregations).reset_index()
+    return cube
+
+
+def cube_filter_engine(cube):
+    return FilterEngine(cube, columns=[c for c in CUBE_DIMENSIONS if c in cube.columns], date_column='Data_Ref')
+
+
+class RowAggregates:
+    """Agregações calculadas diretamente sobre as linhas filtradas (posições rows de df; None = todas)."""
+    source = 'linhas'
+
+    def __init__(self, df, rows=None):
+        self.df = df
+        self.rows = rows
+
+    def has(self, col):
+        return col in self.df.columns
+
+    def column(self, col):
+        return self.df[col] if self.rows is None else self.df[col].iloc[self.rows]
+
+    def frame(self, columns):
+        return self.df.iloc[slice(None) if self.rows is None else self.rows, self.df.columns.get_indexer(columns)]
+
+    def total(self):
+        return len(self.df) if self.rows is None else len(self.rows)
+
+    def flag_sum(self, flag):
+        return int(self.column(flag).sum())
+
+    def response_count(self):
+        return int(self.column('Tempo_Resposta_Horas').notna().sum()) if self.has('Tempo_Resposta_Horas') else 0
+
+    def mean_response(self):
+        return self.column('Tempo_Resposta_Horas').mean()
+
+    def present(self, col):
+        return filter_options(self.df, col, self.rows)
+
+    def counts_by(self, col):
+        return count_by(self.df, col, self.rows)
+
+    def mean_response_by(self, col):
+        result = self.frame([col, 'Tempo_Resposta_Horas']).groupby(col, observed=True)['Tempo_Resposta_Horas'].mean()
+        result.index = result.index.astype(object)
+        return result
+
+    def monthly_counts(self):
+        return self.frame(['Data_Solicitacao']).set_index('Data_Solicitacao').resample('MS').size()
+
+
+class CubeAggregates(RowAggregates):
+    """Mesmas agregações, respondidas a partir das células do cubo selecionadas."""
+    source = 'cubo'
+
+    def total(self):
+        return int(self.column('n').sum())
+
+    def response_count(self):
+        return int(self.column('resp_count').sum()) if self.has('resp_count') else 0
+
+    def mean_response(self):
+        count = self.column('resp_count').sum()
+        return self.column('resp_sum').sum() / count if count else np.nan
+
+    def counts_by(self, col):
+        grouped = self.frame([col, 'n', 'first_row']).groupby(col, observed=True).agg(count=('n', 'sum'), first_row=('first_row', 'min'))
+        grouped = grouped.sort_values('first_row')  # mesma ordem de primeira ocorrência das linhas
+        counts = pd.Series(grouped['count'].to_numpy(dtype=np.int64), index=pd.Index(grouped.index.astype(object), name=col), name='count')
+        return counts.sort_values(ascending=False).reset_index()
+
+    def mean_response_by(self, col):
+        grouped = self.frame([col, 'resp_sum', 'resp_count']).groupby(col, observed=True)[['resp_sum', 'resp_count']].sum()
+        result = (grouped['resp_sum'] / grouped['resp_count'].where(grouped['resp_count'] > 0)).rename('Tempo_Resposta_Horas')
+        result.index = result.index.astype(object)
+        return result
+
+    def monthly_counts(self):
+        return self.frame(['Data_Ref', 'n']).set_index('Data_Ref')['n'].resample('MS').sum().astype(np.int64)
+
+
+def _compare(rows, cube):
+    assert rows.total() == cube.total()
+    assert rows.response_count() == cube.response_count()
+    if rows.response_count():
+        assert np.isclose(rows.mean_response(), cube.mean_response())
+    for flag in MEASURE_FLAGS:
+        if rows.has(flag):
+            assert rows.flag_sum(flag) == cube.flag_sum(flag), flag
+    assert rows.present('Municipio Solicitante') == cube.present('Municipio Solicitante')
+    for col in ['Especialidade', 'Categoria Profissional', 'Estabelecimento']:
+        if rows.has(col):
+            pd.testing.assert_frame_equal(rows.counts_by(col), cube.counts_by(col))
+    if rows.response_count():
+        pd.testing.assert_series_equal(rows.mean_response_by('Especialidade').round(1), cube.mean_response_by('Especialidade').round(1), check_names=False)
+    if rows.total():
+        pd.testing.assert_series_equal(rows.monthly_counts(), cube.monthly_counts(), check_names=False, check_freq=False, check_dtype=False, check_index_type=False)
+
+
+def verify_against_rows(df, cube, n_trials=50, seed=0):
+    """Compara as agregações do cubo com as das linhas em combinações aleatórias de filtros."""
+    rng = np.random.default_rng(seed)
+    row_engine, cube_engine = FilterEngine(df), cube_filter_engine(cube)
+    start, end = row_engine.date_bounds()
+    days = pd.date_range(start.normalize(), end.normalize(), freq='D')
+    for _ in range(n_trials):
+        row_mask, cube_mask = row_engine.all_rows(), cube_engine.all_rows()
+        for col in rng.choice([c for c in CUBE_DIMENSIONS if c in cube_engine], size=2, replace=False):
+            options = row_engine.options(col, row_mask)
+            if options:
+                selection = list(rng.choice(options, size=min(len(options), int(rng.integers(1, 4))), replace=False))
+                row_mask &= row_engine.mask_for(col, selection)
+                cube_mask &= cube_engine.mask_for(col, selection)
+        lo, hi = sorted(rng.choice(days, size=2))
+        rows = RowAggregates(df, np.flatnonzero(row_mask & row_engine.date_mask(lo, hi)))
+        cells = CubeAggregates(cube, np.flatnonzero(cube_mask & cube_engine.date_mask(lo, hi)))
+        _compare(rows, cells)
+    return n_trials
+
+
+if __name__ == '__main__':
+    import os
+    import time
+    from core.ingestion import read_upload
+    from core.preparation import prepare_dataset
+    from core.reference import load_reference_data
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = sys.argv[1]
+    with open(path, 'rb') as f:
+        df_upload, _ = read_upload(f.read(), path)
+    df_prepared, _ = prepare_dataset(df_upload, load_reference_data(base, os.path.join(base, '.cache', 'referencias')))
+    start = time.perf_counter()
+    cube = build_cube(df_prepared)
+    print(f"Cubo com {len(cube)} células para {len(df_prepared)} linhas, montado em {time.perf_counter() - start:.2f} s.")
+    print(f"{verify_against_rows(df_prepared, cube)} combinações de filtros conferidas: cubo igual às linhas.")
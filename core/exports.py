@@ -0,0 +1,105 @@
+"""Exportação de tabelas para Excel, CSV e Parquet.
+
+O Excel é gravado pelo xlsxwriter em modo constant_memory: as linhas vão para
+o arquivo em blocos de CHUNK_ROWS, convertidas bloco a bloco, e cada linha é
+descartada assim que a seguinte começa. Nesse modo a escrita precisa ser linha
+a linha (o DataFrame.to_excel do pandas escreve por coluna e perderia dados).
+As larguras das colunas saem das categorias presentes, de um tamanho fixo para
+datas ou de uma amostra das demais colunas, sem converter a coluna inteira
+para texto.
+
+CSV e Parquet são o caminho rápido para extrações grandes e não têm o limite
+de linhas de uma planilha.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+CHUNK_ROWS = 50_000
+SAMPLE_ROWS = 20_000
+EXCEL_MAX_ROWS = 1_048_575  # linhas de dados numa planilha, descontado o cabeçalho
+DATETIME_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+DATETIME_WIDTH = len('2025-01-01 00:00:00')
+# Mesmo estilo de cabeçalho do DataFrame.to_excel.
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_FORMATS = {
+    'Excel (.xlsx)': ('xlsx', EXCEL_MIME),
+    'CSV (.csv)': ('csv', 'text/csv'),
+    'Parquet (.parquet)': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def _values_width(series, sample_rows):
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return DATETIME_WIDTH if series.notna().any() else 0
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        present = series.cat.categories[np.unique(codes[codes >= 0])]
+        return int(present.astype(str).str.len().max()) if len(present) else 0
+    if len(series) > sample_rows:
+        series = series.sample(sample_rows, random_state=0)
+    values = pd.Series(series.dropna().unique())
+    return int(values.astype(str).str.len().max()) if len(values) else 0
+
+
+def column_widths(df, sample_rows=SAMPLE_ROWS):
+    """Largura de cada coluna (maior texto entre os valores e o cabeçalho, mais 2)."""
+    return [max(_values_width(df[col], sample_rows), len(str(col))) + 2 for col in df.columns]
+
+
+def _cell_values(series):
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def _rows(df, chunk_rows):
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        yield from zip(*(_cell_values(chunk[col]) for col in chunk.columns))
+
+
+def write_excel(target, sheets, chunk_rows=CHUNK_ROWS):
+    """Grava [(nome da aba, DataFrame), ...] num .xlsx; target é um caminho ou arquivo binário."""
+    for sheet_name, df in sheets:
+        if len(df) > EXCEL_MAX_ROWS:
+            raise ValueError(f"A aba {sheet_name} teria {len(df)} linhas, acima do limite do Excel; exporte em CSV ou Parquet.")
+    workbook = xlsxwriter.Workbook(target, {'constant_memory': True, 'default_date_format': DATETIME_FORMAT})
+    header_format = workbook.add_format(HEADER_FORMAT)
+    for sheet_name, df in sheets:
+        worksheet = workbook.add_worksheet(sheet_name)
+        for idx, width in enumerate(column_widths(df)):
+            worksheet.set_column(idx, idx, width)
+        worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+        for row_idx, row in enumerate(_rows(df, chunk_rows), start=1):
+            worksheet.write_row(row_idx, 0, row)
+    workbook.close()
+
+
+def to_excel_bytes(sheets):
+    output = io.BytesIO()
+    write_excel(output, sheets)
+    return output.getvalue()
+
+
+def to_csv_bytes(df):
+    """CSV com ; e BOM, como o Excel em português abre sem perguntar a codificação."""
+    return df.to_csv(index=False, sep=';').encode('utf-8-sig')
+
+
+def to_parquet_bytes(df):
+    output = io.BytesIO()
+    df.to_parquet(output, index=False)
+    return output.getvalue()
+
+
+def export_bytes(df, extension, sheet_name='Dados'):
+    """Conteúdo do arquivo de df no formato da extensão ('xlsx', 'csv' ou 'parquet')."""
+    if extension == 'xlsx':
+        return to_excel_bytes([(sheet_name, df)])
+    if extension == 'csv':
+        return to_csv_bytes(df)
+    if extension == 'parquet':
+        return to_parquet_bytes(df)
+    raise ValueError(f"Formato de exportação desconhecido: {extension}")
@@ -0,0 +1,86 @@
+"""Motor de filtros da barra lateral baseado em índice invertido.
+
+Construído uma vez por dataset: para cada coluna filtrável guarda os números
+de linha agrupados por código da categoria (argsort estável + offsets), de modo
+que as linhas de um valor são uma fatia ordenada de um array. Aplicar uma
+seleção é marcar essas linhas numa máscara booleana e intersectá-la com as
+anteriores; as opções em cascata saem dos códigos das linhas ainda ativas, sem
+reprocessar texto. O período usa um índice ordenado de Data_Solicitacao e
+busca binária.
+"""
+import numpy as np
+import pandas as pd
+
+FILTER_COLUMNS = ['Situação', 'Monitor', 'Macrorregiao', 'Microrregiao', 'Municipio Solicitante', 'Estabelecimento', 'Especialidade', 'Categoria Profissional', 'SolicitanteNome', 'NomeEspecialista']
+
+
+class _InvertedIndex:
+    def __init__(self, series):
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype('category')
+        self.categories = series.cat.categories
+        codes = series.cat.codes.to_numpy()
+        self.codes = codes
+        # Nulos (código -1) são deslocados para a posição 0 e nunca selecionados.
+        counts = np.bincount(codes.astype(np.int64) + 1, minlength=len(self.categories) + 1)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.rows = np.argsort(codes, kind='stable').astype(np.int32)
+        self.present = list(self.categories[np.flatnonzero(counts[1:])])
+
+    def rows_for(self, values):
+        codes = self.categories.get_indexer(pd.Index(values, dtype=object))
+        codes = np.sort(codes[codes >= 0]) + 1
+        if len(codes) == 1:
+            return self.rows[self.offsets[codes[0]]:self.offsets[codes[0] + 1]]
+        return np.concatenate([self.rows[self.offsets[c]:self.offsets[c + 1]] for c in codes]) if len(codes) else np.empty(0, dtype=np.int32)
+
+    def options(self, mask):
+        codes = self.codes[mask]
+        present = np.flatnonzero(np.bincount(codes[codes >= 0], minlength=len(self.categories)))
+        return list(self.categories[present])
+
+
+class FilterEngine:
+    def __init__(self, df, columns=FILTER_COLUMNS, date_column='Data_Solicitacao'):
+        self.n_rows = len(df)
+        self._indexes = {col: _InvertedIndex(df[col]) for col in columns if col in df.columns}
+        self._date_rows = np.empty(0, dtype=np.int32)
+        self._sorted_dates = np.empty(0, dtype='datetime64[ns]')
+        if date_column in df.columns:
+            dates = df[date_column].to_numpy(dtype='datetime64[ns]')
+            valid_rows = np.flatnonzero(~np.isnat(dates))
+            self._date_rows = valid_rows[np.argsort(dates[valid_rows], kind='stable')].astype(np.int32)
+            self._sorted_dates = dates[self._date_rows]
+
+    def __contains__(self, col):
+        return col in self._indexes
+
+    def all_rows(self):
+        return np.ones(self.n_rows, dtype=bool)
+
+    def mask_for(self, col, values):
+        """Máscara das linhas cujo valor em col está em values."""
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[self._indexes[col].rows_for(values)] = True
+        return mask
+
+    def options(self, col, mask=None):
+        """Valores de col presentes nas linhas ativas, em ordem; sem máscara usa a lista pré-calculada."""
+        index = self._indexes[col]
+        if mask is None or mask.all():
+            return index.present
+        return index.options(mask)
+
+    def date_bounds(self):
+        """(menor, maior) Data_Solicitacao válida, ou None se não houver datas."""
+        if not len(self._sorted_dates):
+            return None
+        return pd.Timestamp(self._sorted_dates[0]), pd.Timestamp(self._sorted_dates[-1])
+
+    def date_mask(self, start, end):
+        """Máscara de start <= Data_Solicitacao <= end (mesma semântica do Series.between)."""
+        lo = np.searchsorted(self._sorted_dates, pd.Timestamp(start).to_datetime64(), side='left')
+        hi = np.searchsorted(self._sorted_dates, pd.Timestamp(end).to_datetime64(), side='right')
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[self._date_rows[lo:hi]] = True
+        return mask
@@ -0,0 +1,253 @@
+"""Histórico local das teleconsultorias com carga incremental.
+
+Em vez de reenviar todo o histórico, o upload traz só os dias recentes e é
+mesclado a um armazenamento local (Arrow) já preparado. Cada linha recebe uma
+chave estável: a coluna de identificação do sistema, se o relatório tiver uma,
+ou o hash de Data_Solicitacao + SolicitanteNome + Estabelecimento +
+Especialidade (mais a ordem de ocorrência, para não fundir solicitações
+idênticas). Um hash do conteúdo identifica linhas alteradas (ex.: situação ou
+resposta novas). Só as linhas novas ou alteradas são enriquecidas e
+codificadas; o realizado do ano de referência por município é atualizado
+somando/subtraindo as contribuições e o cubo e os sketches do tempo de
+resposta são remontados apenas nos dias tocados. Linhas alteradas mantêm sua posição; novas entram no final.
+
+Uploads já aplicados (pelo sha256) são ignorados. Se as planilhas de
+referência mudarem, o histórico é re-enriquecido por inteiro uma vez.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+from core.cache import _arrow_safe, read_arrow
+from core.cube import build_cube
+from core.ingestion import find_existing
+from core.model import extend_encoding, share_categories
+from core.preparation import apply_quotas, count_realizado, enrich_rows, prepare_dataset
+from core.sketches import build_response_sketches
+
+STORE_VERSION = 1
+ID_CANDIDATES = ['ID', 'Id', 'Código', 'Codigo', 'Protocolo', 'Nº Solicitação', 'Número da Solicitação']
+KEY_COLUMNS = ['Data_Solicitacao', 'SolicitanteNome', 'Estabelecimento', 'Especialidade']
+KEY_COLUMN, CONTENT_COLUMN = '_chave', '_conteudo'
+# Colunas criadas pela preparação; removidas antes de re-enriquecer o histórico.
+DERIVED_COLUMNS = ['Categoria Profissional', 'Monitor', 'Macrorregiao', 'Microrregiao', 'Concluida_Sim', 'Cancelada', 'Conduta_Manter_UBS', 'Conduta_Enc_Secundario', 'Conduta_Enc_Terciario', 'Intencao_Encaminhar', 'Tempo_Resposta_Horas']
+
+
+@dataclass
+class AppendStats:
+    novas: int
+    atualizadas: int
+    inalteradas: int
+    dias_recalculados: int
+    seconds: float
+    total: int
+
+
+def row_keys(df):
+    """(chave, conteúdo) por linha do upload normalizado, como arrays uint64."""
+    id_col = find_existing(ID_CANDIDATES, df.columns)
+    key_cols = [id_col] if id_col else [c for c in KEY_COLUMNS if c in df.columns]
+    if not key_cols:
+        raise ValueError("O relatório não tem colunas suficientes para identificar as teleconsultorias.")
+    base = pd.util.hash_pandas_object(_arrow_safe(df[key_cols]), index=False)
+    occurrence = base.groupby(base.to_numpy()).cumcount()
+    keys = pd.util.hash_pandas_object(pd.DataFrame({'base': base.to_numpy(), 'n': occurrence.to_numpy()}), index=False)
+    content = pd.util.hash_pandas_object(_arrow_safe(df), index=False)
+    return keys.to_numpy(), content.to_numpy()
+
+
+def _realizado_frame(realizado):
+    return realizado.rename_axis('Municipio Solicitante').reset_index(name='Realizado_AnoRef')
+
+
+class TeleconsultaStore:
+    """Histórico preparado em disco: teleconsultorias, estabelecimentos, cubo e realizado por município."""
+
+    TABLES = ['teleconsultorias', 'estabelecimentos', 'cubo', 'realizado', 'tempos']
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(directory)), exist_ok=True)
+
+    def manifest(self):
+        try:
+            with open(os.path.join(self.directory, 'manifest.json'), encoding='utf-8') as f:
+                manifest = json.load(f)
+            return manifest if manifest.get('store_version') == STORE_VERSION else None
+        except (OSError, ValueError):
+            return None
+
+    def exists(self):
+        return self.manifest() is not None
+
+    def version(self):
+        manifest = self.manifest()
+        return manifest['version'] if manifest else None
+
+    def is_applied(self, upload_hash):
+        manifest = self.manifest()
+        return bool(manifest) and upload_hash in manifest['uploads']
+
+    def load(self):
+        """{nome: DataFrame} do histórico, lido via memory-map (somente leitura; ver core.cache.read_arrow)."""
+        paths = {name: os.path.join(self.directory, f"{name}.arrow") for name in self.TABLES}
+        frames = {name: read_arrow(path) for name, path in paths.items() if name != 'tempos' or os.path.exists(path)}
+        if 'tempos' not in frames:  # históricos gravados antes dos sketches; passam a tê-los na próxima carga
+            frames['tempos'] = build_response_sketches(frames['teleconsultorias'])
+        return frames
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def sync_references(self, refs):
+        """Re-enriquece o histórico se as planilhas de referência mudaram; retorna True se recalculou."""
+        with self._lock:
+            manifest = self.manifest()
+            if manifest is None or manifest['reference_fingerprint'] == refs.fingerprint:
+                return False
+            frames = self._build(self._decoded(self.load()['teleconsultorias']), refs)
+            version = hashlib.sha256(f"{manifest['version']}|{refs.fingerprint}".encode()).hexdigest()[:32]
+            self._write(frames, {**manifest, 'version': version, 'reference_fingerprint': refs.fingerprint})
+            return True
+
+    def append(self, df_upload, upload_hash, refs):
+        """Mescla o upload normalizado ao histórico e retorna AppendStats."""
+        with self._lock:
+            start = time.perf_counter()
+            manifest = self.manifest()
+            if manifest and upload_hash in manifest['uploads']:
+                return AppendStats(0, 0, len(df_upload), 0, 0.0, manifest['rows'])
+            keys, content = row_keys(df_upload)
+            df_upload = df_upload.assign(**{KEY_COLUMN: keys, CONTENT_COLUMN: content})
+            if manifest is None:
+                frames = self._build(df_upload, refs)
+                stats = AppendStats(len(df_upload), 0, 0, frames['cubo']['Dia'].nunique(), 0.0, len(df_upload))
+                uploads = []
+            else:
+                frames = self.load()
+                if manifest['reference_fingerprint'] != refs.fingerprint:
+                    frames = self._build(self._decoded(frames['teleconsultorias']), refs)
+                frames, stats = self._merge(frames, df_upload, refs)
+                uploads = manifest['uploads']
+            version = manifest['version'] if manifest else ''
+            if stats.novas or stats.atualizadas or manifest is None or manifest['reference_fingerprint'] != refs.fingerprint:
+                version = hashlib.sha256(f"{version}|{upload_hash}|{refs.fingerprint}".encode()).hexdigest()[:32]
+            new_manifest = {'store_version': STORE_VERSION, 'version': version, 'reference_fingerprint': refs.fingerprint, 'uploads': uploads + [upload_hash], 'rows': len(frames['teleconsultorias'])}
+            if manifest and version == manifest['version']:
+                self._write_manifest(self.directory, new_manifest)  # nada mudou: só registra o upload
+            else:
+                self._write(frames, new_manifest)
+            stats.seconds = time.perf_counter() - start
+            return stats
+
+    def _build(self, df_rows, refs):
+        df, _ = prepare_dataset(df_rows, refs)
+        realizado = count_realizado(df)
+        return {'teleconsultorias': df, 'estabelecimentos': self._estabelecimentos(df, realizado, refs), 'cubo': build_cube(df), 'realizado': _realizado_frame(realizado), 'tempos': build_response_sketches(df)}
+
+    @staticmethod
+    def _decoded(df):
+        df = df.drop(columns=[c for c in DERIVED_COLUMNS if c in df.columns])
+        for col in df.columns[df.dtypes == 'category']:
+            df[col] = df[col].astype(object)
+        return df
+
+    @staticmethod
+    def _estabelecimentos(df, realizado, refs):
+        return share_categories(apply_quotas(refs.estabelecimentos, _realizado_frame(realizado)), df)
+
+    def _merge(self, frames, df_upload, refs):
+        hist = frames['teleconsultorias']
+        positions = pd.Index(hist[KEY_COLUMN].to_numpy()).get_indexer(df_upload[KEY_COLUMN].to_numpy())
+        existing = positions >= 0
+        changed = existing & (hist[CONTENT_COLUMN].to_numpy()[np.where(existing, positions, 0)] != df_upload[CONTENT_COLUMN].to_numpy())
+        novas, atualizadas = int((~existing).sum()), int(changed.sum())
+        stats = AppendStats(novas, atualizadas, len(df_upload) - novas - atualizadas, 0, 0.0, len(hist))
+        if not novas and not atualizadas:
+            return frames, stats
+
+        # Colunas que o histórico não tem são descartadas; as que faltam no upload ficam nulas.
+        delta = enrich_rows(df_upload[changed | ~existing].reset_index(drop=True), refs).reindex(columns=hist.columns)
+        hist, delta = extend_encoding(hist, delta)
+        replaced = positions[changed]
+        old_rows = hist.iloc[replaced]
+
+        realizado = frames['realizado'].set_index('Municipio Solicitante')['Realizado_AnoRef']
+        realizado = realizado.add(count_realizado(delta), fill_value=0).sub(count_realizado(old_rows), fill_value=0)
+        realizado = realizado[realizado > 0].astype(int)
+
+        is_update = changed[changed | ~existing]
+        for col in hist.columns:
+            values = hist[col].copy()
+            values.iloc[replaced] = delta.loc[is_update, col].to_numpy()
+            hist[col] = values
+        hist = pd.concat([hist, delta[~is_update]], ignore_index=True)
+
+        cube = frames['cubo']
+        days = pd.concat([old_rows['Data_Solicitacao'], delta['Data_Solicitacao']]).dropna().dt.normalize().unique()
+        touched = hist['Data_Solicitacao'].dt.normalize().isin(days).to_numpy()
+        for col in cube.columns[cube.dtypes == 'category']:
+            cube[col] = cube[col].cat.set_categories(hist[col].cat.categories)
+        rebuilt = build_cube(hist[touched], positions=np.flatnonzero(touched))
+        cube = pd.concat([cube[~cube['Dia'].isin(days)], rebuilt[cube.columns]], ignore_index=True)
+        sketches = frames['tempos']
+        for col in sketches.columns[sketches.dtypes == 'category']:
+            sketches[col] = sketches[col].cat.set_categories(hist[col].cat.categories)
+        sketches = pd.concat([sketches[~sketches['Dia'].isin(days)], build_response_sketches(hist[touched])[sketches.columns]], ignore_index=True)
+
+        stats.dias_recalculados = len(days)
+        stats.total = len(hist)
+        frames = {'teleconsultorias': hist, 'estabelecimentos': self._estabelecimentos(hist, realizado, refs), 'cubo': cube, 'realizado': _realizado_frame(realizado), 'tempos': sketches}
+        return frames, stats
+
+    @staticmethod
+    def _write_manifest(directory, manifest):
+        tmp_path = os.path.join(directory, 'manifest.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(directory, 'manifest.json'))
+
+    def _write(self, frames, manifest):
+        parent = os.path.dirname(os.path.abspath(self.directory))
+        tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp-hist-')
+        try:
+            for name, df in frames.items():
+                feather.write_feather(_arrow_safe(df), os.path.join(tmp_dir, f"{name}.arrow"), compression='uncompressed')
+            self._write_manifest(tmp_dir, manifest)
+            old_dir = None
+            if os.path.isdir(self.directory):
+                old_dir = tempfile.mkdtemp(dir=parent, prefix='.old-hist-')
+                os.replace(self.directory, os.path.join(old_dir, 'hist'))
+            os.replace(tmp_dir, self.directory)
+            if old_dir:
+                shutil.rmtree(old_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+
+if __name__ == '__main__':
+    import sys
+    from core.cache import hash_bytes
+    from core.ingestion import read_upload
+    from core.reference import load_reference_data
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    refs = load_reference_data(base, os.path.join(base, '.cache', 'referencias'))
+    store = TeleconsultaStore(os.path.join(base, '.cache', 'historico'))
+    for path in sys.argv[1:]:
+        with open(path, 'rb') as f:
+            data = f.read()
+        df_upload, ingest = read_upload(data, path)
+        result = store.append(df_upload, hash_bytes(data), refs)
+        print(f"{path}: {result.novas} novas, {result.atualizadas} atualizadas, {result.inalteradas} inalteradas, "
+              f"{result.dias_recalculados} dias do cubo recalculados; leitura {ingest.parse_seconds:.2f} s + mescla {result.seconds:.2f} s; histórico com {result.total} linhas.")
@@ -0,0 +1,192 @@
+"""Leitura do relatório de teleconsultorias enviado por upload.
+
+O .xlsx é percorrido uma única vez em modo somente-leitura do openpyxl e as
+colunas usadas pelo dashboard já saem com o tipo final. O caminho antigo
+(carregar, salvar e reler o arquivo) fica apenas como fallback para planilhas
+malformadas que o modo streaming não consegue abrir.
+"""
+import io
+import os
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+COL_MAP_FULL = {'Municipio Solicitante': ['Municipio Solicitante', 'Município Solicitante', 'Municipio'], 'Estabelecimento': ['Estabelecimento', 'Estabelecimento do Solicitante', 'Estabelecimento Solicitante', 'Unidade de Saúde'], 'Especialidade': ['Especialidade', 'Especialty', 'Specialty'], 'SolicitanteNome': ['Solicitante', 'Nome do Solicitante', 'Profissional Solicitante'], 'NomeEspecialista': ['Nome do Especialista', 'Nome do Especialista Teleconsultor', 'Especialista'], 'CBP': ['CBP', 'cbo'], 'Conduta': ['Conduta'], 'Inten.Encaminhamento': ['Inten.Encaminhamento'], 'Concluida?': ['Concluída?', 'Concluida?'], 'Data_Solicitacao': ['Data Solicitação', 'Data Solicitacao', 'Data_Solicitacao', 'Dt.Criação'], 'Data_Resposta': ['Data Resposta', 'Data_Resposta', 'Dt.1ª resposta'], 'Situação': ['Situação', 'Situacao', 'Status']}
+DATE_COLUMNS = ['Data_Solicitacao', 'Data_Resposta']
+
+
+@dataclass
+class IngestStats:
+    engine: str
+    rows: int
+    parse_seconds: float
+    memory_mb: float  # aumento de memória durante a leitura (ver memory_source)
+    memory_source: str
+
+
+def find_existing(col_list, df_cols):
+    for candidate in col_list:
+        for c in df_cols:
+            if str(c).strip().lower() == str(candidate).strip().lower(): return c
+    return None
+
+
+def canonical_rename(columns, col_map=COL_MAP_FULL):
+    """Retorna o dicionário {coluna original: nome canônico} para as colunas encontradas."""
+    mapped = {canonical: find_existing(candidates, columns) for canonical, candidates in col_map.items()}
+    return {v: k for k, v in mapped.items() if v is not None}
+
+
+def convert_column(name, values):
+    """Converte uma coluna já com nome canônico para o tipo final usado pelo dashboard."""
+    series = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    if name in DATE_COLUMNS:
+        return pd.to_datetime(series, errors='coerce', dayfirst=True)
+    if name == 'Concluida?':
+        return series.fillna(np.nan).astype(str).str.lower().str.strip()
+    if name == 'CBP':
+        return series.fillna(np.nan).astype(str).str.replace(r'\.0$', '', regex=True)
+    if series.dtype == object:
+        return series.infer_objects()
+    return series
+
+
+def normalize_columns(df):
+    """Aplica o mapeamento canônico e os tipos finais a um DataFrame já lido."""
+    df = df.rename(columns=canonical_rename(df.columns))
+    for col in ['Concluida?', 'CBP', *DATE_COLUMNS]:
+        if col in df.columns:
+            df[col] = convert_column(col, df[col])
+    return df
+
+
+def _header_names(header_row):
+    """Nomes de colunas no mesmo padrão do pd.read_excel (Unnamed: n e sufixos .1, .2 para duplicatas)."""
+    names, seen = [], {}
+    for i, value in enumerate(header_row):
+        name = f"Unnamed: {i}" if value is None or (isinstance(value, str) and not value.strip()) else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def peak_rss_mb():
+    """Pico de memória residente do processo (MB), ou NaN onde não há como medir."""
+    if resource is None:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+
+def current_rss_mb():
+    """Memória residente atual do processo (MB); onde /proc não existe, o pico."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def rss_growth_mb(rss_before, peak_before):
+    """Quanto a RSS subiu desde rss_before: até o novo pico, se o pico do processo subiu no meio, senão até a RSS atual.
+
+    O pico do processo (ru_maxrss) sozinho não serve num servidor de longa
+    duração: depois do primeiro arquivo grande ele fica parado e não diz nada
+    sobre as leituras seguintes.
+    """
+    peak = peak_rss_mb()
+    reached = peak if peak > peak_before else current_rss_mb()
+    return max(reached - rss_before, 0.0)
+
+
+def _read_xlsx_streaming(data):
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        # Exportações do sistema às vezes gravam uma dimensão errada; sem isso o modo read-only trunca as linhas.
+        worksheet.reset_dimensions()
+        rows = worksheet.iter_rows(values_only=True)
+        header_row = next(rows, None)
+        if not header_row or all(v is None for v in header_row):
+            raise ValueError("Planilha sem linha de cabeçalho.")
+        while header_row and header_row[-1] is None:
+            header_row = header_row[:-1]
+        names = _header_names(header_row)
+        n_cols = len(names)
+        columns = [[] for _ in range(n_cols)]
+        for row in rows:
+            row = row[:n_cols]
+            if all(v is None for v in row):
+                continue
+            if len(row) < n_cols:
+                row = row + (None,) * (n_cols - len(row))
+            for values, value in zip(columns, row):
+                values.append(value)
+    finally:
+        workbook.close()
+    rename = canonical_rename(names)
+    data_dict = {}
+    for i, name in enumerate(names):
+        final_name = rename.get(name, name)
+        data_dict[final_name] = convert_column(final_name, columns[i])
+        columns[i] = None  # libera a lista de objetos assim que a coluna tipada existe
+    return pd.DataFrame(data_dict)
+
+
+def _read_xlsx_roundtrip(data):
+    workbook = load_workbook(io.BytesIO(data))
+    cleaned_buffer = io.BytesIO()
+    workbook.save(cleaned_buffer)
+    cleaned_buffer.seek(0)
+    return normalize_columns(pd.read_excel(cleaned_buffer, engine='openpyxl'))
+
+
+def read_upload(data, file_name, trace_memory=False):
+    """Lê o relatório de teleconsultorias (.xls/.xlsx) e retorna (DataFrame normalizado, IngestStats).
+
+    Por padrão a memória informada é quanto a RSS do processo subiu durante a
+    leitura (rss_growth_mb), que não custa nada medir mas também conta o que
+    outras sessões alocarem ao mesmo tempo. Com trace_memory=True usa-se o pico
+    do tracemalloc, que isola a leitura mas a deixa várias vezes mais lenta;
+    serve para benchmarks, não para produção.
+    """
+    already_tracing = tracemalloc.is_tracing()
+    if trace_memory:
+        if not already_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+    rss_before, peak_before = current_rss_mb(), peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        if file_name.endswith('.xlsx'):
+            try:
+                df, engine = _read_xlsx_streaming(data), 'openpyxl-streaming'
+            except Exception:
+                df, engine = _read_xlsx_roundtrip(data), 'openpyxl-roundtrip'
+        elif file_name.endswith('.xls'):
+            df, engine = normalize_columns(pd.read_excel(io.BytesIO(data), engine='xlrd')), 'xlrd'
+        else:
+            raise ValueError("Formato de arquivo não suportado. Por favor, use .xls ou .xlsx.")
+        elapsed = time.perf_counter() - start
+        if trace_memory:
+            memory_mb, memory_source = tracemalloc.get_traced_memory()[1] / 2**20, 'pico tracemalloc'
+        else:
+            memory_mb, memory_source = rss_growth_mb(rss_before, peak_before), 'aumento da RSS'
+    finally:
+        if trace_memory and not already_tracing:
+            tracemalloc.stop()
+    return df, IngestStats(engine=engine, rows=len(df), parse_seconds=elapsed, memory_mb=memory_mb, memory_source=memory_source)
@@ -0,0 +1,175 @@
+"""Representação compacta das teleconsultorias em memória.
+
+As colunas de texto repetitivo viram pd.Categorical com dicionário ordenado;
+Municipio Solicitante e Estabelecimento usam o mesmo dicionário em df e em
+df_estabelecimentos, de modo que filtros, junções e groupby trabalham sobre os
+códigos inteiros. As condições testadas em toda execução (concluída, cancelada,
+classes de conduta, intenção de encaminhar) são avaliadas uma vez sobre o
+dicionário e viram colunas booleanas.
+
+Medição antes/depois: python -m core.model arquivo.xlsx
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+CATEGORICAL_COLUMNS = ['Municipio Solicitante', 'Estabelecimento', 'Especialidade', 'SolicitanteNome', 'NomeEspecialista', 'Situação', 'Conduta', 'Monitor', 'Macrorregiao', 'Microrregiao', 'Categoria Profissional', 'Concluida?', 'Inten.Encaminhamento', 'CBP']
+SHARED_COLUMNS = ['Municipio Solicitante', 'Estabelecimento']
+# Coluna de flag -> (coluna de origem, função aplicada ao dicionário de valores em minúsculas)
+FLAG_COLUMNS = {
+    'Concluida_Sim': ('Concluida?', lambda s: s.str.contains('sim', na=False)),
+    'Cancelada': ('Situação', lambda s: s.str.contains('cancelad', na=False)),
+    'Conduta_Manter_UBS': ('Conduta', lambda s: s.str.contains('manter na unidade', na=False)),
+    'Conduta_Enc_Secundario': ('Conduta', lambda s: s.str.contains('encaminhar niveis secundarios', na=False)),
+    'Conduta_Enc_Terciario': ('Conduta', lambda s: s.str.contains('encaminhar niveis terciarios', na=False)),
+    'Intencao_Encaminhar': ('Inten.Encaminhamento', lambda s: s.str.strip() == 'sim'),
+}
+
+
+def _sorted_categories(*series_list):
+    values = pd.unique(pd.concat([s.dropna() for s in series_list], ignore_index=True).astype(object))
+    try:
+        return pd.Index(sorted(values), dtype=object)
+    except TypeError:
+        return pd.Index(sorted(values, key=str), dtype=object)
+
+
+def _as_categorical(series, categories):
+    return pd.Series(pd.Categorical(series, categories=categories), index=series.index, name=series.name)
+
+
+def flag_from_categorical(series, predicate):
+    """Avalia predicate sobre o dicionário da coluna categórica e expande o resultado pelos códigos."""
+    labels = pd.Series(series.cat.categories.astype(str)).str.lower()
+    on_categories = np.append(predicate(labels).to_numpy(dtype=bool), False)  # código -1 (nulo) cai no último
+    return pd.Series(on_categories[series.cat.codes.to_numpy()], index=series.index)
+
+
+def encode_teleconsultas(df, df_estabelecimentos):
+    """Retorna (df, df_estabelecimentos) com colunas categóricas, flags booleanas e Tempo_Resposta_Horas."""
+    df = df.copy()
+    df_estabelecimentos = df_estabelecimentos.copy()
+    for col in CATEGORICAL_COLUMNS:
+        if col not in df.columns:
+            continue
+        if col in SHARED_COLUMNS and col in df_estabelecimentos.columns:
+            categories = _sorted_categories(df[col], df_estabelecimentos[col])
+            df_estabelecimentos[col] = _as_categorical(df_estabelecimentos[col], categories)
+        else:
+            categories = _sorted_categories(df[col])
+        df[col] = _as_categorical(df[col], categories)
+    for flag, (source, predicate) in FLAG_COLUMNS.items():
+        if source in df.columns:
+            df[flag] = flag_from_categorical(df[source], predicate)
+    if 'Data_Solicitacao' in df.columns and 'Data_Resposta' in df.columns:
+        df['Tempo_Resposta_Horas'] = (df['Data_Resposta'] - df['Data_Solicitacao']).dt.total_seconds() / 3600
+    return df, df_estabelecimentos
+
+
+def extend_encoding(df, df_delta):
+    """Codifica linhas novas (df_delta, ainda em texto) com os dicionários de df, ampliando-os se preciso.
+
+    Os dicionários continuam ordenados; df só é recodificado (operação sobre
+    inteiros) nas colunas em que df_delta trouxe valores inéditos. Retorna (df, df_delta).
+    """
+    df = df.copy()
+    df_delta = df_delta.copy()
+    for col in CATEGORICAL_COLUMNS:
+        if col not in df.columns or col not in df_delta.columns:
+            continue
+        categories = df[col].cat.categories
+        new_values = pd.Index(pd.unique(df_delta[col].dropna().astype(object))).difference(categories)
+        if len(new_values):
+            categories = _sorted_categories(pd.Series(categories, dtype=object), pd.Series(new_values, dtype=object))
+            df[col] = df[col].cat.set_categories(categories)
+        df_delta[col] = _as_categorical(df_delta[col], categories)
+    for flag, (source, predicate) in FLAG_COLUMNS.items():
+        if source in df_delta.columns:
+            df_delta[flag] = flag_from_categorical(df_delta[source], predicate)
+    if 'Data_Solicitacao' in df_delta.columns and 'Data_Resposta' in df_delta.columns:
+        df_delta['Tempo_Resposta_Horas'] = (df_delta['Data_Resposta'] - df_delta['Data_Solicitacao']).dt.total_seconds() / 3600
+    return df, df_delta
+
+
+def share_categories(df_estabelecimentos, df):
+    """Aplica aos estabelecimentos os dicionários compartilhados de df."""
+    df_estabelecimentos = df_estabelecimentos.copy()
+    for col in SHARED_COLUMNS:
+        if col in df.columns and col in df_estabelecimentos.columns:
+            categories = df[col].cat.categories
+            missing = pd.Index(pd.unique(df_estabelecimentos[col].dropna().astype(object))).difference(categories)
+            if len(missing):
+                raise ValueError(f"Dicionário de '{col}' não cobre os estabelecimentos de referência.")
+            df_estabelecimentos[col] = _as_categorical(df_estabelecimentos[col], categories)
+    return df_estabelecimentos
+
+
+def filter_options(df, col, rows=None):
+    """Valores presentes na coluna (nas posições rows, se dadas), ordenados; para categóricas usa só os códigos (sem hashing de texto)."""
+    if col not in df.columns:
+        return []
+    series = df[col]
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        if rows is not None:
+            codes = codes[rows]
+        present = np.flatnonzero(np.bincount(codes[codes >= 0], minlength=len(series.cat.categories)))
+        return list(series.cat.categories[present])
+    if rows is not None:
+        series = series.iloc[rows]
+    return sorted(series.dropna().unique())
+
+
+def count_by(df, col, rows=None):
+    """Equivalente a value_counts().reset_index(), inclusive na ordem dos empates, contando pelos códigos.
+
+    rows (posições crescentes em df) restringe a contagem a essas linhas sem copiar as demais colunas.
+    """
+    series = df[col]
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return (series if rows is None else series.iloc[rows]).value_counts().reset_index()
+    codes = series.cat.codes.to_numpy()
+    if rows is not None:
+        codes = codes[rows]
+    codes = codes[codes >= 0]
+    order = pd.unique(codes)  # ordem de primeira ocorrência, a mesma que o value_counts usa para texto
+    counts = np.bincount(codes, minlength=len(series.cat.categories))[order]
+    index = pd.Index(series.cat.categories[order], dtype=object, name=col)
+    return pd.Series(counts, index=index, name='count').sort_values(ascending=False).reset_index()
+
+
+def _measure(df, label):
+    start = time.perf_counter()
+    for _ in range(10):
+        mask = pd.Series(True, index=df.index)
+        for col in ['Municipio Solicitante', 'Especialidade', 'Situação']:
+            options = filter_options(df, col)
+            mask &= df[col].isin(options[: max(1, len(options) // 2)])
+        filtered = df[mask]
+        filtered.groupby('Estabelecimento', observed=True).size()
+        count_by(filtered, 'SolicitanteNome')
+        if 'Concluida_Sim' in filtered.columns:
+            filtered['Concluida_Sim'].sum()
+        else:
+            filtered['Concluida?'].str.contains('sim', na=False).sum()
+    elapsed = (time.perf_counter() - start) / 10
+    memory_mb = df.memory_usage(deep=True).sum() / 2**20
+    print(f"{label}: {memory_mb:.1f} MB em memória, {elapsed * 1000:.1f} ms por execução dos filtros/agregações")
+
+
+if __name__ == '__main__':
+    import os
+    from core.ingestion import read_upload
+    from core.preparation import enrich_teleconsultas
+    from core.reference import load_reference_data
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = sys.argv[1]
+    with open(path, 'rb') as f:
+        df_upload, _ = read_upload(f.read(), path)
+    refs = load_reference_data(base, os.path.join(base, '.cache', 'referencias'))
+    df_plain, df_estab_plain = enrich_teleconsultas(df_upload, refs)
+    df_encoded, _ = encode_teleconsultas(df_plain, df_estab_plain)
+    _measure(df_plain, 'antes (object)')
+    _measure(df_encoded, 'depois (categórico)')
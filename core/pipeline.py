@@ -0,0 +1,261 @@
+"""Pipeline de dados do dashboard, sem Streamlit: carga -> normalização -> enriquecimento -> filtro -> agregação.
+
+Cada etapa é uma função pura com entrada e saída tipadas; o app.py só monta a
+interface, guarda em cache as etapas caras (dataset e índices) e desenha os
+resultados. O Dataset é compartilhado, somente leitura, por todas as sessões;
+cada sessão guarda só uma FilteredView, que aponta as linhas selecionadas por
+posição em vez de copiá-las. As mesmas funções servem para scripts, benchmarks
+e a linha de comando:
+    python -m core.pipeline relatorio.xlsx [--inicio AAAA-MM-DD] [--fim AAAA-MM-DD] [--filtro Coluna=valor ...]
+"""
+import argparse
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from core.cube import ROW_LEVEL_FILTERS, CubeAggregates, RowAggregates, build_cube, cube_filter_engine
+from core.filters import FilterEngine
+from core.ingestion import IngestStats, read_upload
+from core.model import count_by
+from core.preparation import prepare_dataset
+from core.reference import ReferenceData
+from core.reports import performance_by_establishment
+from core.sketches import SKETCH_DIMENSIONS, build_response_sketches, sketch_filter_engine, summarize_rows, summarize_sketches
+
+
+@dataclass
+class Dataset:
+    """Tabelas preparadas; tratadas como imutáveis, pois a mesma instância serve a todas as sessões."""
+    teleconsultorias: pd.DataFrame
+    estabelecimentos: pd.DataFrame
+    cubo: pd.DataFrame
+    tempos: pd.DataFrame  # sketches do tempo de resposta (core.sketches)
+
+    @classmethod
+    def from_frames(cls, frames):
+        return cls(frames['teleconsultorias'], frames['estabelecimentos'], frames['cubo'], frames['tempos'])
+
+    def frames(self):
+        return {'teleconsultorias': self.teleconsultorias, 'estabelecimentos': self.estabelecimentos, 'cubo': self.cubo, 'tempos': self.tempos}
+
+
+@dataclass
+class Engines:
+    rows: FilterEngine
+    cube: FilterEngine
+    sketches: FilterEngine
+
+
+@dataclass
+class Selection:
+    start: pd.Timestamp
+    end: pd.Timestamp
+    filters: dict = field(default_factory=dict)  # coluna -> valores selecionados
+
+
+@dataclass
+class FilteredView:
+    dataset: Dataset
+    engines: Engines
+    base_mask: np.ndarray  # filtros sem o período
+    cube_mask: Optional[np.ndarray]  # None quando há filtro que só as linhas respondem
+    sketch_mask: Optional[np.ndarray]  # idem, para a tabela de sketches do tempo de resposta
+    positions: np.ndarray  # posições em dataset.teleconsultorias das linhas filtradas no período da seleção
+    aggregates: RowAggregates
+
+    @property
+    def n_rows(self):
+        return len(self.positions)
+
+    def positions_for(self, col, values):
+        """Posições das linhas da visão cujo valor em col está em values."""
+        return self.positions[self.engines.rows.mask_for(col, values)[self.positions]]
+
+    def frame(self, columns=None, positions=None):
+        """Cópia das linhas da visão (ou de positions), só com columns; para relatórios e exportações."""
+        df = self.dataset.teleconsultorias
+        columns = [c for c in columns if c in df.columns] if columns is not None else list(df.columns)
+        return df.iloc[self.positions if positions is None else positions, df.columns.get_indexer(columns)]
+
+    def aggregates_for(self, start, end):
+        """Agregações dos mesmos filtros em outro período: do cubo quando possível, das linhas caso contrário."""
+        if self.cube_mask is not None:
+            return CubeAggregates(self.dataset.cubo, _positions(self.cube_mask & self.engines.cube.date_mask(start, end)))
+        return RowAggregates(self.dataset.teleconsultorias, _positions(self.base_mask & self.engines.rows.date_mask(start, end)))
+
+
+@dataclass
+class Kpis:
+    total: int
+    respostas: int
+    media_resposta: Optional[float]
+    concluidas: Optional[int]
+    percentual_concluidas: Optional[float]
+    municipios: list
+    estabelecimentos: int
+
+
+@dataclass
+class Flow:
+    casos_ubs: int
+    encaminhados: int
+    percentual_ubs: float
+    percentual_encaminhados: float
+    intencao_encaminhar: int
+    evitados: Optional[int]
+    percentual_evitados: Optional[float]
+
+
+def _positions(mask):
+    return np.flatnonzero(mask).astype(np.int32)
+
+
+def load_upload(data: bytes, file_name: str) -> tuple[pd.DataFrame, IngestStats]:
+    """Carga e normalização: bytes do .xls/.xlsx -> DataFrame com nomes e tipos canônicos."""
+    return read_upload(data, file_name)
+
+
+def prepare(df_upload: pd.DataFrame, refs: ReferenceData) -> Dataset:
+    """Enriquecimento: referências, cotas, codificação, cubo pré-agregado e sketches do tempo de resposta."""
+    df, df_estabelecimentos = prepare_dataset(df_upload, refs)
+    return Dataset(df, df_estabelecimentos, build_cube(df), build_response_sketches(df))
+
+
+def build_engines(dataset: Dataset) -> Engines:
+    return Engines(FilterEngine(dataset.teleconsultorias), cube_filter_engine(dataset.cubo), sketch_filter_engine(dataset.tempos))
+
+
+def apply_filters(dataset: Dataset, engines: Engines, selection: Selection) -> FilteredView:
+    """Filtro: máscaras das linhas e das células do cubo para a seleção."""
+    base_mask = engines.rows.all_rows()
+    for col, values in selection.filters.items():
+        base_mask &= engines.rows.mask_for(col, values)
+    cube_mask = None
+    if not any(col in selection.filters for col in ROW_LEVEL_FILTERS):
+        cube_mask = engines.cube.all_rows()
+        for col, values in selection.filters.items():
+            cube_mask &= engines.cube.mask_for(col, values)
+    sketch_mask = None
+    if all(col in SKETCH_DIMENSIONS and col in engines.sketches for col in selection.filters):
+        sketch_mask = engines.sketches.all_rows()
+        for col, values in selection.filters.items():
+            sketch_mask &= engines.sketches.mask_for(col, values)
+    positions = _positions(base_mask & engines.rows.date_mask(selection.start, selection.end))
+    view = FilteredView(dataset, engines, base_mask, cube_mask, sketch_mask, positions, None)
+    view.aggregates = view.aggregates_for(selection.start, selection.end)
+    return view
+
+
+def compute_kpis(agg: RowAggregates, refs: ReferenceData) -> Kpis:
+    total = agg.total()
+    respostas = agg.response_count()
+    concluidas = agg.flag_sum('Concluida_Sim') if agg.has('Concluida_Sim') and total > 0 else None
+    municipios = agg.present('Municipio Solicitante')
+    estabelecimentos = len(frozenset().union(*(refs.municipio_estabelecimentos.get(m, ()) for m in municipios)))
+    return Kpis(total=total, respostas=respostas, media_resposta=agg.mean_response() if respostas > 0 else None,
+                concluidas=concluidas, percentual_concluidas=concluidas / total * 100 if concluidas is not None else None,
+                municipios=municipios, estabelecimentos=estabelecimentos)
+
+
+def compute_flow(agg: RowAggregates) -> Optional[Flow]:
+    """Fluxo de encaminhamentos; None se faltarem as colunas de conduta/intenção."""
+    if not (agg.has('Conduta_Manter_UBS') and agg.has('Intencao_Encaminhar')):
+        return None
+    casos_ubs = agg.flag_sum('Conduta_Manter_UBS')
+    encaminhados = agg.flag_sum('Conduta_Enc_Secundario') + agg.flag_sum('Conduta_Enc_Terciario')
+    total_conduta = casos_ubs + encaminhados
+    percentual_ubs, percentual_encaminhados = (casos_ubs / total_conduta * 100, encaminhados / total_conduta * 100) if total_conduta > 0 else (0.0, 0.0)
+    intencao = agg.flag_sum('Intencao_Encaminhar')
+    evitados = intencao - encaminhados if intencao > 0 else None
+    return Flow(casos_ubs, encaminhados, percentual_ubs, percentual_encaminhados, intencao, evitados, evitados / intencao * 100 if evitados is not None else None)
+
+
+def compute_performance(dataset: Dataset, agg: RowAggregates, municipios: list) -> pd.DataFrame:
+    """Realizado no período vs. cota mensal por estabelecimento dos municípios visíveis."""
+    realizado_estab = agg.counts_by('Estabelecimento').set_index('Estabelecimento')['count']
+    return performance_by_establishment(dataset.estabelecimentos, municipios, realizado_estab)
+
+
+def monthly_evolution(agg: RowAggregates, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+    """Quantidade por mês (Data_Solicitacao, Quantidade, Mês), com zeros nos meses sem dados."""
+    date_range_full = pd.date_range(start=start, end=end, freq='MS')
+    df_ts = agg.monthly_counts().reindex(date_range_full, fill_value=0).reset_index(name='Quantidade')
+    df_ts.rename(columns={'index': 'Data_Solicitacao'}, inplace=True)
+    df_ts['Mês'] = df_ts['Data_Solicitacao'].dt.strftime('%b/%Y').str.lower()
+    return df_ts
+
+
+def specialty_distribution(agg: RowAggregates) -> pd.DataFrame:
+    """Quantidade por especialidade com o rótulo 'Especialidade (média h)' usado no gráfico e no PDF."""
+    esp_count = agg.counts_by('Especialidade')
+    if agg.response_count() > 0:
+        avg_resp = agg.mean_response_by('Especialidade').round(1).reset_index(name='avg_resp_horas')
+        df_pie_data = pd.merge(esp_count, avg_resp, on='Especialidade')
+        df_pie_data['label'] = df_pie_data['Especialidade'].astype(str) + ' (' + df_pie_data['avg_resp_horas'].astype(str) + 'h)'
+    else:
+        df_pie_data = esp_count
+        df_pie_data['label'] = df_pie_data['Especialidade']
+    return df_pie_data
+
+
+def response_time_summary(view: FilteredView, start: pd.Timestamp, end: pd.Timestamp, by: Optional[str] = None) -> tuple[pd.DataFrame, str]:
+    """(Respostas, P50/P90/P95 e % em até 72h, no total ou por by; fonte) no período.
+
+    Mescla os sketches pré-agregados quando filtros e agrupamento cabem neles;
+    caso contrário, põe nos mesmos baldes só as linhas filtradas.
+    """
+    df = view.dataset.teleconsultorias
+    if 'Tempo_Resposta_Horas' not in df.columns:
+        return pd.DataFrame(), 'linhas'
+    if view.sketch_mask is not None and (by is None or by in view.dataset.tempos.columns):
+        return summarize_sketches(view.dataset.tempos, _positions(view.sketch_mask & view.engines.sketches.date_mask(start, end)), by), 'sketches'
+    return summarize_rows(df, _positions(view.base_mask & view.engines.rows.date_mask(start, end)), by), 'linhas'
+
+
+def category_distribution(agg: RowAggregates) -> pd.DataFrame:
+    return agg.counts_by('Categoria Profissional') if agg.has('Categoria Profissional') else pd.DataFrame()
+
+
+def requester_distribution(view: FilteredView) -> pd.DataFrame:
+    """Quantidade por solicitante; sempre das linhas, pois o cubo não guarda o solicitante."""
+    df = view.dataset.teleconsultorias
+    if 'SolicitanteNome' not in df.columns:
+        return pd.DataFrame()
+    counts = count_by(df, 'SolicitanteNome', view.positions)
+    return counts if not counts.empty else pd.DataFrame()
+
+
+def main(argv=None):
+    from core.reference import load_reference_data
+    parser = argparse.ArgumentParser(description="Calcula os indicadores do dashboard para um relatório de teleconsultorias.")
+    parser.add_argument('arquivo')
+    parser.add_argument('--inicio', help="AAAA-MM-DD (padrão: primeira data do relatório)")
+    parser.add_argument('--fim', help="AAAA-MM-DD (padrão: última data do relatório)")
+    parser.add_argument('--filtro', action='append', default=[], help="Coluna=valor; pode repetir")
+    args = parser.parse_args(argv)
+
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    refs = load_reference_data(base, os.path.join(base, '.cache', 'referencias'))
+    with open(args.arquivo, 'rb') as f:
+        df_upload, _ = load_upload(f.read(), args.arquivo)
+    dataset = prepare(df_upload, refs)
+    engines = build_engines(dataset)
+    min_date, max_date = engines.rows.date_bounds()
+    filters = {}
+    for item in args.filtro:
+        col, _, value = item.partition('=')
+        filters.setdefault(col, []).append(value)
+    selection = Selection(pd.Timestamp(args.inicio) if args.inicio else min_date.normalize(), pd.Timestamp(args.fim) if args.fim else max_date.normalize(), filters)
+    view = apply_filters(dataset, engines, selection)
+    kpis = compute_kpis(view.aggregates, refs)
+    flow = compute_flow(view.aggregates)
+    result = {'kpis': {**asdict(kpis), 'municipios': len(kpis.municipios)}, 'fluxo': asdict(flow) if flow else None, 'fonte': view.aggregates.source}
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Preparação dos dados: tabelas de referência, cotas e junções com as teleconsultorias."""
+import pandas as pd
+
+from core.ingestion import find_existing
+from core.model import encode_teleconsultas
+
+COL_MAP_CATEGORIA = {'CBO': ['CBO'], 'Categoria': ['Categoria']}
+COL_MAP_CONDICOES = {'Municipio Solicitante': ['MUNICÍPIOS', 'Municipio Solicitante'], 'CotaTotal': ['Cota total', 'Cota Total'], 'Monitor': ['Monitor(a) de Campo Responsável', 'Monitor'], 'Macrorregiao': ['Macrorregião de Saúde'], 'Microrregiao': ['Microrregião de Saúde']}
+COL_MAP_ESTAB = {'Municipio Solicitante': ['Município', 'Municipio Solicitante'], 'Estabelecimento': ['Unidade de Saúde', 'Estabelecimento']}
+ANO_REFERENCIA = 2024
+
+
+def _rename_canonical(df, col_map):
+    mapped = {canonical: find_existing(candidates, df.columns) for canonical, candidates in col_map.items()}
+    return df.rename(columns={v: k for k, v in mapped.items() if v})
+
+
+def normalize_references(df_condicoes_raw, df_estabelecimentos_raw, df_categoria_raw):
+    """Aplica os nomes canônicos às planilhas de referência e junta a CotaTotal aos estabelecimentos."""
+    df_categoria = _rename_canonical(df_categoria_raw, COL_MAP_CATEGORIA)
+    if 'CBO' in df_categoria.columns:
+        df_categoria['CBO'] = df_categoria['CBO'].astype(str).str.replace(r'\.0$', '', regex=True)
+
+    df_condicoes = _rename_canonical(df_condicoes_raw, COL_MAP_CONDICOES)
+    df_estabelecimentos = _rename_canonical(df_estabelecimentos_raw, COL_MAP_ESTAB)
+    if 'Municipio Solicitante' in df_estabelecimentos.columns and 'Municipio Solicitante' in df_condicoes.columns:
+        df_estabelecimentos = pd.merge(df_estabelecimentos, df_condicoes[['Municipio Solicitante', 'CotaTotal']], on='Municipio Solicitante', how='left').fillna({'CotaTotal': 0})
+    return {'condicoes': df_condicoes, 'estabelecimentos': df_estabelecimentos, 'categoria': df_categoria}
+
+
+def compute_quotas(df, df_estabelecimentos, ano_referencia=ANO_REFERENCIA):
+    """Calcula Realizado_AnoRef e CotaMensal_Estabelecimento a partir das teleconsultorias."""
+    if 'Data_Solicitacao' not in df.columns or 'Situação' not in df.columns:
+        return df_estabelecimentos
+    realizado_ano_ref = count_realizado(df, ano_referencia).reset_index(name='Realizado_AnoRef')
+    return apply_quotas(df_estabelecimentos, realizado_ano_ref)
+
+
+def count_realizado(df, ano_referencia=ANO_REFERENCIA):
+    """Teleconsultorias não canceladas no ano de referência, por município (Series indexada por texto)."""
+    cancelada = df['Cancelada'] if 'Cancelada' in df.columns else df['Situação'].str.lower().str.contains('cancelad', na=False)
+    df_ano_ref = df[(df['Data_Solicitacao'].dt.year == ano_referencia) & ~cancelada.astype(bool)]
+    counts = df_ano_ref.groupby('Municipio Solicitante', observed=True).size()
+    counts.index = counts.index.astype(object)
+    return counts
+
+
+def apply_quotas(df_estabelecimentos, realizado_ano_ref):
+    """Junta o realizado no ano de referência por município e deriva a cota mensal por estabelecimento."""
+    df_estabelecimentos = df_estabelecimentos.copy()
+    df_estabelecimentos['Num_Estabelecimentos'] = df_estabelecimentos.groupby('Municipio Solicitante')['Estabelecimento'].transform('count')
+    df_estabelecimentos = pd.merge(df_estabelecimentos, realizado_ano_ref, on='Municipio Solicitante', how='left').fillna({'Realizado_AnoRef': 0})
+    df_estabelecimentos['Realizado_AnoRef'] = df_estabelecimentos['Realizado_AnoRef'].astype(int)
+    df_estabelecimentos['CotaMensal_Estabelecimento'] = ((df_estabelecimentos['CotaTotal'] - df_estabelecimentos['Realizado_AnoRef']) / 12 / df_estabelecimentos['Num_Estabelecimentos']).where(df_estabelecimentos['Num_Estabelecimentos'] > 0, 0).round(2)
+    df_estabelecimentos['CotaMensal_Estabelecimento'] = df_estabelecimentos['CotaMensal_Estabelecimento'].clip(lower=0)
+    return df_estabelecimentos
+
+
+def enrich_teleconsultas(df, refs):
+    """Junta categoria profissional e dados do município às teleconsultorias; retorna (df, df_estabelecimentos).
+
+    refs é o ReferenceData de core.reference.
+    """
+    if 'CBP' in df.columns:
+        df = df.assign(**{'Categoria Profissional': df['CBP'].map(refs.cbo_to_categoria).fillna('Não Mapeado')})
+    df_estabelecimentos = compute_quotas(df, refs.estabelecimentos)
+    return merge_condicoes(df, refs), df_estabelecimentos
+
+
+def enrich_rows(df, refs):
+    """Parte do enriquecimento que depende só de cada linha (sem as cotas); usada na carga incremental."""
+    if 'CBP' in df.columns:
+        df = df.assign(**{'Categoria Profissional': df['CBP'].map(refs.cbo_to_categoria).fillna('Não Mapeado')})
+    return merge_condicoes(df, refs)
+
+
+def merge_condicoes(df, refs):
+    df_condicoes = refs.condicoes
+    cols_to_merge_final = [col for col in ['Municipio Solicitante', 'Monitor', 'Macrorregiao', 'Microrregiao'] if col in df_condicoes.columns]
+    if 'Municipio Solicitante' in df.columns and 'Municipio Solicitante' in df_condicoes.columns:
+        df = pd.merge(df, df_condicoes[cols_to_merge_final], on='Municipio Solicitante', how='left')
+    return df
+
+
+def prepare_dataset(df_upload, refs):
+    """Upload normalizado -> (df, df_estabelecimentos) enriquecidos e codificados, prontos para o dashboard."""
+    return encode_teleconsultas(*enrich_teleconsultas(df_upload, refs))
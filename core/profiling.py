@@ -0,0 +1,129 @@
+"""Instrumentação por seção do dashboard: tempo, linhas de entrada/saída e memória.
+
+Cada seção medida vira um SectionRecord; o app guarda o último de cada seção na
+sessão (para o painel de administração) e acrescenta todos a um log em JSON
+lines, uma linha por seção executada, para acompanhar a latência entre
+usuários e tamanhos de dataset:
+    python -m core.profiling .cache/perfil/secoes.jsonl
+"""
+import json
+import os
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from core.ingestion import current_rss_mb, peak_rss_mb
+
+LOG_MAX_BYTES = 50 * 2**20
+DATASET_SIZE_BINS = [0, 10_000, 100_000, 1_000_000, np.inf]
+DATASET_SIZE_LABELS = ['< 10 mil', '10 mil a 100 mil', '100 mil a 1 milhão', '1 milhão ou mais']
+
+
+@dataclass
+class SectionRecord:
+    secao: str
+    segundos: float
+    linhas_entrada: Optional[int]
+    linhas_saida: Optional[int]
+    memoria_mb: float  # RSS ao final da seção
+    delta_memoria_mb: float  # RSS final - inicial
+    delta_pico_mb: float  # quanto o pico de RSS do processo subiu durante a seção
+    linhas_dataset: Optional[int]
+    execucao: int  # execuções completas do app na sessão; fragmentos repetem o número
+    fragmento: bool
+    sessao: str
+    data: str
+
+
+@dataclass
+class OpenSection:
+    name: str
+    rows_in: Optional[int]
+    start: float
+    rss_mb: float
+    peak_mb: float
+
+
+class Profiler:
+    """Seções medidas de uma sessão; records guarda a última execução de cada uma e counts quantas houve."""
+
+    def __init__(self, session_id, log=None):
+        self.session_id = session_id
+        self.log = log
+        self.records = {}
+        self.counts = {}
+
+    def start(self, name, rows_in=None):
+        return OpenSection(name, rows_in, time.perf_counter(), current_rss_mb(), peak_rss_mb())
+
+    def stop(self, section, rows_out=None, dataset_rows=None, run=0, fragment=False):
+        rss = current_rss_mb()
+        return self.add(SectionRecord(
+            secao=section.name, segundos=time.perf_counter() - section.start, linhas_entrada=section.rows_in, linhas_saida=rows_out,
+            memoria_mb=round(rss, 1), delta_memoria_mb=round(rss - section.rss_mb, 1), delta_pico_mb=round(peak_rss_mb() - section.peak_mb, 1),
+            linhas_dataset=dataset_rows, execucao=run, fragmento=fragment, sessao=self.session_id, data=datetime.now().isoformat(timespec='seconds')))
+
+    def add(self, record):
+        self.records[record.secao] = record
+        self.counts[record.secao] = self.counts.get(record.secao, 0) + 1
+        if self.log is not None:
+            self.log.append(record)
+        return record
+
+    def table(self):
+        """Última execução de cada seção, na ordem em que as seções rodaram pela primeira vez."""
+        rows = [{**asdict(record), 'execucoes_secao': self.counts[name]} for name, record in self.records.items()]
+        return pd.DataFrame(rows)
+
+
+class ProfileLog:
+    """Log JSON lines compartilhado pelas sessões do processo; as escritas são serializadas por um lock.
+
+    Ao passar de max_bytes o arquivo vira <path>.1 (substituindo o anterior) e um novo é iniciado.
+    """
+
+    def __init__(self, path, max_bytes=LOG_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def append(self, record):
+        line = json.dumps(asdict(record), ensure_ascii=False) + '\n'
+        with self._lock:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + '.1')
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def read(self, last=None):
+        if not os.path.exists(self.path):
+            return pd.DataFrame()
+        with self._lock, open(self.path, encoding='utf-8') as f:
+            lines = f.readlines()
+        if last:
+            lines = lines[-last:]
+        return pd.DataFrame([json.loads(line) for line in lines if line.strip()])
+
+
+def summarize(df_log):
+    """Latência por seção e faixa de tamanho do dataset: execuções, mediana, p95 e máximo em ms."""
+    if df_log.empty:
+        return pd.DataFrame()
+    df = df_log.assign(ms=df_log['segundos'] * 1000, faixa=pd.cut(df_log['linhas_dataset'].astype(float), DATASET_SIZE_BINS, labels=DATASET_SIZE_LABELS, right=False))
+    grouped = df.groupby(['secao', 'faixa'], observed=True, sort=False)
+    summary = grouped['ms'].agg(execucoes='count', mediana_ms='median', p95_ms=lambda s: s.quantile(0.95), max_ms='max')
+    summary['mediana_delta_memoria_mb'] = grouped['delta_memoria_mb'].median()
+    summary['sessoes'] = grouped['sessao'].nunique()
+    return summary.round(1).reset_index()
+
+
+if __name__ == '__main__':
+    pd.set_option('display.width', 200)
+    print(summarize(ProfileLog(sys.argv[1]).read()).to_string(index=False))
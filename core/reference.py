@@ -0,0 +1,164 @@
+"""Snapshot binário das planilhas de referência (condições, estabelecimentos e categorias).
+
+As três planilhas estáticas são lidas com openpyxl apenas quando mudam: o
+resultado, já com nomes canônicos, tipos validados e a CotaTotal junta aos
+estabelecimentos, é gravado em Arrow junto com um manifest.json contendo
+tamanho, mtime e sha256 de cada .xlsx. Na carga, tamanho e mtime iguais
+bastam; se só o mtime mudou (ex.: cópia no build do Docker), o sha256 decide.
+
+Para pré-compilar no build: python -m core.reference
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from dataclasses import dataclass
+
+import pandas as pd
+import pyarrow.feather as feather
+
+from core.cache import hash_file
+from core.preparation import normalize_references
+
+SNAPSHOT_VERSION = 1
+REFERENCE_FILES = {'condicoes': 'condicoes.xlsx', 'estabelecimentos': 'estabelecimentos.xlsx', 'categoria': 'categoria.xlsx'}
+REQUIRED_COLUMNS = {'condicoes': ['Municipio Solicitante', 'CotaTotal'], 'estabelecimentos': ['Municipio Solicitante', 'Estabelecimento', 'CotaTotal'], 'categoria': ['CBO', 'Categoria']}
+
+
+@dataclass
+class ReferenceData:
+    condicoes: pd.DataFrame
+    estabelecimentos: pd.DataFrame
+    categoria: pd.DataFrame
+    cbo_to_categoria: dict
+    municipio_estabelecimentos: dict
+    fingerprint: str
+
+
+def _source_stats(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _validate(tables):
+    for name, columns in REQUIRED_COLUMNS.items():
+        missing = [c for c in columns if c not in tables[name].columns]
+        if missing:
+            raise ValueError(f"Planilha '{REFERENCE_FILES[name]}' sem as colunas obrigatórias: {', '.join(missing)}.")
+    for name in ['condicoes', 'estabelecimentos']:
+        cota = pd.to_numeric(tables[name]['CotaTotal'], errors='coerce')
+        if cota.isna().any():
+            raise ValueError(f"Planilha '{REFERENCE_FILES[name]}' tem valores não numéricos em CotaTotal.")
+        tables[name]['CotaTotal'] = cota
+    for name, columns in [('condicoes', ['Municipio Solicitante']), ('estabelecimentos', ['Municipio Solicitante', 'Estabelecimento']), ('categoria', ['CBO', 'Categoria'])]:
+        for col in columns:
+            series = tables[name][col]
+            tables[name][col] = series.where(series.isna(), series.astype(str))
+    return tables
+
+
+def _compile(base_dir):
+    raw = {name: pd.read_excel(os.path.join(base_dir, file_name)) for name, file_name in REFERENCE_FILES.items()}
+    return _validate(normalize_references(raw['condicoes'], raw['estabelecimentos'], raw['categoria']))
+
+
+def _build_lookups(tables):
+    cbo_to_categoria = tables['categoria'].set_index('CBO')['Categoria'].to_dict()
+    estab = tables['estabelecimentos'].dropna(subset=['Municipio Solicitante', 'Estabelecimento'])
+    municipio_estabelecimentos = {m: frozenset(group) for m, group in estab.groupby('Municipio Solicitante')['Estabelecimento']}
+    return cbo_to_categoria, municipio_estabelecimentos
+
+
+def _read_manifest(snapshot_dir):
+    try:
+        with open(os.path.join(snapshot_dir, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest if manifest.get('version') == SNAPSHOT_VERSION else None
+    except (OSError, ValueError):
+        return None
+
+
+def _is_fresh(manifest, base_dir, snapshot_dir):
+    """Confere o manifest contra os .xlsx; atualiza os mtimes quando só eles mudaram."""
+    if manifest is None:
+        return False
+    touched = False
+    for name, file_name in REFERENCE_FILES.items():
+        source = manifest['sources'].get(name)
+        stats = _source_stats(os.path.join(base_dir, file_name))
+        if source is None or source['size'] != stats['size']:
+            return False
+        if source['mtime_ns'] != stats['mtime_ns']:
+            if hash_file(os.path.join(base_dir, file_name)) != source['sha256']:
+                return False
+            source['mtime_ns'] = stats['mtime_ns']
+            touched = True
+    if touched:
+        _write_manifest(snapshot_dir, manifest)
+    return True
+
+
+def _write_manifest(directory, manifest):
+    tmp_path = os.path.join(directory, 'manifest.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, 'manifest.json'))
+
+
+def build_snapshot(base_dir, snapshot_dir):
+    """Compila as planilhas de referência e grava o snapshot; retorna o manifest."""
+    sources = {}
+    for name, file_name in REFERENCE_FILES.items():
+        path = os.path.join(base_dir, file_name)
+        sources[name] = {**_source_stats(path), 'sha256': hash_file(path)}
+    tables = _compile(base_dir)
+    fingerprint = hashlib.sha256('|'.join(sources[n]['sha256'] for n in REFERENCE_FILES).encode()).hexdigest()
+    manifest = {'version': SNAPSHOT_VERSION, 'fingerprint': fingerprint, 'sources': sources}
+    parent = os.path.dirname(os.path.abspath(snapshot_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp-ref-')
+    try:
+        for name, df in tables.items():
+            feather.write_feather(df.reset_index(drop=True), os.path.join(tmp_dir, f"{name}.arrow"), compression='uncompressed')
+        _write_manifest(tmp_dir, manifest)
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+        os.replace(tmp_dir, snapshot_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return manifest
+
+
+def reference_signature(base_dir):
+    """Tupla (arquivo, tamanho, mtime) das planilhas; barata o bastante para conferir a cada rerun."""
+    signature = []
+    for file_name in REFERENCE_FILES.values():
+        try:
+            stats = _source_stats(os.path.join(base_dir, file_name))
+            signature.append((file_name, stats['size'], stats['mtime_ns']))
+        except OSError:
+            signature.append((file_name, None, None))
+    return tuple(signature)
+
+
+def load_reference_data(base_dir, snapshot_dir):
+    """Carrega o snapshot das referências, recompilando-o se alguma planilha mudou."""
+    for file_name in REFERENCE_FILES.values():
+        path = os.path.join(base_dir, file_name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"ERRO: Arquivo '{path}' não encontrado.")
+    manifest = _read_manifest(snapshot_dir)
+    if not _is_fresh(manifest, base_dir, snapshot_dir):
+        manifest = build_snapshot(base_dir, snapshot_dir)
+    tables = {name: feather.read_feather(os.path.join(snapshot_dir, f"{name}.arrow")) for name in REFERENCE_FILES}
+    cbo_to_categoria, municipio_estabelecimentos = _build_lookups(tables)
+    return ReferenceData(condicoes=tables['condicoes'], estabelecimentos=tables['estabelecimentos'], categoria=tables['categoria'], cbo_to_categoria=cbo_to_categoria, municipio_estabelecimentos=municipio_estabelecimentos, fingerprint=manifest['fingerprint'])
+
+
+if __name__ == '__main__':
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    target = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base, '.cache', 'referencias')
+    built = build_snapshot(base, target)
+    print(f"Snapshot das referências gravado em {target} ({built['fingerprint'][:12]}).")
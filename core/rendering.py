@@ -0,0 +1,125 @@
+"""Renderização em PNG dos gráficos do relatório PDF.
+
+O ChartRenderer mantém um conjunto de processos kaleido já iniciados (um
+PlotlyScope por worker, cada um com seu próprio Chromium, pois cada scope
+serializa as conversões num lock) e converte as figuras em paralelo. Os PNGs
+ficam num cache em disco identificado pelo sha256 do JSON da figura e do
+tamanho da imagem, de modo que gerar o mesmo relatório de novo não chama o
+kaleido. O cache é limitado em bytes com descarte LRU (mtime atualizado a cada
+leitura), como o cache de datasets.
+"""
+import hashlib
+import os
+import queue
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import plotly.io as pio
+
+# Figura mínima já em dicionário: montar um px.bar em cada thread ao mesmo tempo
+# não é seguro (o tratamento de templates do plotly express é compartilhado).
+WARM_FIGURE = {'data': [{'type': 'bar', 'x': [0], 'y': [0]}]}
+
+
+def figure_key(fig, width, height):
+    """sha256 do JSON da figura mais o tamanho da imagem."""
+    payload = f"{width}x{height}|{pio.to_json(fig, validate=False)}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class PngCache:
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+            os.utime(self._path(key))
+            return data
+        except OSError:
+            return None
+
+    def put(self, key, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-', suffix='.png')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.png') and not entry.name.startswith('.tmp-'):
+                try:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                except OSError:
+                    continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class ChartRenderer:
+    """Conversão concorrente figura -> PNG com processos kaleido aquecidos e cache em disco."""
+
+    def __init__(self, cache_dir, workers=None, max_bytes=64 * 2**20):
+        from kaleido.scopes.plotly import PlotlyScope
+        self.cache = PngCache(cache_dir, max_bytes)
+        self.workers = workers or max(1, min(3, os.cpu_count() or 1))
+        # Mesmo plotly.js/MathJax locais que o plotly configura no seu scope padrão.
+        default_scope = pio.kaleido.scope
+        self._all_scopes = [PlotlyScope(plotlyjs=default_scope.plotlyjs, mathjax=default_scope.mathjax) for _ in range(self.workers)]
+        self._scopes = queue.Queue()
+        for scope in self._all_scopes:
+            self._scopes.put(scope)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='kaleido')
+        self._warming = []
+
+    def warm(self):
+        """Inicia os processos kaleido em segundo plano, para o primeiro relatório não pagar a partida."""
+        self._warming = [self._executor.submit(scope.transform, WARM_FIGURE, format='png', width=10, height=10) for scope in self._all_scopes]
+        return self._warming
+
+    def warm_errors(self):
+        """Exceções dos aquecimentos já concluídos (os scopes que falharam ficam frios até o primeiro uso)."""
+        return [f.exception() for f in self._warming if f.done() and f.exception() is not None]
+
+    def _transform(self, fig, width, height):
+        scope = self._scopes.get()
+        try:
+            return scope.transform(fig.to_dict(), format='png', width=width, height=height)
+        finally:
+            self._scopes.put(scope)
+
+    def render(self, figures, width=800, height=450):
+        """Gera (nome, png, erro, veio_do_cache) à medida que cada figura de {nome: fig} fica pronta."""
+        pending = {}
+        for name, fig in figures.items():
+            key = figure_key(fig, width, height)
+            png = self.cache.get(key)
+            if png is not None:
+                yield name, png, None, True
+            else:
+                pending[self._executor.submit(self._transform, fig, width, height)] = (name, key)
+        for future in as_completed(pending):
+            name, key = pending[future]
+            try:
+                png = future.result()
+            except Exception as e:
+                yield name, None, e, False
+                continue
+            self.cache.put(key, png)
+            yield name, png, None, False
@@ -0,0 +1,245 @@
+"""Relatórios por município (Excel e, opcionalmente, PDF) e geração em lote num ZIP.
+
+O lote particiona os dados filtrados uma única vez (groupby sobre os códigos de
+Municipio Solicitante), gera os relatórios num pool de processos e grava cada
+arquivo no ZIP assim que fica pronto. No máximo max_pending relatórios ficam em
+andamento ao mesmo tempo, o que limita a memória independentemente do número
+de municípios.
+
+Execução agendada (por padrão, o mês anterior):
+    python -m core.reports relatorio.xlsx --saida relatorios.zip [--inicio AAAA-MM-DD --fim AAAA-MM-DD] [--pdf]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+from core.exports import to_excel_bytes
+
+SUMMARY_COLUMNS = ['Municipio Solicitante', 'Estabelecimento', 'CotaMensal_Estabelecimento', 'Realizado_Periodo', 'Percentual Atingido']
+DETAIL_COLUMNS = ['Data_Solicitacao', 'Municipio Solicitante', 'Estabelecimento', 'Especialidade', 'SolicitanteNome', 'Categoria Profissional', 'Situação', 'Monitor', 'Conduta', 'Inten.Encaminhamento']
+PDF_CSS = """
+    @page { size: A4 portrait; margin: 1.5cm; }
+    body { font-family: 'Helvetica', sans-serif; color: #333; font-size: 10px; }
+    h1 { text-align: center; color: #33ac47; font-size: 18px; }
+    h2 { color: #33ac47; border-bottom: 1px solid #33ac47; padding-bottom: 5px; font-size: 13px; }
+    .periodo { text-align: center; font-style: italic; color: #555; }
+    .styled-table { border-collapse: collapse; margin: 15px 0; font-size: 8px; width: 100%; }
+    .styled-table thead tr { background-color: #33ac47; color: #ffffff; }
+    .styled-table th, .styled-table td { padding: 5px 7px; border: 1px solid #ddd; }
+"""
+
+
+def performance_by_establishment(df_estabelecimentos, municipios, realizado_estab):
+    """Estabelecimentos dos municípios com Realizado_Periodo (de realizado_estab) e Percentual Atingido da cota mensal."""
+    df_perf = df_estabelecimentos[df_estabelecimentos['Municipio Solicitante'].isin(municipios)].reset_index(drop=True)
+    df_perf = df_perf.assign(Realizado_Periodo=df_perf['Estabelecimento'].astype(object).map(realizado_estab).fillna(0).astype(int))
+    df_perf['Percentual Atingido'] = (df_perf['Realizado_Periodo'] / df_perf['CotaMensal_Estabelecimento'] * 100).where(df_perf['CotaMensal_Estabelecimento'] > 0, 0)
+    return df_perf
+
+
+def to_excel_report_bytes(df_summary, df_details):
+    return to_excel_bytes([('Resumo_Performance', df_summary), ('Detalhes_Consultorias', df_details)])
+
+
+def to_pdf_report_bytes(municipio, periodo, df_summary, df_details):
+    """PDF resumido do município: performance por estabelecimento e teleconsultorias por especialidade."""
+    from weasyprint import HTML
+    summary = df_summary.copy()
+    if 'Percentual Atingido' in summary.columns:
+        summary['Percentual Atingido'] = summary['Percentual Atingido'].map('{:.1f}%'.format)
+    by_specialty = df_details['Especialidade'].value_counts().rename_axis('Especialidade').reset_index(name='Quantidade') if 'Especialidade' in df_details.columns else pd.DataFrame()
+    html = f"""<html><head><meta charset="UTF-8"><style>{PDF_CSS}</style></head><body>
+        <h1>Relatório de Teleconsultorias - {municipio}</h1>
+        <p class="periodo">Período: {periodo} &middot; {len(df_details)} teleconsultorias</p>
+        <h2>Performance por Estabelecimento</h2>
+        {summary.to_html(index=False, classes='styled-table', border=0)}
+        <h2>Teleconsultorias por Especialidade</h2>
+        {by_specialty.to_html(index=False, classes='styled-table', border=0)}
+    </body></html>"""
+    return HTML(string=html).write_pdf()
+
+
+def dashboard_report_html(start_date, end_date, kpis_dict, observacao_fluxo, df_perf, figures, images):
+    """Gera uma string HTML completa para o relatório PDF do dashboard; images traz o PNG em base64 de cada gráfico."""
+    df_perf_formatted = df_perf.copy()
+    if 'Percentual Atingido' in df_perf_formatted.columns:
+        df_perf_formatted['Percentual Atingido'] = df_perf_formatted['Percentual Atingido'].map('{:.1f}%'.format)
+    df_perf_html = df_perf_formatted.to_html(index=True, classes='styled-table', border=0)
+    kpi_html_rows = ""
+    for i, kpi_row in enumerate(kpis_dict):
+        kpi_html_rows += '<div class="kpi-container">'
+        for k, v in kpi_row.items():
+            kpi_html_rows += f'<div class="kpi"><div class="kpi-value">{v}</div><div class="kpi-label">{k}</div></div>'
+        kpi_html_rows += '</div>'
+        if i == 2 and observacao_fluxo:
+            kpi_html_rows += f'<div class="observacao">{observacao_fluxo}</div>'
+    html = f"""
+    <html><head><meta charset="UTF-8">
+        <style>
+            @page {{ size: A4 portrait; margin: 1.5cm; }}
+            body {{ font-family: 'Helvetica', sans-serif; color: #333; font-size: 10px;}}
+            h1 {{ text-align: center; color: #33ac47; font-size: 20px;}}
+            h2 {{ color: #33ac47; border-bottom: 1px solid #33ac47; padding-bottom: 5px; margin-top: 25px; font-size: 14px;}}
+            .periodo {{ text-align: center; font-style: italic; color: #555; }}
+            .kpi-container {{ display: flex; flex-wrap: wrap; justify-content: space-around; padding: 8px; background-color: #f8f9fa; border-radius: 5px; margin-bottom: 5px; border: 1px solid #dee2e6; }}
+            .kpi {{ text-align: center; padding: 5px 10px; flex-grow: 1; }}
+            .kpi-value {{ font-size: 18px; font-weight: bold; }}
+            .kpi-label {{ font-size: 10px; color: #6c757d; }}
+            .observacao {{ font-size: 9px; font-style: italic; color: #6c757d; text-align: center; padding: 10px; margin-top: -5px; border: 1px dashed #ccc; border-radius: 5px; background-color: #f8f9fa;}}
+            .styled-table {{ border-collapse: collapse; margin: 15px 0; font-size: 8px; width: 100%; table-layout: fixed; }}
+            .styled-table thead tr {{ background-color: #33ac47; color: #ffffff; text-align: center; }}
+            .styled-table th, .styled-table td {{ padding: 6px 8px; border: 1px solid #ddd; word-wrap: break-word; text-align: left; }}
+            .styled-table td:nth-child(n+3) {{ text-align: center; }}
+            .styled-table tbody tr:nth-of-type(even) {{ background-color: #f3f3f3; }}
+            .chart-container {{ page-break-before: always; text-align: center; margin-top: 20px; }}
+            img {{ max-width: 100%; height: auto; }}
+        </style>
+    </head><body>
+        <h1>Relatório de Análise de Teleconsultorias</h1>
+        <p class="periodo">Período: {start_date.strftime('%d/%m/%Y')} a {end_date.strftime('%d/%m/%Y')}</p>
+        <h2>Indicadores Chave do Período</h2>
+        {kpi_html_rows}
+        <h2>Performance por Estabelecimento</h2>
+        {df_perf_html}
+    """
+    charts_html = ""
+    for title, fig_data in figures.items():
+        if fig_data is not None and fig_data.get('fig') is not None:
+            df_table = fig_data.get('table')
+            img_b64 = images.get(title)
+            if img_b64:
+                charts_html += f'<div class="chart-container"><h2>{title}</h2><img src="data:image/png;base64,{img_b64}">'
+                if df_table is not None and not df_table.empty:
+                    charts_html += df_table.to_html(index=True, classes='styled-table', border=0)
+                charts_html += '</div>'
+    html += charts_html
+    html += "</body></html>"
+    return html
+
+
+def report_file_name(municipio, extension):
+    return f"Relatorio_{str(municipio).replace(' ', '_').replace('/', '-')}.{extension}"
+
+
+def _plain(df):
+    """Troca categóricas por texto, para não serializar dicionários inteiros a cada tarefa do pool."""
+    return df.astype({col: object for col in df.columns[df.dtypes == 'category']})
+
+
+def partition_by_municipio(df_summary, df_details):
+    """Gera (município, resumo, detalhes) com um único groupby em cada tabela, em ordem alfabética."""
+    summary_rows = df_summary.groupby('Municipio Solicitante', observed=True).indices
+    detail_rows = df_details.groupby('Municipio Solicitante', observed=True).indices
+    summary_cols = [c for c in SUMMARY_COLUMNS if c in df_summary.columns]
+    detail_cols = [c for c in DETAIL_COLUMNS if c in df_details.columns]
+    for municipio in sorted(detail_rows, key=str):
+        summary = df_summary.iloc[summary_rows.get(municipio, [])][summary_cols]
+        yield municipio, _plain(summary), _plain(df_details.iloc[detail_rows[municipio]][detail_cols])
+
+
+def build_municipal_reports(municipio, df_summary, df_details, periodo=None, include_pdf=False):
+    """Lista de (nome do arquivo, bytes) do município; roda dentro dos processos do pool."""
+    files = [(report_file_name(municipio, 'xlsx'), to_excel_report_bytes(df_summary, df_details))]
+    if include_pdf:
+        files.append((report_file_name(municipio, 'pdf'), to_pdf_report_bytes(municipio, periodo, df_summary, df_details)))
+    return files
+
+
+def write_reports_zip(target, df_summary, df_details, periodo=None, include_pdf=False, workers=None, max_pending=None, progress=None):
+    """Grava no ZIP target (caminho ou arquivo) os relatórios de todos os municípios presentes em df_details.
+
+    progress(feitos, total, município) é chamado no processo principal a cada
+    município concluído. Retorna o número de municípios.
+    """
+    workers = workers or max(1, (os.cpu_count() or 1) - 1)
+    max_pending = max_pending or 2 * workers
+    partitions = partition_by_municipio(df_summary, df_details)
+    total = int(df_details['Municipio Solicitante'].nunique())
+    done = 0
+    with zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        if workers == 1:
+            for municipio, summary, details in partitions:
+                for name, data in build_municipal_reports(municipio, summary, details, periodo, include_pdf):
+                    archive.writestr(name, data)
+                done += 1
+                if progress:
+                    progress(done, total, municipio)
+            return done
+        # spawn: o processo do Streamlit tem threads, e fork com threads não é seguro.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            pending = {}
+            for municipio, summary, details in partitions:
+                if len(pending) >= max_pending:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        done += _store(archive, future, pending.pop(future), done, total, progress)
+                pending[pool.submit(build_municipal_reports, municipio, summary, details, periodo, include_pdf)] = municipio
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done += _store(archive, future, pending.pop(future), done, total, progress)
+    return done
+
+
+def _store(archive, future, municipio, done, total, progress):
+    for name, data in future.result():
+        archive.writestr(name, data)
+    if progress:
+        progress(done + 1, total, municipio)
+    return 1
+
+
+def _previous_month(today):
+    end = today.replace(day=1) - pd.Timedelta(days=1)
+    return end.replace(day=1), end
+
+
+def main(argv=None):
+    from core.ingestion import read_upload
+    from core.model import count_by
+    from core.preparation import prepare_dataset
+    from core.reference import load_reference_data
+
+    parser = argparse.ArgumentParser(description="Gera os relatórios de todos os municípios num ZIP.")
+    parser.add_argument('arquivo', help="relatório de teleconsultorias (.xls/.xlsx)")
+    parser.add_argument('--saida', default='relatorios_municipios.zip')
+    parser.add_argument('--inicio', help="AAAA-MM-DD (padrão: primeiro dia do mês anterior)")
+    parser.add_argument('--fim', help="AAAA-MM-DD; como no dashboard, o período termina às 00:00 desse dia (padrão: mês anterior inteiro, até o fim do último dia)")
+    parser.add_argument('--pdf', action='store_true', help="gera também um PDF por município")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    refs = load_reference_data(base, os.path.join(base, '.cache', 'referencias'))
+    with open(args.arquivo, 'rb') as f:
+        df_upload, _ = read_upload(f.read(), args.arquivo)
+    df, df_estabelecimentos = prepare_dataset(df_upload, refs)
+    default_start, default_end = _previous_month(pd.Timestamp.today().normalize())
+    start = pd.Timestamp(args.inicio) if args.inicio else default_start
+    if args.fim:
+        end = pd.Timestamp(args.fim)
+        in_period = df['Data_Solicitacao'].between(start, end)  # mesmo período do filtro do dashboard
+    else:  # lote mensal: o último dia do mês entra inteiro
+        end = default_end
+        in_period = (df['Data_Solicitacao'] >= start) & (df['Data_Solicitacao'] < end + pd.Timedelta(days=1))
+    df_period = df[in_period]
+    municipios = df_period['Municipio Solicitante'].dropna().unique()
+    realizado_estab = count_by(df_period, 'Estabelecimento').set_index('Estabelecimento')['count']
+    df_perf = performance_by_establishment(df_estabelecimentos, municipios, realizado_estab)
+    periodo = f"{start.strftime('%d/%m/%Y')} a {end.strftime('%d/%m/%Y')}"
+
+    started = time.perf_counter()
+    def progress(done, total, municipio):
+        print(f"[{done}/{total}] {municipio}", file=sys.stderr)
+    count = write_reports_zip(args.saida, df_perf, df_period, periodo=periodo, include_pdf=args.pdf, workers=args.workers, progress=progress)
+    print(f"{count} municípios ({periodo}) gravados em {args.saida} em {time.perf_counter() - started:.1f} s.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Sketches mescláveis do tempo de resposta: percentis e prazo de 72h sem ordenar as linhas.
+
+Cada tempo de resposta cai num balde de limites geométricos ancorados no
+prazo: o balde k cobre (72·γ^(k-1), 72·γ^k], com γ = (1 + α) / (1 - α), e é
+representado por 2·72·γ^k / (γ + 1), que fica a no máximo α (erro relativo) de
+qualquer valor do balde (a ideia do DDSketch). Um sketch é a contagem por
+balde; mesclar sketches é somar contagens. A tabela 'tempos' do Dataset guarda
+essas contagens por dia x município x especialidade (Monitor, Macro e
+Microrregião vêm junto, pois dependem só do município), com Meia_Noite e
+Data_Ref como no cubo, para que os filtros de período deem o mesmo resultado
+que nas linhas.
+
+Garantias, comparadas ao quantil exato de menor posto (np.quantile com
+method='lower'): erro relativo de no máximo α para tempos entre MIN_HOURS e
+MAX_HOURS; tempos até MIN_HOURS (inclusive negativos, de datas inconsistentes)
+contam como 0 h; acima de MAX_HOURS, como MAX_HOURS. O percentual em até
+SLA_HOURS é exato, pois o prazo é um limite de balde.
+
+Verificação contra as linhas: python -m core.sketches arquivo.xlsx
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+from core.filters import FilterEngine
+
+RELATIVE_ERROR = 0.01
+SLA_HOURS = 72
+MIN_HOURS = 1 / 60  # um minuto
+MAX_HOURS = 2 * 365 * 24
+SKETCH_DIMENSIONS = ['Municipio Solicitante', 'Monitor', 'Macrorregiao', 'Microrregiao', 'Especialidade']
+SUMMARY_QUANTILES = {'P50 (h)': 0.5, 'P90 (h)': 0.9, 'P95 (h)': 0.95}
+SLA_COLUMN = f'Até {SLA_HOURS}h (%)'
+
+GAMMA = (1 + RELATIVE_ERROR) / (1 - RELATIVE_ERROR)
+LOG_GAMMA = np.log(GAMMA)
+MIN_BUCKET = int(np.ceil(np.log(MIN_HOURS / SLA_HOURS) / LOG_GAMMA))
+MAX_BUCKET = int(np.ceil(np.log(MAX_HOURS / SLA_HOURS) / LOG_GAMMA))
+ZERO_BUCKET = MIN_BUCKET - 1
+N_BUCKETS = MAX_BUCKET - ZERO_BUCKET + 1
+# Valor estimado de cada balde, indexado por balde - ZERO_BUCKET.
+BUCKET_VALUES = np.concatenate(([0.0], 2 * SLA_HOURS * GAMMA ** np.arange(MIN_BUCKET, MAX_BUCKET + 1) / (GAMMA + 1)))
+
+
+def bucket_of(hours):
+    """Balde (int16) de cada tempo de resposta em horas; os valores não podem ser nulos."""
+    hours = np.asarray(hours, dtype=float)
+    buckets = np.ceil(np.log(np.maximum(hours, MIN_HOURS) / SLA_HOURS) / LOG_GAMMA)
+    buckets = np.clip(buckets, MIN_BUCKET, MAX_BUCKET)
+    buckets[hours <= MIN_HOURS] = ZERO_BUCKET
+    return buckets.astype(np.int16)
+
+
+def build_response_sketches(df):
+    """Tabela 'tempos': respostas por dia x município x especialidade x balde, com n e Data_Ref."""
+    hours = df['Tempo_Resposta_Horas'] if 'Tempo_Resposta_Horas' in df.columns else pd.Series(np.nan, index=df.index)
+    valid = (df['Data_Solicitacao'].notna() & hours.notna()).to_numpy()
+    rows = df[valid]
+    dims = [c for c in SKETCH_DIMENSIONS if c in df.columns]
+    dia = rows['Data_Solicitacao'].dt.normalize()
+    frame = pd.DataFrame({'Dia': dia, 'Meia_Noite': rows['Data_Solicitacao'].eq(dia), **{d: rows[d] for d in dims}})
+    frame['Balde'] = bucket_of(hours[valid])
+    frame['n'] = np.ones(len(rows), dtype=np.int32)
+    frame['Data_Ref'] = rows['Data_Solicitacao']
+    grouped = frame.groupby(['Dia', 'Meia_Noite', *dims, 'Balde'], observed=True, dropna=False, sort=False)
+    return grouped.agg(n=('n', 'sum'), Data_Ref=('Data_Ref', 'min')).reset_index()
+
+
+def sketch_filter_engine(sketches):
+    return FilterEngine(sketches, columns=[c for c in SKETCH_DIMENSIONS if c in sketches.columns], date_column='Data_Ref')
+
+
+def summarize_buckets(buckets, counts=None, groups=None, labels=None, name='Grupo'):
+    """Respostas, P50/P90/P95 e % em até SLA_HOURS a partir de (balde, contagem) das entradas.
+
+    groups são códigos inteiros por entrada (-1 = sem valor, ignorado) e labels
+    o rótulo de cada código; sem groups, uma única linha com o total.
+    """
+    columns = ([name] if groups is not None else []) + ['Respostas', *SUMMARY_QUANTILES, SLA_COLUMN]
+    offsets = np.asarray(buckets, dtype=np.int64) - ZERO_BUCKET
+    counts = np.ones(len(offsets)) if counts is None else np.asarray(counts, dtype=float)
+    if groups is not None:
+        keep = np.asarray(groups) >= 0
+        present, group_ids = np.unique(np.asarray(groups)[keep], return_inverse=True)
+        offsets, counts = offsets[keep], counts[keep]
+    else:
+        present, group_ids = np.zeros(1, dtype=np.int64), np.zeros(len(offsets), dtype=np.int64)
+    if not counts.sum():
+        return pd.DataFrame(columns=columns)
+    histogram = np.bincount(group_ids * N_BUCKETS + offsets, weights=counts, minlength=len(present) * N_BUCKETS).reshape(len(present), N_BUCKETS)
+    cumulative = histogram.cumsum(axis=1)
+    totals = cumulative[:, -1]
+    result = {} if groups is None else {name: np.asarray(labels, dtype=object)[present]}
+    result['Respostas'] = totals.astype(np.int64)
+    for column, q in SUMMARY_QUANTILES.items():
+        rank = np.floor(q * (totals - 1))  # posto do quantil de menor posto, a partir de 0
+        result[column] = BUCKET_VALUES[(cumulative <= rank[:, None]).sum(axis=1)]
+    result[SLA_COLUMN] = cumulative[:, -ZERO_BUCKET] / totals * 100  # baldes até o 0, inclusive
+    summary = pd.DataFrame(result)
+    return summary.sort_values('Respostas', ascending=False, kind='stable').reset_index(drop=True) if groups is not None else summary
+
+
+def _codes(series, positions):
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype('category')
+    return series.cat.codes.to_numpy()[positions], series.cat.categories
+
+
+def summarize_rows(df, positions, by=None):
+    """Mesmo resumo calculado das linhas (posições de df): baldes por linha, sem ordenação."""
+    hours = df['Tempo_Resposta_Horas'].to_numpy(dtype=float)[positions]
+    valid = ~np.isnan(hours)
+    groups, labels = _codes(df[by], positions[valid]) if by else (None, None)
+    return summarize_buckets(bucket_of(hours[valid]), None, groups, labels, by)
+
+
+def summarize_sketches(sketches, positions, by=None):
+    """Resumo mesclando as entradas da tabela 'tempos' nas posições dadas."""
+    groups, labels = _codes(sketches[by], positions) if by else (None, None)
+    return summarize_buckets(sketches['Balde'].to_numpy()[positions], sketches['n'].to_numpy()[positions], groups, labels, by)
+
+
+def exact_summary(df, positions, by=None):
+    """Referência exata (np.quantile com method='lower') para a verificação; vazia sem respostas."""
+    rows = df.iloc[positions]
+    rows = rows[rows['Tempo_Resposta_Horas'].notna()]
+    hours = rows['Tempo_Resposta_Horas'].clip(upper=MAX_HOURS)
+    groups = [(None, hours)] if by is None else [(label, group) for label, group in hours.groupby(rows[by], observed=True)]
+    result = []
+    for label, values in groups:
+        if values.empty:
+            continue
+        entry = {'Respostas': len(values), **{c: np.quantile(values, q, method='lower') for c, q in SUMMARY_QUANTILES.items()}, SLA_COLUMN: (values <= SLA_HOURS).mean() * 100}
+        result.append(entry if by is None else {by: label, **entry})
+    return pd.DataFrame(result)
+
+
+def check_summary(estimated, exact, by=None):
+    """Maior erro relativo dos percentis estimados; AssertionError se passar de RELATIVE_ERROR ou se contagens/prazo divergirem."""
+    if by is not None:
+        estimated = estimated.set_index(by).sort_index()
+        exact = exact.set_index(by).sort_index()
+        exact.index = exact.index.astype(object)
+    assert list(estimated.index) == list(exact.index) and (estimated['Respostas'].to_numpy() == exact['Respostas'].to_numpy()).all()
+    assert np.allclose(estimated[SLA_COLUMN].to_numpy(dtype=float), exact[SLA_COLUMN].to_numpy(dtype=float))
+    worst = 0.0
+    for column in SUMMARY_QUANTILES:
+        est, ref = estimated[column].to_numpy(dtype=float), exact[column].to_numpy(dtype=float)
+        small = ref <= MIN_HOURS
+        assert (est[small] == 0).all(), column
+        error = np.abs(est[~small] - ref[~small]) / ref[~small]
+        assert (error <= RELATIVE_ERROR * (1 + 1e-9)).all(), (column, error.max())
+        worst = max(worst, float(error.max()) if len(error) else 0.0)
+    return worst
+
+
+def verify_against_rows(df, sketches, n_trials=50, seed=0):
+    """Compara sketches e linhas com o exato em combinações aleatórias de filtros e períodos; retorna o maior erro relativo."""
+    rng = np.random.default_rng(seed)
+    row_engine, sketch_engine = FilterEngine(df), sketch_filter_engine(sketches)
+    start, end = row_engine.date_bounds()
+    days = pd.date_range(start.normalize(), end.normalize(), freq='D')
+    worst = 0.0
+    for _ in range(n_trials):
+        row_mask, sketch_mask = row_engine.all_rows(), sketch_engine.all_rows()
+        for col in rng.choice([c for c in SKETCH_DIMENSIONS if c in sketch_engine], size=2, replace=False):
+            options = row_engine.options(col, row_mask)
+            if options and rng.random() < 0.7:
+                selection = list(rng.choice(options, size=min(len(options), int(rng.integers(1, 6))), replace=False))
+                row_mask &= row_engine.mask_for(col, selection)
+                sketch_mask &= sketch_engine.mask_for(col, selection)
+        lo, hi = sorted(rng.choice(days, size=2))
+        rows = np.flatnonzero(row_mask & row_engine.date_mask(lo, hi))
+        cells = np.flatnonzero(sketch_mask & sketch_engine.date_mask(lo, hi))
+        for by in [None, 'Especialidade', 'Municipio Solicitante']:
+            exact = exact_summary(df, rows, by)
+            if exact.empty:  # período ou filtros sem respostas: as estimativas também devem vir vazias
+                assert summarize_sketches(sketches, cells, by).empty and summarize_rows(df, rows, by).empty
+                continue
+            worst = max(worst, check_summary(summarize_sketches(sketches, cells, by), exact, by))
+            worst = max(worst, check_summary(summarize_rows(df, rows, by), exact, by))
+    return worst
+
+
+if __name__ == '__main__':
+    import os
+    import time
+    from core.ingestion import read_upload
+    from core.preparation import prepare_dataset
+    from core.reference import load_reference_data
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = sys.argv[1]
+    with open(path, 'rb') as f:
+        df_upload, _ = read_upload(f.read(), path)
+    df_prepared, _ = prepare_dataset(df_upload, load_reference_data(base, os.path.join(base, '.cache', 'referencias')))
+    start = time.perf_counter()
+    sketches = build_response_sketches(df_prepared)
+    print(f"Tabela de sketches com {len(sketches)} entradas ({N_BUCKETS} baldes possíveis) para {len(df_prepared)} linhas, montada em {time.perf_counter() - start:.2f} s.")
+    all_rows, all_cells = np.arange(len(df_prepared)), np.arange(len(sketches))
+    for label, fn in [('exato', lambda: exact_summary(df_prepared, all_rows, 'Municipio Solicitante')), ('sketches', lambda: summarize_sketches(sketches, all_cells, 'Municipio Solicitante'))]:
+        start = time.perf_counter()
+        fn()
+        print(f"Percentis por município, {label}: {(time.perf_counter() - start) * 1000:.1f} ms")
+    worst = verify_against_rows(df_prepared, sketches)
+    print(f"Combinações de filtros conferidas: maior erro relativo {worst:.2%} (limite {RELATIVE_ERROR:.0%}); contagens e prazo de {SLA_HOURS}h exatos.")
@@ -0,0 +1,108 @@
+"""Tabelas paginadas no servidor: busca, ordenação e fatia da página sobre o DataFrame filtrado.
+
+Só a página (no máximo MAX_PAGE_SIZE linhas) vai para o navegador, qualquer
+que seja o tamanho do filtro. A busca em colunas categóricas compara o texto
+com as categorias e depois seleciona as linhas pelos códigos, sem converter a
+coluna para texto. Nas datas, o texto exibido (AAAA-MM-DD HH:MM:SS) é
+comparado da mesma forma: formatam-se só os dias do intervalo e os horários
+do dia, e as linhas são selecionadas pelo dia e pelo horário de cada uma. A
+ordenação devolve posições, e a página é um iloc.
+A tabela pode ser uma visão (rows: posições de df), e então só a página e as
+colunas usadas na busca e na ordenação são lidas dessas posições.
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+PAGE_SIZES = [25, 50, 100, 250]
+# Caracteres possíveis no texto de uma data exibida; buscas com outros não olham as colunas de data.
+DATE_SEARCH_CHARS = set('0123456789-: ')
+MAX_PAGE_SIZE = PAGE_SIZES[-1]
+# Faixas do Percentual Atingido: (limite superior exclusivo, classe).
+PERFORMANCE_BANDS = [(50, 'abaixo'), (90, 'atencao'), (np.inf, 'atingido')]
+PERFORMANCE_CSS = {'abaixo': 'background-color: #f8d7da; color: #721c24;', 'atencao': 'background-color: #fff3cd; color: #856404;', 'atingido': 'background-color: #d4edda; color: #33ac47;'}
+
+
+@dataclass
+class TablePage:
+    rows: pd.DataFrame  # índice = número da linha na tabela completa, a partir de 1
+    total: int  # linhas depois da busca
+    page: int
+    pages: int
+
+
+def performance_class(percentual):
+    """Classe de cor de cada Percentual Atingido ('' quando ausente), calculada de uma vez para a coluna."""
+    values = percentual.to_numpy(dtype=float)
+    conditions = [values < limit for limit, _ in PERFORMANCE_BANDS]
+    classes = np.select(conditions, [name for _, name in PERFORMANCE_BANDS], default='')
+    classes[np.isnan(values)] = ''
+    return pd.Series(classes, index=percentual.index)
+
+
+def search_mask(df, text, columns=None, rows=None):
+    """Linhas (de df, ou das posições rows) em que alguma das colunas de texto ou de data contém text (sem diferenciar maiúsculas)."""
+    mask = np.zeros(len(df) if rows is None else len(rows), dtype=bool)
+    search_dates = set(text) <= DATE_SEARCH_CHARS
+    for col in columns if columns is not None else df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            matches = np.flatnonzero(series.cat.categories.astype(str).str.contains(text, case=False, regex=False))
+            codes = series.cat.codes.to_numpy()
+            mask |= np.isin(codes if rows is None else codes[rows], matches)
+        elif pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype):
+            series = series if rows is None else series.iloc[rows]
+            mask |= series.str.contains(text, case=False, regex=False, na=False).to_numpy()
+        elif search_dates and pd.api.types.is_datetime64_dtype(series.dtype):
+            values = series.to_numpy(dtype='datetime64[s]')
+            mask |= _datetime_text_mask(values if rows is None else values[rows], text)
+    return mask
+
+
+@lru_cache(maxsize=1)
+def _times_of_day():
+    """'HH:MM:SS' de cada segundo do dia."""
+    return np.array([s[11:] for s in np.datetime_as_string(np.arange(86_400).astype('datetime64[s]'), unit='s')])
+
+
+def _datetime_text_mask(values, text):
+    """Datas (datetime64[s]) cujo texto exibido contém text; NaT nunca casa."""
+    mask = np.zeros(len(values), dtype=bool)
+    valid = ~np.isnat(values)
+    if not valid.any():
+        return mask
+    seconds = values[valid]
+    days = seconds.astype('datetime64[D]')
+    first = days.min()
+    day_index, time_index = (days - first).astype(np.int64), (seconds - days).astype(np.int64)
+    day_text, time_text = np.datetime_as_string(np.arange(first, days.max() + 1), unit='D'), _times_of_day()
+    hits = (np.char.find(day_text, text) >= 0)[day_index] | (np.char.find(time_text, text) >= 0)[time_index]
+    # Texto que atravessa o espaço entre o dia e o horário: fim do dia + ' ' + começo do horário.
+    for i in (i for i, c in enumerate(text) if c == ' '):
+        hits |= np.char.endswith(day_text, text[:i])[day_index] & np.char.startswith(time_text, text[i + 1:])[time_index]
+    mask[valid] = hits
+    return mask
+
+
+def sorted_positions(df, positions, sort_by, ascending=True, rows=None):
+    """positions reordenadas por sort_by; empates mantêm a ordem original e valores ausentes vão para o fim."""
+    values = df[sort_by].iloc[positions if rows is None else rows[positions]].reset_index(drop=True)
+    order = values.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+    return positions[order]
+
+
+def paginate(df, page=1, page_size=PAGE_SIZES[1], sort_by=None, ascending=True, search='', search_columns=None, rows=None, columns=None):
+    """Página de df (ou da visão rows de df, só com columns) depois da busca e da ordenação; page fora do intervalo é ajustada."""
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    n_rows = len(df) if rows is None else len(rows)
+    positions = np.flatnonzero(search_mask(df, search, search_columns, rows)) if search else np.arange(n_rows)
+    if sort_by is not None:
+        positions = sorted_positions(df, positions, sort_by, ascending, rows)
+    pages = max(1, -(-len(positions) // page_size))
+    page = min(max(1, page), pages)
+    page_positions = positions[(page - 1) * page_size: page * page_size]
+    page_rows = df.iloc[page_positions if rows is None else rows[page_positions], slice(None) if columns is None else df.columns.get_indexer(columns)]
+    page_rows.index = page_positions + 1
+    return TablePage(page_rows, len(positions), page, pages)
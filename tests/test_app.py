@@ -0,0 +1,50 @@
+"""Execução completa do app.py pelo AppTest do Streamlit sobre exportações sintéticas.
+
+    python -m pytest tests
+"""
+import io
+import os
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from benchmarks.synthetic import generate_export, write_export
+from core.reference import load_reference_data
+
+try:
+    import weasyprint  # noqa: F401  (importado pelo app.py)
+except (ImportError, OSError):  # sem as bibliotecas do sistema (pango) o WeasyPrint não carrega
+    pytest.skip("WeasyPrint indisponível neste ambiente", allow_module_level=True)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Upload(io.BytesIO):
+    """Arquivo enviado, com os atributos do UploadedFile usados pelo app."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            super().__init__(f.read())
+        self.name = self.file_id = os.path.basename(path)
+
+
+@pytest.fixture(scope='module')
+def refs():
+    return load_reference_data(BASE_DIR, os.path.join(BASE_DIR, '.cache', 'referencias'))
+
+
+@pytest.mark.parametrize('drop', [[], ['Situação']], ids=['completo', 'sem-situacao'])
+def test_app_renders_upload(refs, drop, tmp_path, monkeypatch):
+    path = str(tmp_path / 'teleconsultorias.xlsx')
+    write_export(generate_export(500, refs).drop(columns=drop), path)
+    upload = Upload(path)
+    monkeypatch.setattr(st, 'file_uploader', lambda *args, **kwargs: upload)
+    monkeypatch.setenv('DASHBOARD_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setenv('DASHBOARD_PROFILE_LOG', '')
+
+    at = AppTest.from_file(os.path.join(BASE_DIR, 'app.py'), default_timeout=300).run()
+
+    assert not at.exception, [e.value for e in at.exception]
+    assert any(m.label == 'Total de Teleconsultorias' for m in at.metric)
+    assert 'Exportar Relatório em PDF' in [h.value for h in at.header]